@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'files.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -131,7 +132,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ]
 }
 
@@ -186,6 +187,14 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Заголовки ответа, доступные фронтенду (метаданные бинарного скачивания)
+CORS_EXPOSE_HEADERS = [
+    'content-disposition',
+    'x-encrypted-aes-key',
+    'x-encryption-iv',
+    'x-file-mime-type',
+]
+
 ALLOWED_HOSTS = ['*']
 
 # Настройки JWT
@@ -194,8 +203,31 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Отзыв refresh токенов при ротации - users.revocation вместо приложения token_blacklist
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.RevocableTokenRefreshSerializer',
 }
 
+# Отозванные refresh токены: фильтр Блума в памяти процесса (емкость и доля
+# ложных срабатываний), как часто подхватывать отзывы из других процессов и
+# пересобирать фильтр без истекших токенов (секунды)
+TOKEN_REVOCATION_BLOOM_CAPACITY = 100000
+TOKEN_REVOCATION_BLOOM_ERROR_RATE = 0.001
+TOKEN_REVOCATION_SYNC_INTERVAL = 1.0
+TOKEN_REVOCATION_REBUILD_INTERVAL = 3600
+
+# Кэш пользователей при аутентификации по JWT (users.authentication.CachedJWTAuthentication):
+# сколько секунд пользователь берется из кэша процесса без запроса к БД и сколько
+# пользователей хранится; AUTH_USER_CACHE_SHARED - дополнительно кэш Django (CACHES)
+AUTH_USER_CACHE_TTL = 30
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_SHARED = False
+
+# Пул для хеширования и проверки паролей (вход и регистрация); при заполнении
+# очереди запрос ждет PASSWORD_HASHING_TIMEOUT секунд и получает ответ 503
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_QUEUE_DEPTH = 8
+PASSWORD_HASHING_TIMEOUT = 0.5
+
 # Session settings
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_HTTPONLY = True
@@ -205,4 +237,85 @@ SESSION_COOKIE_SAMESITE = 'Lax'
 # SECURE_SSL_REDIRECT = False
 # SECURE_HSTS_SECONDS = 31536000
 # SECURE_HSTS_INCLUDE_SUBDOMAINS = True
-# SECURE_HSTS_PRELOAD = True
\ No newline at end of file
+# SECURE_HSTS_PRELOAD = True
+
+# Загрузка файлов по частям (сессии загрузки)
+FILE_UPLOAD_SESSION_TTL = timedelta(hours=24)  # Время жизни неактивной сессии
+FILE_UPLOAD_SESSION_MAX_SIZE = 50 * 1024 ** 3  # Максимальный размер файла (50GB)
+FILE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Размер части по умолчанию
+FILE_UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+FILE_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+FILE_UPLOAD_MAX_ACTIVE_SESSIONS = 16  # Незавершенных сессий на пользователя
+
+# Отдача файлов при скачивании:
+# None - через FileResponse (Django), 'x-accel-redirect' - nginx,
+# 'x-sendfile' - lighttpd/apache (mod_xsendfile)
+FILE_DOWNLOAD_OFFLOAD = None
+FILE_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'  # internal location в nginx, указывающий на MEDIA_ROOT
+
+# Максимальное количество файлов в одном ZIP архиве
+FILE_ARCHIVE_MAX_FILES = 1000
+
+# Размер страницы списка файлов
+FILE_LIST_PAGE_SIZE = 100
+FILE_LIST_MAX_PAGE_SIZE = 1000
+
+# Квота хранилища на пользователя по умолчанию в байтах (None - без ограничения);
+# индивидуальная квота задается в StorageUsage.quota_bytes
+FILE_STORAGE_DEFAULT_QUOTA = None
+
+# Серверное шифрование файлов (загрузка с ?encrypt=server):
+# мастер-ключ в base64 (32 байта); если не задан, выводится из SECRET_KEY
+FILE_SERVER_ENCRYPTION_KEY = None
+# Прежние мастер-ключи (base64) на время перешифрования ключей файлов командой rotate_server_file_keys
+FILE_SERVER_ENCRYPTION_OLD_KEYS = []
+
+# Пул потоков для AES операций при шифровании/расшифровке на сервере
+FILE_CRYPTO_POOL_WORKERS = 4
+FILE_CRYPTO_POOL_QUEUE_DEPTH = 16  # Задач сверх числа потоков, ожидающих в очереди
+FILE_CRYPTO_POOL_TIMEOUT = 30  # Сколько секунд ждать места в очереди до ответа 503
+
+# Перешифрование ключей файлов после смены ключа: файлов в одной пачке
+FILE_KEY_ROTATION_BATCH_SIZE = 500
+FILE_KEY_ROTATION_MAX_BATCH_SIZE = 5000
+
+# Журнал действий пользователей: записи ставятся в очередь и пишутся
+# фоновым потоком пачками. AUDIT_LOG_SINKS: 'jsonl' - файл AUDIT_LOG_PATH
+# в формате JSON Lines, 'db' - таблица AuditEvent, 'logging' - логгер user_actions
+AUDIT_LOG_SINKS = ['jsonl', 'db']
+AUDIT_LOG_PATH = BASE_DIR / 'logs' / 'audit.jsonl'
+AUDIT_LOG_QUEUE_SIZE = 10000
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_FLUSH_INTERVAL = 1.0  # Секунд между записями неполных пачек
+AUDIT_LOG_OVERFLOW = 'drop_oldest'  # 'drop_new', 'drop_oldest' или 'block'
+AUDIT_LOG_BLOCK_TIMEOUT = 0.1  # Для 'block': сколько секунд ждать места в очереди
+AUDIT_LOG_SHUTDOWN_TIMEOUT = 5.0  # Сколько секунд дописывать очередь при завершении процесса
+
+# Журнал аудита в БД: размер страницы API и сроки хранения (команда purge_audit_events)
+AUDIT_LOG_PAGE_SIZE = 100
+AUDIT_LOG_MAX_PAGE_SIZE = 1000
+AUDIT_LOG_RETENTION_DAYS = 90
+AUDIT_LOG_COMPACT_DAYS = 7  # Частые малозначимые события хранятся меньше
+AUDIT_LOG_COMPACT_ACTIONS = ['file.list', 'file.meta']
+
+# Метрики в формате Prometheus (/api/files/metrics/): токен сборщика
+# (Authorization: Bearer <токен>; без токена метрики доступны только
+# администраторам) и каталог снимков процессов при нескольких воркерах
+# (None - один процесс; каталог нужно очищать при перезапуске сервера)
+METRICS_TOKEN = None
+METRICS_MULTIPROCESS_DIR = None
+METRICS_FLUSH_INTERVAL = 5.0  # Секунд между записями снимка процесса
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'user_actions': {'format': '%(asctime)s - %(message)s', 'datefmt': '%Y-%m-%d %H:%M:%S'},
+    },
+    'handlers': {
+        'user_actions': {'class': 'logging.StreamHandler', 'formatter': 'user_actions'},
+    },
+    'loggers': {
+        'user_actions': {'handlers': ['user_actions'], 'level': 'INFO', 'propagate': False},
+    },
+}
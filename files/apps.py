@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def restore_filename_search(sender, using, **kwargs):
+    """Пересоздание таблицы в SQLite миграциями удаляет триггеры FTS"""
+    from django.db import connections
+    from .search import install_fts
+    install_fts(connections[using], repair_only=True)
 
 
 class FilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'files'
+
+    def ready(self):
+        post_migrate.connect(restore_filename_search, sender=self)
@@ -0,0 +1,107 @@
+import base64
+import json
+import os
+import zipfile
+
+from django.utils import timezone
+
+from .server_encryption import ENCRYPTION_SERVER, decrypted_reader
+from .storage import stored_file_path
+
+# Размер блока при чтении файлов, добавляемых в архив
+BLOCK_SIZE = 64 * 1024
+
+# Имя служебного файла с описанием содержимого архива
+MANIFEST_NAME = 'manifest.json'
+
+
+class _StreamBuffer:
+    """
+    Неперематываемый поток для zipfile: записанные байты забирает
+    генератор ответа, поэтому в памяти хранится только последний блок.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _unique_name(filename, used_names):
+    """Имя записи в архиве, не совпадающее с уже добавленными"""
+    name = filename.replace('\\', '/').lstrip('/') or 'file'
+    base, extension = os.path.splitext(name)
+    counter = 1
+    while name in used_names:
+        name = f"{base} ({counter}){extension}"
+        counter += 1
+    used_names.add(name)
+    return name
+
+
+def _read_blocks(path):
+    with open(path, 'rb') as source:
+        yield from iter(lambda: source.read(BLOCK_SIZE), b'')
+
+
+def stream_zip(file_instances):
+    """
+    Генератор ZIP архива из файлов пользователя. Записи сохраняются без
+    сжатия (файлы уже сжаты или зашифрованы) и с поддержкой ZIP64, архив
+    отдается по мере формирования, без временных файлов.
+    Для зашифрованных файлов в manifest.json кладутся ключ и IV.
+    """
+    buffer = _StreamBuffer()
+    used_names = {MANIFEST_NAME}
+    manifest = []
+
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for file_instance in file_instances:
+            path = stored_file_path(file_instance.file.name) if file_instance.file else None
+            if not path or not os.path.exists(path):
+                manifest.append({'file_id': file_instance.id, 'filename': file_instance.filename, 'missing': True})
+                continue
+
+            name = _unique_name(file_instance.filename, used_names)
+            uploaded_at = timezone.localtime(file_instance.uploaded_at) if file_instance.uploaded_at else timezone.localtime()
+            entry = zipfile.ZipInfo(name, date_time=uploaded_at.timetuple()[:6])
+            entry.compress_type = zipfile.ZIP_STORED
+
+            # Файлы, зашифрованные на сервере, попадают в архив расшифрованными
+            if file_instance.encryption_mode == ENCRYPTION_SERVER:
+                entry.file_size = file_instance.size
+                blocks = decrypted_reader(file_instance)(0, file_instance.size - 1)
+            else:
+                entry.file_size = os.path.getsize(path)
+                blocks = _read_blocks(path)
+
+            with archive.open(entry, mode='w', force_zip64=True) as target:
+                for block in blocks:
+                    target.write(block)
+                    yield buffer.pop()
+            yield buffer.pop()
+
+            item = {'file_id': file_instance.id, 'filename': file_instance.filename, 'name': name,
+                    'size': entry.file_size, 'is_encrypted': file_instance.is_encrypted}
+            if file_instance.is_encrypted and file_instance.encrypted_aes_key and file_instance.iv:
+                item['encrypted_aes_key'] = base64.b64encode(file_instance.encrypted_aes_key).decode('utf-8')
+                item['iv'] = base64.b64encode(file_instance.iv).decode('utf-8')
+            manifest.append(item)
+
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+    yield buffer.pop()
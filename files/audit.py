@@ -0,0 +1,82 @@
+from .filters import PREFIX_UPPER_BOUND, parse_int, parse_moment
+
+# Коды действий журнала аудита по тексту действия из log_user_action.
+# Код хранится в AuditEvent.action и используется в фильтрах; текст
+# действия остается в AuditEvent.message.
+ACTION_CODES = {
+    # Загрузка файлов
+    "Файл успешно загружен": 'file.upload',
+    "Попытка загрузки файла": 'file.upload.rejected',
+    "Попытка загрузки зашифрованного файла": 'file.upload.rejected',
+    "Ошибка при загрузке файла": 'file.upload.error',
+    "Ошибка при загрузке зашифрованного файла": 'file.upload.error',
+    "Ошибка при сохранении записи файла": 'file.upload.error',
+    # Загрузка по частям
+    "Создана сессия загрузки": 'upload_session.create',
+    "Попытка создания сессии загрузки": 'upload_session.rejected',
+    "Ошибка при создании сессии загрузки": 'upload_session.error',
+    "Попытка загрузки части": 'upload_session.chunk.rejected',
+    "Ошибка при загрузке части": 'upload_session.chunk.error',
+    "Попытка завершения загрузки": 'upload_session.complete.rejected',
+    "Ошибка при завершении загрузки": 'upload_session.complete.error',
+    "Сессия загрузки отменена": 'upload_session.abort',
+    # Список, метаданные и скачивание
+    "Получен список файлов": 'file.list',
+    "Получены метаданные файла": 'file.meta',
+    "Попытка получения метаданных": 'file.meta.rejected',
+    "Файл успешно скачан": 'file.download',
+    "Зашифрованный файл отправлен для расшифровки на клиенте": 'file.download',
+    "Файл подготовлен для расшифровки на клиенте": 'file.download',
+    "Попытка скачивания файла": 'file.download.rejected',
+    "Попытка скачивания зашифрованного файла": 'file.download.rejected',
+    "Ошибка при чтении файла": 'file.download.error',
+    "Ошибка при скачивании файла": 'file.download.error',
+    "Ошибка при подготовке зашифрованного файла": 'file.download.error',
+    "Скачивание архива": 'file.archive',
+    "Попытка скачивания архива": 'file.archive.rejected',
+    # Удаление
+    "Файл успешно удален": 'file.delete',
+    "Попытка удаления файла": 'file.delete.rejected',
+    "Ошибка при удалении файла": 'file.delete.error',
+    # Ключи
+    "Обновлен публичный ключ": 'keys.update',
+    "Попытка обновления публичного ключа": 'keys.update.rejected',
+    "Ошибка при обработке публичного ключа": 'keys.update.error',
+    "Ошибка при обновлении публичного ключа": 'keys.update.error',
+    "Попытка получения публичного ключа": 'keys.get.rejected',
+    "Ошибка при получении публичного ключа": 'keys.get.error',
+    "Начато перешифрование ключей файлов": 'keys.rotation.start',
+    "Перешифрованы ключи файлов": 'keys.rotation.batch',
+    "Попытка перешифрования ключей": 'keys.rotation.rejected',
+}
+
+# Код для действий, которых нет в ACTION_CODES
+DEFAULT_ACTION_CODE = 'other'
+
+
+def action_code(action):
+    return ACTION_CODES.get(action, DEFAULT_ACTION_CODE)
+
+
+def filter_audit_events(queryset, params):
+    """
+    Применяет к журналу аудита фильтры из параметров запроса: action
+    (код действия; с '*' на конце - префикс кода, например file.upload*),
+    file_id, since и until.
+    """
+    action = params.get('action')
+    if action:
+        if action.endswith('*'):
+            # Диапазон вместо LIKE, чтобы использовать индекс (action, timestamp, id)
+            prefix = action[:-1]
+            queryset = queryset.filter(action__gte=prefix, action__lt=prefix + PREFIX_UPPER_BOUND)
+        else:
+            queryset = queryset.filter(action=action)
+
+    if params.get('file_id'):
+        queryset = queryset.filter(file_id=parse_int('file_id', params['file_id']))
+    if params.get('since'):
+        queryset = queryset.filter(timestamp__gte=parse_moment('since', params['since']))
+    if params.get('until'):
+        queryset = queryset.filter(timestamp__lte=parse_moment('until', params['until'], end_of_day=True))
+    return queryset
@@ -0,0 +1,90 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from .models import FileBlob
+from .storage import blob_storage_name, delete_stored_file, move_stored_file
+from .usage import release_usage
+
+
+@contextmanager
+def atomic_blob_store():
+    """
+    transaction.atomic() для сохранения файлов в общее хранилище. Выдает
+    список, который передается в store_blob: если транзакция откатывается,
+    перенесенные в blobs/ файлы возвращаются под исходные имена.
+    """
+    moves = []
+    try:
+        with transaction.atomic():
+            yield moves
+    except BaseException:
+        for source, target in reversed(moves):
+            move_stored_file(target, source)
+        raise
+
+
+def store_blob(storage_name, sha256, size, moves):
+    """
+    Переносит записанный файл в общее хранилище содержимого.
+    Если такое содержимое уже хранится, новый файл удаляется после
+    фиксации транзакции, а у существующего увеличивается счетчик ссылок.
+    Возвращает FileBlob. Вызывается внутри atomic_blob_store вместе с
+    сохранением EncryptedFile; moves - выданный им список.
+    """
+    with transaction.atomic():
+        while True:
+            blob, created = FileBlob.objects.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={'file': blob_storage_name(sha256), 'size': size, 'ref_count': 1}
+            )
+            # Запись могла быть удалена вместе с последней ссылкой после чтения
+            # (на SQLite select_for_update ничего не блокирует): тогда создаем ее заново
+            if created or FileBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+                break
+
+        if created or not os.path.exists(default_storage.path(blob.file.name)):
+            move_stored_file(storage_name, blob.file.name)
+            moves.append((storage_name, blob.file.name))
+        else:
+            transaction.on_commit(lambda: delete_stored_file(storage_name))
+    return blob
+
+
+def delete_encrypted_file(file_instance):
+    """
+    Удаляет запись файла вместе с его содержимым на диске и уменьшает
+    занятое пользователем место. Содержимое из общего хранилища
+    удаляется только вместе с последней ссылкой на него.
+    """
+    blob_id = file_instance.blob_id
+    storage_name = file_instance.file.name if file_instance.file else None
+    trash_name = None
+
+    try:
+        with transaction.atomic():
+            file_instance.delete()
+            release_usage(file_instance.user_id, file_instance.size)
+            if blob_id is not None:
+                FileBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+                released, _ = FileBlob.objects.filter(pk=blob_id, ref_count__lte=0).delete()
+                if released and storage_name:
+                    # Файл содержимого убирается с пути blobs/ до фиксации: после нее
+                    # store_blob может создать запись с тем же SHA-256 и положить
+                    # по этому пути новый файл, который удалять уже нельзя
+                    trash_name = f'{storage_name}.deleted-{uuid.uuid4().hex}'
+                    try:
+                        move_stored_file(storage_name, trash_name)
+                    except FileNotFoundError:
+                        trash_name = None
+                storage_name = trash_name
+    except BaseException:
+        if trash_name:
+            move_stored_file(trash_name, file_instance.file.name)
+        raise
+
+    delete_stored_file(storage_name)
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class CryptoPoolBusy(Exception):
+    """Очередь пула переполнена дольше допустимого времени ожидания"""
+
+
+class CryptoPool:
+    """
+    Ограниченный пул потоков для AES операций. cryptography отпускает GIL
+    на время шифрования, поэтому сегменты шифруются параллельно, пока поток
+    запроса читает или пишет следующие. Одновременно в пуле находится не
+    больше workers + queue_depth задач; при заполнении submit ждет
+    освобождения места не дольше timeout секунд.
+    """
+
+    def __init__(self, workers, queue_depth, timeout, pipeline_depth=None, name='crypto'):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        # Сколько сегментов одного потока данных может находиться в пуле
+        self.pipeline_depth = pipeline_depth or max(2, min(workers, 4))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._waited = 0
+        self._rejected = 0
+        self._wait_seconds = 0.0
+        self._busy_seconds = 0.0
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            # Пул насыщен: ждем свободного места (обратное давление на запрос)
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self._waited += 1
+                self._wait_seconds += time.monotonic() - started
+                if not acquired:
+                    self._rejected += 1
+            if not acquired:
+                raise CryptoPoolBusy()
+
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            future = self._executor.submit(self._run, fn, args)
+        except Exception:
+            self._release(None)
+            raise
+        # Место освобождается и для отмененных задач, которые не запускались
+        future.add_done_callback(self._release)
+        return future
+
+    def map_ordered(self, fn, iterable, window=None):
+        """
+        Аналог map: применяет fn к элементам iterable в пуле и выдает
+        результаты в исходном порядке, держа в пуле не больше window задач.
+        """
+        window = window or self.pipeline_depth
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(self.submit(fn, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @property
+    def saturated(self):
+        """Заняты все рабочие потоки и вся очередь"""
+        return self._in_flight >= self.workers + self.queue_depth
+
+    def stats(self):
+        """Метрики загрузки и насыщения пула"""
+        with self._lock:
+            in_flight = self._in_flight
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'in_flight': in_flight,
+                'queued': max(in_flight - self.workers, 0),
+                'peak_in_flight': self._peak_in_flight,
+                'utilization': min(in_flight / self.workers, 1.0),
+                'saturation': in_flight / (self.workers + self.queue_depth),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'waited': self._waited,
+                'rejected': self._rejected,
+                'wait_seconds_total': round(self._wait_seconds, 6),
+                'busy_seconds_total': round(self._busy_seconds, 6),
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, fn, args):
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._busy_seconds += time.monotonic() - started
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future is not None and not future.cancelled():
+                self._completed += 1
+        self._slots.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Общий пул процесса, создается при первом обращении по настройкам"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CryptoPool(
+                    workers=settings.FILE_CRYPTO_POOL_WORKERS,
+                    queue_depth=settings.FILE_CRYPTO_POOL_QUEUE_DEPTH,
+                    timeout=settings.FILE_CRYPTO_POOL_TIMEOUT,
+                )
+    return _pool
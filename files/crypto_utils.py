@@ -2,10 +2,20 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives import padding as sym_padding
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
 import base64
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 
+from .metrics import CRYPTO_SECONDS, timed
 
+
+@timed(CRYPTO_SECONDS, operation='rsa_generate')
 def generate_rsa_key_pair():
     """Генерирует новую пару RSA ключей"""
     private_key = rsa.generate_private_key(
@@ -43,53 +53,129 @@ def generate_aes_key():
     return key, iv
 
 
+# Максимальное число разобранных ключей в кэше
+KEY_CACHE_SIZE = 256
+
+RSA_OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+
+def key_fingerprint(key_pem):
+    """Отпечаток ключа в PEM (SHA-256) - ключ кэша разобранных ключей"""
+    return hashlib.sha256(bytes(key_pem)).hexdigest()
+
+
+class _KeyCache:
+    """
+    Ограниченный LRU кэш разобранных ключей по отпечатку PEM: разбор
+    приватного RSA ключа (с проверками согласованности) занимает
+    миллисекунды, а один и тот же ключ используется многократно.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_pem, loader):
+        key_pem = bytes(key_pem)
+        fingerprint = key_fingerprint(key_pem)
+        with self._lock:
+            key = self._keys.get(fingerprint)
+            if key is not None:
+                self._keys.move_to_end(fingerprint)
+                self.hits += 1
+                return key
+            self.misses += 1
+        # Разбор выполняется вне блокировки; повторный разбор при гонке безвреден
+        key = loader(key_pem, backend=default_backend())
+        with self._lock:
+            self._keys[fingerprint] = key
+            self._keys.move_to_end(fingerprint)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        return key
+
+    def invalidate(self, key_pem):
+        with self._lock:
+            self._keys.pop(key_fingerprint(key_pem), None)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._keys), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+_key_cache = _KeyCache(KEY_CACHE_SIZE)
+
+
+def load_public_key(public_key_pem):
+    """Разобранный публичный ключ из PEM (через кэш)"""
+    return _key_cache.get(public_key_pem, serialization.load_pem_public_key)
+
+
+def load_private_key(private_key_pem):
+    """Разобранный приватный ключ из PEM (через кэш)"""
+    return _key_cache.get(
+        private_key_pem,
+        lambda data, backend: serialization.load_pem_private_key(data, password=None, backend=backend)
+    )
+
+
+def invalidate_cached_key(key_pem):
+    """Удаляет ключ из кэша (например, когда пользователь заменил ключ)"""
+    if key_pem:
+        _key_cache.invalidate(key_pem)
+
+
+def key_cache_stats():
+    return _key_cache.stats()
+
+
+@timed(CRYPTO_SECONDS, operation='rsa_encrypt')
 def encrypt_aes_key(aes_key_data, public_key_pem):
     """Шифрует AES ключ и IV с использованием публичного ключа RSA"""
-    public_key = serialization.load_pem_public_key(
-        public_key_pem,
-        backend=default_backend()
-    )
-    
-    encrypted_key = public_key.encrypt(
-        aes_key_data,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    
-    return encrypted_key
+    return load_public_key(public_key_pem).encrypt(aes_key_data, RSA_OAEP_PADDING)
 
 
+@timed(CRYPTO_SECONDS, operation='rsa_decrypt')
 def decrypt_aes_key(encrypted_aes_key, private_key_pem):
     """Дешифрует AES ключ с использованием приватного ключа RSA"""
-    private_key = serialization.load_pem_private_key(
-        private_key_pem,
-        password=None,
-        backend=default_backend()
-    )
-    
-    decrypted_key = private_key.decrypt(
-        encrypted_aes_key,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    
-    return decrypted_key
+    return load_private_key(private_key_pem).decrypt(encrypted_aes_key, RSA_OAEP_PADDING)
+
+
+@timed(CRYPTO_SECONDS, operation='rsa_encrypt_batch')
+def wrap_aes_keys(aes_keys, public_key_pem):
+    """Шифрует список AES ключей одним публичным ключом (ключ разбирается один раз)"""
+    public_key = load_public_key(public_key_pem)
+    return [public_key.encrypt(aes_key, RSA_OAEP_PADDING) for aes_key in aes_keys]
+
+
+@timed(CRYPTO_SECONDS, operation='rsa_decrypt_batch')
+def unwrap_aes_keys(encrypted_aes_keys, private_key_pem):
+    """Расшифровывает список AES ключей одним приватным ключом"""
+    private_key = load_private_key(private_key_pem)
+    aes_keys = []
+    for index, encrypted_aes_key in enumerate(encrypted_aes_keys):
+        try:
+            aes_keys.append(private_key.decrypt(bytes(encrypted_aes_key), RSA_OAEP_PADDING))
+        except ValueError:
+            raise ValueError(f"Не удалось расшифровать ключ №{index}")
+    return aes_keys
 
 
 def import_public_key(public_key_data):
     """Импортирует публичный ключ из base64 строки"""
     try:
-        key_bytes = base64.b64decode(public_key_data)
-        return serialization.load_pem_public_key(
-            key_bytes,
-            backend=default_backend()
-        )
+        return load_public_key(base64.b64decode(public_key_data))
     except Exception as e:
         raise ValueError(f"Ошибка импорта публичного ключа: {str(e)}")
 
@@ -97,12 +183,7 @@ def import_public_key(public_key_data):
 def import_private_key(private_key_data):
     """Импортирует приватный ключ из base64 строки"""
     try:
-        key_bytes = base64.b64decode(private_key_data)
-        return serialization.load_pem_private_key(
-            key_bytes,
-            password=None,
-            backend=default_backend()
-        )
+        return load_private_key(base64.b64decode(private_key_data))
     except Exception as e:
         raise ValueError(f"Ошибка импорта приватного ключа: {str(e)}")
 
@@ -126,6 +207,7 @@ def export_private_key(private_key):
     return base64.b64encode(private_pem).decode('utf-8')
 
 
+@timed(CRYPTO_SECONDS, operation='cbc_encrypt')
 def encrypt_file_content(file_content, public_key_pem):
     """Шифрует содержимое файла с использованием гибридного шифрования RSA+AES"""
     try:
@@ -146,16 +228,13 @@ def encrypt_file_content(file_content, public_key_pem):
         )
         encryptor = cipher.encryptor()
         
-        # Добавляем padding (PKCS7)
-        block_size = algorithms.AES.block_size // 8  # в байтах
-        padding_length = block_size - (len(file_content) % block_size)
-        if padding_length == 0:
-            padding_length = block_size
-        
-        padded_data = file_content + bytes([padding_length] * padding_length)
-        
-        # Шифруем данные
-        encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
+        # Добавляем padding (PKCS7) и шифруем данные
+        padder = sym_padding.PKCS7(algorithms.AES.block_size).padder()
+        encrypted_data = (
+            encryptor.update(padder.update(file_content))
+            + encryptor.update(padder.finalize())
+            + encryptor.finalize()
+        )
         
         return {
             'encrypted_data': encrypted_data,
@@ -167,11 +246,15 @@ def encrypt_file_content(file_content, public_key_pem):
         raise Exception(f"Ошибка при шифровании файла: {str(e)}")
 
 
+@timed(CRYPTO_SECONDS, operation='cbc_decrypt')
 def decrypt_file_content(encrypted_data, encrypted_aes_key, iv, private_key_pem):
     """Дешифрует содержимое файла с использованием гибридного шифрования RSA+AES"""
     try:
         # Расшифровка AES ключа
         aes_key = decrypt_aes_key(encrypted_aes_key, private_key_pem)
+        # encrypt_file_content шифрует ключ вместе с IV (32 + 16 байт)
+        if len(aes_key) == 48:
+            aes_key = aes_key[:32]
         if len(aes_key) != 32:  # AES-256 ключ должен быть 32 байта
             raise ValueError("Неверный формат AES ключа")
         
@@ -183,21 +266,232 @@ def decrypt_file_content(encrypted_data, encrypted_aes_key, iv, private_key_pem)
         )
         decryptor = cipher.decryptor()
         
-        # Дешифруем данные
-        padded_data = decryptor.update(encrypted_data) + decryptor.finalize()
-        
-        # Проверяем padding
-        padding_length = padded_data[-1]
-        if padding_length > 16 or padding_length == 0:  # AES block size = 16 bytes
-            raise ValueError("Неверный padding")
-            
-        # Проверяем, что все байты padding одинаковые
-        if not all(x == padding_length for x in padded_data[-padding_length:]):
+        # Дешифруем данные и проверяем/удаляем padding (PKCS7)
+        unpadder = sym_padding.PKCS7(algorithms.AES.block_size).unpadder()
+        try:
+            data = unpadder.update(decryptor.update(encrypted_data) + decryptor.finalize()) + unpadder.finalize()
+        except ValueError:
             raise ValueError("Неверный формат padding")
-            
-        # Удаляем padding
-        data = padded_data[:-padding_length]
         
         return data
     except Exception as e:
-        raise Exception(f"Ошибка при дешифровании файла: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Ошибка при дешифровании файла: {str(e)}")
+
+
+# Потоковый формат с аутентифицированным шифрованием (AES-256-GCM по сегментам).
+#
+# Заголовок: MAGIC (5 байт) | версия (1 байт) | размер сегмента (4 байта, BE) |
+#            префикс nonce (7 байт)
+# Далее сегменты: шифротекст до segment_size байт открытого текста + тег 16 байт.
+# Nonce сегмента: префикс (7) | номер сегмента (4, BE) | признак последнего (1).
+# Заголовок передается как associated data, поэтому подмена заголовка,
+# перестановка, удаление и усечение сегментов обнаруживаются при расшифровке.
+CHUNKED_MAGIC = b'FMENC'
+CHUNKED_VERSION = 1
+CHUNKED_HEADER_SIZE = len(CHUNKED_MAGIC) + 1 + 4 + 7
+CHUNKED_TAG_SIZE = 16
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+MAX_SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+def segment_nonce(nonce_prefix, index, last):
+    """Nonce сегмента: префикс | номер сегмента | признак последнего сегмента"""
+    return nonce_prefix + index.to_bytes(4, 'big') + (b'\x01' if last else b'\x00')
+
+
+def _read_exactly(source, size):
+    data = source.read(size)
+    while data is not None and len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data or b''
+
+
+def is_chunked_format(header):
+    """Проверяет, что данные начинаются с заголовка потокового формата"""
+    return header[:len(CHUNKED_MAGIC)] == CHUNKED_MAGIC
+
+
+def new_chunked_header(segment_size=DEFAULT_SEGMENT_SIZE):
+    """Создает заголовок потокового формата со случайным префиксом nonce"""
+    if not 0 < segment_size <= MAX_SEGMENT_SIZE:
+        raise ValueError("Неверный размер сегмента")
+    nonce_prefix = os.urandom(7)
+    header = CHUNKED_MAGIC + bytes([CHUNKED_VERSION]) + segment_size.to_bytes(4, 'big') + nonce_prefix
+    return header, nonce_prefix
+
+
+def parse_chunked_header(header):
+    """Разбирает заголовок потокового формата: (размер сегмента, префикс nonce)"""
+    if len(header) != CHUNKED_HEADER_SIZE or not is_chunked_format(header):
+        raise ValueError("Неверный заголовок зашифрованного файла")
+    version = header[len(CHUNKED_MAGIC)]
+    if version != CHUNKED_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата: {version}")
+    segment_size = int.from_bytes(header[len(CHUNKED_MAGIC) + 1:len(CHUNKED_MAGIC) + 5], 'big')
+    if not 0 < segment_size <= MAX_SEGMENT_SIZE:
+        raise ValueError("Неверный размер сегмента")
+    return segment_size, header[len(CHUNKED_MAGIC) + 5:]
+
+
+def chunked_ciphertext_size(plaintext_size, segment_size=DEFAULT_SEGMENT_SIZE):
+    """Размер зашифрованного файла в потоковом формате"""
+    segments = max(1, -(-plaintext_size // segment_size))
+    return CHUNKED_HEADER_SIZE + plaintext_size + segments * CHUNKED_TAG_SIZE
+
+
+def chunked_plaintext_size(ciphertext_size, segment_size):
+    """Размер открытого текста по размеру файла в потоковом формате"""
+    body = ciphertext_size - CHUNKED_HEADER_SIZE
+    full_segments, rest = divmod(body, segment_size + CHUNKED_TAG_SIZE)
+    if rest and rest < CHUNKED_TAG_SIZE or body < CHUNKED_TAG_SIZE:
+        raise ValueError("Неверный размер зашифрованного файла")
+    return full_segments * segment_size + (rest - CHUNKED_TAG_SIZE if rest else 0)
+
+
+@timed(CRYPTO_SECONDS, operation='gcm_encrypt_segment')
+def encrypt_segment(aesgcm, nonce, segment, header):
+    """Шифрует один сегмент потокового формата"""
+    return aesgcm.encrypt(nonce, segment, header)
+
+
+@timed(CRYPTO_SECONDS, operation='gcm_decrypt_segment')
+def decrypt_segment(aesgcm, nonce, encrypted, header):
+    """Расшифровывает и проверяет один сегмент потокового формата"""
+    return aesgcm.decrypt(nonce, encrypted, header)
+
+
+def encrypt_stream(source, aes_key, segment_size=DEFAULT_SEGMENT_SIZE, map_segments=map):
+    """
+    Генератор: шифрует файловый объект source сегментами AES-GCM и
+    выдает заголовок и зашифрованные сегменты. map_segments - упорядоченный
+    map, которым сегменты отдаются на шифрование (например, пулу потоков);
+    в памяти держится ограниченное число сегментов.
+    """
+    header, nonce_prefix = new_chunked_header(segment_size)
+    aesgcm = AESGCM(aes_key)
+    yield header
+
+    def segments():
+        index = 0
+        segment = _read_exactly(source, segment_size)
+        while True:
+            # Читаем следующий сегмент заранее, чтобы знать, какой из них последний
+            next_segment = _read_exactly(source, segment_size) if len(segment) == segment_size else b''
+            last = not next_segment
+            yield segment_nonce(nonce_prefix, index, last), segment
+            if last:
+                return
+            segment = next_segment
+            index += 1
+
+    yield from map_segments(lambda item: encrypt_segment(aesgcm, item[0], item[1], header), segments())
+
+
+def decrypt_stream(source, aes_key, start=0, end=None, map_segments=map):
+    """
+    Генератор: расшифровывает файл потокового формата. Для диапазона
+    [start, end] открытого текста (end включительно) читаются только
+    покрывающие его сегменты; source должен поддерживать seek.
+    """
+    source.seek(0)
+    header = _read_exactly(source, CHUNKED_HEADER_SIZE)
+    segment_size, nonce_prefix = parse_chunked_header(header)
+    ciphertext_size = source.seek(0, os.SEEK_END)
+    plaintext_size = chunked_plaintext_size(ciphertext_size, segment_size)
+    aesgcm = AESGCM(aes_key)
+    last_index = max(0, -(-plaintext_size // segment_size) - 1)
+
+    def decrypt(item):
+        index, encrypted = item
+        try:
+            return decrypt_segment(aesgcm, segment_nonce(nonce_prefix, index, index == last_index), encrypted, header)
+        except InvalidTag:
+            raise ValueError(f"Сегмент {index} поврежден или подменен")
+
+    if end is None or end >= plaintext_size:
+        end = plaintext_size - 1
+    if start > end:
+        # Пустой диапазон; пустой файл все равно проверяется по тегу
+        if plaintext_size == 0:
+            source.seek(CHUNKED_HEADER_SIZE)
+            decrypt((0, _read_exactly(source, CHUNKED_TAG_SIZE)))
+        return
+
+    stored_segment_size = segment_size + CHUNKED_TAG_SIZE
+    indexes = range(start // segment_size, end // segment_size + 1)
+
+    def segments():
+        source.seek(CHUNKED_HEADER_SIZE + indexes[0] * stored_segment_size)
+        for index in indexes:
+            yield index, _read_exactly(source, stored_segment_size)
+
+    for index, segment in zip(indexes, map_segments(decrypt, segments())):
+        segment_start = index * segment_size
+        yield segment[max(start - segment_start, 0):end - segment_start + 1]
+
+
+def decrypt_cbc_stream(source, aes_key, iv, block_size=64 * 1024):
+    """Генератор: потоковая расшифровка файлов старого формата AES-CBC + PKCS7"""
+    decryptor = Cipher(algorithms.AES(aes_key), modes.CBC(iv), backend=default_backend()).decryptor()
+    unpadder = sym_padding.PKCS7(algorithms.AES.block_size).unpadder()
+    for block in iter(lambda: source.read(block_size), b''):
+        data = unpadder.update(decryptor.update(block))
+        if data:
+            yield data
+    yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
+
+
+def decrypt_file_stream(source, aes_key, iv=None, start=0, end=None, map_segments=map):
+    """
+    Расшифровывает файл любого поддерживаемого формата: потокового
+    (AES-GCM по сегментам, с произвольным доступом) или старого AES-CBC.
+    """
+    source.seek(0)
+    header = _read_exactly(source, CHUNKED_HEADER_SIZE)
+    if is_chunked_format(header):
+        return decrypt_stream(source, aes_key, start, end, map_segments)
+    if iv is None:
+        raise ValueError("Для файла в формате AES-CBC нужен IV")
+    source.seek(0)
+    stream = decrypt_cbc_stream(source, aes_key, iv)
+    if start or end is not None:
+        return _slice_stream(stream, start, end)
+    return stream
+
+
+def _slice_stream(stream, start, end):
+    """Диапазон [start, end] из последовательного потока (для формата CBC)"""
+    position = 0
+    for data in stream:
+        data_start, position = position, position + len(data)
+        if position <= start:
+            continue
+        if end is not None and data_start > end:
+            break
+        yield data[max(start - data_start, 0):(end - data_start + 1) if end is not None else None]
+
+
+def derive_key(secret, info, length=32):
+    """Выводит ключ заданной длины из секрета (HKDF-SHA256)"""
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=None, info=info).derive(secret)
+
+
+@timed(CRYPTO_SECONDS, operation='key_wrap')
+def wrap_key(master_key, key, context=b''):
+    """Шифрует ключ файла мастер-ключом (AES-GCM); context привязывает ключ к владельцу"""
+    nonce = os.urandom(12)
+    return nonce + AESGCM(master_key).encrypt(nonce, key, context)
+
+
+@timed(CRYPTO_SECONDS, operation='key_unwrap')
+def unwrap_key(master_key, wrapped_key, context=b''):
+    """Расшифровывает ключ файла, зашифрованный wrap_key"""
+    try:
+        return AESGCM(master_key).decrypt(wrapped_key[:12], wrapped_key[12:], context)
+    except InvalidTag:
+        raise ValueError("Неверный мастер-ключ или поврежденный ключ файла")
@@ -0,0 +1,233 @@
+import os
+import re
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from .metrics import OFFLOADED_BYTES
+
+# Максимальное количество диапазонов в одном запросе Range
+MAX_RANGES = 16
+
+# Размер блока при чтении диапазонов файла
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    """Ни один из запрошенных диапазонов не попадает в файл"""
+
+
+def file_etag(file_instance):
+    """Строгий ETag содержимого файла (содержимое записи не меняется)"""
+    if file_instance.sha256:
+        return quote_etag(file_instance.sha256)
+    uploaded = int(file_instance.uploaded_at.timestamp()) if file_instance.uploaded_at else 0
+    return quote_etag(f"{file_instance.id}-{file_instance.size}-{uploaded}")
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range (RFC 9110) для файла размера size.
+    Возвращает список диапазонов (start, end) включительно либо None,
+    если заголовок синтаксически неверен и должен быть проигнорирован.
+    """
+    units, _, ranges_spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not ranges_spec:
+        return None
+
+    ranges = []
+    for spec in ranges_spec.split(','):
+        match = RANGE_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # Суффиксный диапазон: последние N байт
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    return _merge_ranges(ranges)
+
+
+def _merge_ranges(ranges):
+    """Объединяет пересекающиеся и соседние диапазоны"""
+    if len(ranges) == 1:
+        return ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Проверяет условие If-Range; без заголовка диапазоны всегда применимы"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(last_modified) == if_range_date
+
+
+def _read_range(f, start, end):
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        block = f.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+def file_range_reader(path):
+    """Функция read_range(start, end), читающая диапазон файла с диска блоками"""
+    def read_range(start, end):
+        with open(path, 'rb') as f:
+            yield from _read_range(f, start, end)
+    return read_range
+
+
+def _multipart_ranges(read_range, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode('latin-1')
+        yield from read_range(start, end)
+    yield f"\r\n--{boundary}--\r\n".encode('latin-1')
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    length = len(f"\r\n--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        )
+        length += end - start + 1
+    return length
+
+
+def _offload_response(offload, path, content_type):
+    """Пустой ответ с заголовком внутреннего перенаправления для прокси"""
+    response = HttpResponse(content_type=content_type)
+    if offload == 'x-accel-redirect':
+        prefix = settings.FILE_DOWNLOAD_ACCEL_PREFIX.rstrip('/')
+        # Имя берется из фактического пути: во время переноса файлов он может отличаться от file.name
+        name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = f"{prefix}/{quote(name)}"
+    elif offload == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        raise ValueError(f"Неизвестный режим FILE_DOWNLOAD_OFFLOAD: {offload}")
+    return response
+
+
+def _range_response(request, read_range, size, content_type, etag, last_modified):
+    """Ответ 206/416 на запрос Range или None, если отдавать нужно весь файл"""
+    range_header = request.META.get('HTTP_RANGE')
+    if not range_header or request.method not in ('GET', 'HEAD'):
+        return None
+    if not _if_range_matches(request, etag, last_modified):
+        return None
+
+    try:
+        ranges = parse_range_header(range_header, size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if not ranges:
+        return None
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(read_range(start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+    boundary = uuid.uuid4().hex
+    response = StreamingHttpResponse(
+        _multipart_ranges(read_range, ranges, size, content_type, boundary),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}'
+    )
+    response['Content-Length'] = str(_multipart_length(ranges, size, content_type, boundary))
+    return response
+
+
+def serve_file(request, path, file_instance, content_type, filename, read_range=None, size=None):
+    """
+    Отдает файл с поддержкой условных запросов (ETag/Last-Modified, 304)
+    и запросов диапазонов (Range/If-Range, 206, multipart/byteranges).
+    Содержимое читается с диска блоками, целиком в память не загружается,
+    либо отдается фронтовым прокси (settings.FILE_DOWNLOAD_OFFLOAD).
+    read_range(start, end) и size задают другой источник содержимого
+    (например, расшифровку на сервере); такой ответ прокси не передается.
+    """
+    if read_range is None:
+        size = os.path.getsize(path)
+    etag = file_etag(file_instance)
+    last_modified = file_instance.uploaded_at.timestamp() if file_instance.uploaded_at else os.path.getmtime(path)
+
+    # If-None-Match / If-Modified-Since -> 304, If-Match / If-Unmodified-Since -> 412
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if conditional is not None:
+        if conditional.status_code == 304:
+            conditional['ETag'] = etag
+            conditional['Last-Modified'] = http_date(last_modified)
+        return conditional
+
+    # Отдачу байтов можно переложить на фронтовой прокси (nginx/lighttpd),
+    # он же обрабатывает Range; Django только проверяет доступ
+    offload = getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', None)
+    if offload and read_range is None:
+        response = _offload_response(offload, path, content_type)
+        OFFLOADED_BYTES.inc(size)
+    else:
+        response = _range_response(request, read_range or file_range_reader(path), size, content_type, etag, last_modified)
+        if response is not None and response.status_code == 416:
+            return response
+
+    if response is None:
+        if read_range is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(read_range(0, size - 1), content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,91 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .search import filter_filename_contains
+
+# Поля, по которым можно сортировать список файлов (каждое покрыто индексом)
+SORT_FIELDS = ('uploaded_at', 'filename', 'size')
+
+# Сортировка по умолчанию: сначала новые
+DEFAULT_SORT = '-uploaded_at'
+
+# Верхняя граница для диапазонного поиска по префиксу имени
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+class InvalidFilter(ValueError):
+    """Неверное значение параметра фильтрации или сортировки"""
+
+
+def _parse_bool(name, value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise InvalidFilter(f'Неверное значение параметра {name}')
+
+
+def parse_int(name, value):
+    """Целое число из параметра запроса"""
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidFilter(f'Неверное значение параметра {name}')
+
+
+def parse_moment(name, value, end_of_day=False):
+    """Дата (YYYY-MM-DD) или дата и время в ISO 8601"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise InvalidFilter(f'Неверное значение параметра {name}')
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_files(queryset, params):
+    """
+    Применяет к списку файлов фильтры из параметров запроса и возвращает
+    (queryset, поле сортировки, по убыванию ли). Поддерживаются:
+    name_prefix, q (подстрока имени), size_min, size_max,
+    uploaded_after, uploaded_before, is_encrypted и sort.
+    """
+    name_prefix = params.get('name_prefix')
+    if name_prefix:
+        # Диапазон вместо LIKE, чтобы использовать индекс (user, filename, id)
+        queryset = queryset.filter(filename__gte=name_prefix, filename__lt=name_prefix + PREFIX_UPPER_BOUND)
+
+    substring = params.get('q')
+    if substring:
+        queryset = filter_filename_contains(queryset, substring)
+
+    if params.get('size_min'):
+        queryset = queryset.filter(size__gte=parse_int('size_min', params['size_min']))
+    if params.get('size_max'):
+        queryset = queryset.filter(size__lte=parse_int('size_max', params['size_max']))
+
+    if params.get('uploaded_after'):
+        queryset = queryset.filter(uploaded_at__gte=parse_moment('uploaded_after', params['uploaded_after']))
+    if params.get('uploaded_before'):
+        queryset = queryset.filter(
+            uploaded_at__lte=parse_moment('uploaded_before', params['uploaded_before'], end_of_day=True)
+        )
+
+    if params.get('is_encrypted'):
+        queryset = queryset.filter(is_encrypted=_parse_bool('is_encrypted', params['is_encrypted']))
+
+    sort = params.get('sort') or DEFAULT_SORT
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-')
+    if sort_field not in SORT_FIELDS:
+        raise InvalidFilter('Неверное поле сортировки')
+    if sort_field == 'size':
+        # Размер известен для всех загруженных файлов; NULL не участвует в курсоре
+        queryset = queryset.filter(size__isnull=False)
+
+    return queryset, sort_field, descending
@@ -0,0 +1,160 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .crypto_utils import key_fingerprint
+from .models import EncryptedFile, KeyRotationJob, UserKeys
+from .server_encryption import rewrap_file_key, server_master_key
+
+
+class InvalidRotationBatch(ValueError):
+    """Присланная пачка ключей не соответствует текущей позиции перешифрования"""
+
+
+def _job_files(job):
+    """Файлы, ключи которых перешифровывает задача (без загруженных после ее начала)"""
+    files = EncryptedFile.objects.filter(encryption_mode=job.mode, id__lte=job.max_file_id)
+    if job.user_id is not None:
+        files = files.filter(user_id=job.user_id)
+    return files
+
+
+def _start(user, mode, files, new_key_fingerprint):
+    running = KeyRotationJob.objects.filter(user=user, mode=mode, status=KeyRotationJob.STATUS_RUNNING).first()
+    if running is not None:
+        return running, False
+
+    job = KeyRotationJob(
+        user=user,
+        mode=mode,
+        new_key_fingerprint=new_key_fingerprint,
+        max_file_id=files.aggregate(max_id=Max('id'))['max_id'] or 0,
+        total_files=files.count()
+    )
+    if job.total_files == 0:
+        job.status = KeyRotationJob.STATUS_COMPLETED
+        job.completed_at = timezone.now()
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # Задачу одновременно создал другой запрос
+        return KeyRotationJob.objects.get(user=user, mode=mode, status=KeyRotationJob.STATUS_RUNNING), False
+    return job, True
+
+
+def start_client_rotation(user):
+    """
+    Начинает (или возвращает незавершенное) перешифрование ключей файлов
+    пользователя его текущим публичным ключом. Незавершенная задача для
+    ключа, который уже заменен, отменяется: клиент перешифровывал бы
+    ключи файлов для него.
+    """
+    user_keys = UserKeys.objects.filter(user=user).first()
+    fingerprint = key_fingerprint(user_keys.rsa_public_key) if user_keys and user_keys.rsa_public_key else ''
+    KeyRotationJob.objects.filter(
+        user=user, mode=KeyRotationJob.MODE_CLIENT, status=KeyRotationJob.STATUS_RUNNING
+    ).exclude(new_key_fingerprint=fingerprint).update(
+        status=KeyRotationJob.STATUS_CANCELLED, completed_at=timezone.now()
+    )
+    files = EncryptedFile.objects.filter(user=user, encryption_mode=KeyRotationJob.MODE_CLIENT)
+    return _start(user, KeyRotationJob.MODE_CLIENT, files, fingerprint)
+
+
+def cancel_job(job):
+    """Отменяет незавершенную задачу; False, если она уже завершена или отменена"""
+    cancelled = KeyRotationJob.objects.filter(pk=job.pk, status=KeyRotationJob.STATUS_RUNNING).update(
+        status=KeyRotationJob.STATUS_CANCELLED, completed_at=timezone.now()
+    )
+    job.refresh_from_db()
+    return bool(cancelled)
+
+
+def start_server_rotation():
+    """Начинает (или возвращает незавершенное) перешифрование ключей файлов текущим мастер-ключом"""
+    files = EncryptedFile.objects.filter(encryption_mode=KeyRotationJob.MODE_SERVER)
+    return _start(None, KeyRotationJob.MODE_SERVER, files, key_fingerprint(server_master_key()))
+
+
+def next_batch(job, limit):
+    """Следующие limit файлов после курсора задачи: id, user_id и текущий ключ файла"""
+    return list(
+        _job_files(job)
+        .filter(id__gt=job.last_file_id)
+        .order_by('id')
+        .values('id', 'user_id', 'encrypted_aes_key')[:limit]
+    )
+
+
+def _advance(job, last_file_id, count):
+    job.last_file_id = last_file_id
+    job.processed_files += count
+    if not _job_files(job).filter(id__gt=last_file_id).exists():
+        job.status = KeyRotationJob.STATUS_COMPLETED
+        job.completed_at = timezone.now()
+    job.save()
+
+
+def apply_client_batch(job, wrapped_keys):
+    """
+    Сохраняет перешифрованные клиентом ключи ({file_id: ключ}). Пачка должна
+    содержать ровно следующие по порядку файлы после курсора задачи, поэтому
+    повторная отправка той же пачки отклоняется, а прерванное перешифрование
+    продолжается с места остановки.
+    """
+    with transaction.atomic():
+        job = KeyRotationJob.objects.select_for_update().get(pk=job.pk)
+        if job.status != KeyRotationJob.STATUS_RUNNING:
+            raise InvalidRotationBatch("Перешифрование уже завершено или отменено")
+
+        expected = list(
+            _job_files(job)
+            .filter(id__gt=job.last_file_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:len(wrapped_keys)]
+        )
+        if not expected or set(expected) != set(wrapped_keys):
+            raise InvalidRotationBatch("Пачка должна содержать следующие по порядку файлы")
+
+        EncryptedFile.objects.bulk_update(
+            [EncryptedFile(id=file_id, encrypted_aes_key=wrapped_keys[file_id]) for file_id in expected],
+            ['encrypted_aes_key'],
+            batch_size=500
+        )
+        _advance(job, expected[-1], len(expected))
+    return job
+
+
+def rotate_server_batch(job, batch_size):
+    """
+    Перешифровывает текущим мастер-ключом следующую пачку ключей файлов.
+    Возвращает (обработано файлов, перешифровано ключей).
+    """
+    rows = next_batch(job, batch_size)
+    if not rows:
+        _advance(job, job.last_file_id, 0)
+        return 0, 0
+
+    updates = []
+    for row in rows:
+        wrapped_key = rewrap_file_key(row['encrypted_aes_key'], row['user_id'])
+        if wrapped_key is not None:
+            updates.append(EncryptedFile(id=row['id'], encrypted_aes_key=wrapped_key))
+
+    with transaction.atomic():
+        EncryptedFile.objects.bulk_update(updates, ['encrypted_aes_key'], batch_size=500)
+        _advance(job, rows[-1]['id'], len(rows))
+    return len(rows), len(updates)
+
+
+def job_progress(job):
+    return {
+        'job_id': str(job.id),
+        'mode': job.mode,
+        'status': job.status,
+        'total_files': job.total_files,
+        'processed_files': job.processed_files,
+        'progress': 1.0 if job.status == KeyRotationJob.STATUS_COMPLETED else min(job.processed_files / job.total_files, 1.0),
+        'created_at': job.created_at,
+        'completed_at': job.completed_at
+    }
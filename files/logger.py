@@ -1,18 +1,320 @@
+import atexit
+import json
 import logging
-from datetime import datetime
-
-# Настройка логгера
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .audit import action_code
+
 logger = logging.getLogger('user_actions')
 
-def log_user_action(user, action, details=None):
-    """Логирует действие пользователя"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    message = f"Пользователь {user.username} ({user.id}) - {action}"
-    if details:
-        message += f" - {details}"
-    logger.info(message) 
\ No newline at end of file
+# Политики при переполнении очереди журнала
+OVERFLOW_DROP_NEW = 'drop_new'  # Новая запись отбрасывается
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # Отбрасывается самая старая запись в очереди
+OVERFLOW_BLOCK = 'block'  # Поток запроса ждет места не дольше AUDIT_LOG_BLOCK_TIMEOUT
+
+_WAKEUP = object()
+
+
+class JsonLinesSink:
+    """Журнал в файле JSON Lines: одна запись - одна строка, пачка пишется одним вызовом"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        self._file.write(''.join(
+            json.dumps({**record, 'timestamp': record['timestamp'].isoformat()}, ensure_ascii=False, default=str) + '\n'
+            for record in records
+        ))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LoggingSink:
+    """Журнал через стандартный logging (логгер user_actions), в прежнем текстовом формате"""
+
+    def write(self, records):
+        for record in records:
+            message = f"Пользователь {record['username']} ({record['user_id']}) - {record['action']}"
+            if record.get('details'):
+                message += f" - {record['details']}"
+            if record.get('traceback'):
+                message += f"\n{record['traceback'].rstrip()}"
+            logger.info(message)
+
+    def close(self):
+        pass
+
+
+class DatabaseSink:
+    """Журнал в таблице AuditEvent: пачка вставляется одним bulk_create"""
+
+    def write(self, records):
+        from .models import AuditEvent
+
+        AuditEvent.objects.bulk_create([
+            AuditEvent(
+                timestamp=record['timestamp'],
+                user_id=record['user_id'],
+                action=record['code'],
+                file_id=record.get('file_id'),
+                bytes=record.get('bytes'),
+                duration_ms=record.get('duration_ms'),
+                message=record['action'][:255],
+                details=_details_with_traceback(record)
+            )
+            for record in records
+        ])
+
+    def close(self):
+        from django.db import connection
+
+        connection.close()
+
+
+def _details_with_traceback(record):
+    """Подробности записи; трассировка исключения дописывается после них"""
+    return '\n'.join(part for part in (record.get('details'), record.get('traceback')) if part)
+
+
+class MultiSink:
+    """Пишет каждую пачку во все приемники; ошибка одного не мешает остальным"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def write(self, records):
+        failed = None
+        for sink in self.sinks:
+            try:
+                sink.write(records)
+            except Exception as e:
+                failed = e
+        if failed is not None:
+            raise failed
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+SINKS = {
+    'jsonl': lambda: JsonLinesSink(settings.AUDIT_LOG_PATH),
+    'logging': LoggingSink,
+    'db': DatabaseSink,
+}
+
+
+def _make_sink():
+    return MultiSink([SINKS[name]() for name in settings.AUDIT_LOG_SINKS])
+
+
+class AuditPipeline:
+    """
+    Неблокирующий журнал действий: поток запроса только кладет запись в
+    ограниченную очередь, а фоновый поток форматирует записи и пишет их
+    в приемник пачками. При завершении процесса очередь дописывается.
+    """
+
+    def __init__(self, sink_factory, queue_size, batch_size, flush_interval, overflow, block_timeout):
+        if overflow not in (OVERFLOW_DROP_NEW, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise ValueError(f"Неизвестная политика AUDIT_LOG_OVERFLOW: {overflow}")
+        self.sink_factory = sink_factory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = None
+        self._sink = None
+
+    def _start(self):
+        # После fork (например, gunicorn --preload) поток писателя нужно создать заново
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stop = threading.Event()
+            self._sink = self.sink_factory()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        if self._put(record):
+            self._count('enqueued')
+        else:
+            self._count('dropped')
+
+    def _put(self, record):
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            if self.overflow != OVERFLOW_DROP_OLDEST:
+                return False
+
+        # Освобождаем место, отбрасывая самую старую запись
+        try:
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._count('dropped')
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout=5.0):
+        """Ждет, пока все поставленные в очередь записи будут записаны"""
+        if self._queue is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=None):
+        """Дописывает очередь и останавливает писателя (вызывается при завершении процесса)"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        try:
+            self._queue.put_nowait(_WAKEUP)
+        except queue.Full:
+            pass
+        self._thread.join(settings.AUDIT_LOG_SHUTDOWN_TIMEOUT if timeout is None else timeout)
+        self._sink.close()
+        self._thread = None
+        self._pid = None
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        stats['queue_size'] = self.queue_size
+        stats['overflow'] = self.overflow
+        return stats
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            if self._stop.is_set() and self._queue.empty():
+                return
+
+    def _next_batch(self):
+        """Ждет первую запись не дольше flush_interval и добирает пачку без ожидания"""
+        batch = []
+        try:
+            item = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch
+        while True:
+            if item is _WAKEUP:
+                self._queue.task_done()
+            else:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        try:
+            records = [_format_record(record) for record in batch]
+            self._sink.write(records)
+            self._count('written', len(batch))
+            self._count('batches')
+        except Exception:
+            self._count('errors')
+            logging.getLogger(__name__).exception("Ошибка записи журнала действий")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+def _format_record(record):
+    """Приводит запись к итоговому виду; выполняется в фоновом потоке"""
+    record['timestamp'] = datetime.fromtimestamp(record['timestamp'], timezone.utc)
+    if record.get('code') is None:
+        record['code'] = action_code(record['action'])
+    exc = record.pop('exc', None)
+    if exc is not None:
+        record['traceback'] = ''.join(traceback.format_exception(exc))
+    return record
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = AuditPipeline(
+                    sink_factory=_make_sink,
+                    queue_size=settings.AUDIT_LOG_QUEUE_SIZE,
+                    batch_size=settings.AUDIT_LOG_BATCH_SIZE,
+                    flush_interval=settings.AUDIT_LOG_FLUSH_INTERVAL,
+                    overflow=settings.AUDIT_LOG_OVERFLOW,
+                    block_timeout=settings.AUDIT_LOG_BLOCK_TIMEOUT,
+                )
+                atexit.register(_pipeline.close)
+    return _pipeline
+
+
+def log_user_action(user, action, details=None, exc=None, code=None, file_id=None, bytes=None, duration=None):
+    """
+    Логирует действие пользователя. Запись только ставится в очередь,
+    форматирование (включая трассировку исключения exc) и запись
+    выполняет фоновый поток. code - код действия (по умолчанию
+    определяется по тексту action), duration - длительность в секундах.
+    """
+    get_pipeline().submit({
+        'timestamp': time.time(),
+        'user_id': user.id,
+        'username': user.username,
+        'action': action,
+        'code': code,
+        'details': details,
+        'file_id': file_id,
+        'bytes': bytes,
+        'duration_ms': round(duration * 1000) if duration is not None else None,
+        'exc': exc,
+    })
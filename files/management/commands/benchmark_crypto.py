@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cryptography
+from cryptography.hazmat.backends.openssl.backend import backend as openssl_backend
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from files import crypto_utils
+from files.crypto_pool import get_pool
+
+SIZE_RE = re.compile(r'^(\d+)\s*([KMG]?)B?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+DEFAULT_SIZES = ['4K', '64K', '1M', '16M', '256M', '1G']
+
+# Потоковые операции читают и пишут блоками такого размера
+IO_BLOCK_SIZE = 1024 * 1024
+
+
+def parse_size(value):
+    match = SIZE_RE.match(value.strip())
+    if not match:
+        raise ValueError(f'Invalid size: {value}')
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f'{size // SIZE_UNITS[unit]}{unit}B'
+    return f'{size}B'
+
+
+class _PatternReader:
+    """Файловый объект заданного размера без хранения всего содержимого в памяти"""
+
+    def __init__(self, size, pattern):
+        self.remaining = size
+        self.pattern = pattern
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+        if size <= len(self.pattern):
+            return self.pattern[:size]
+        repeats, rest = divmod(size, len(self.pattern))
+        return self.pattern * repeats + self.pattern[:rest]
+
+
+def _drain(chunks):
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks crypto_utils: RSA key generation and key wrapping, whole-buffer AES-CBC '
+        'and streaming AES-GCM (serial and on the crypto pool) for payloads from 4KB to 1GB'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='Payload sizes, e.g. 4K 1M 1G')
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4], help='Concurrent thread counts')
+        parser.add_argument('--repeat', type=int, default=3, help='Measurements per case (median is reported)')
+        parser.add_argument('--rsa-iterations', type=int, default=5, help='RSA key pairs generated for the keygen benchmark')
+        parser.add_argument('--buffer-limit', default='256M', help='Largest payload for whole-buffer CBC (it needs ~3x the payload in memory)')
+        parser.add_argument('--skip-memory', action='store_true', help='Do not measure peak memory (tracemalloc)')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        parser.add_argument('--output', help='Also write JSON results to this file')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(parse_size(size) for size in options['sizes'])
+            buffer_limit = parse_size(options['buffer_limit'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if any(threads < 1 for threads in options['threads']):
+            raise CommandError('--threads must be positive')
+
+        logging.disable(logging.INFO)
+        try:
+            results = {
+                'meta': self._meta(),
+                'rsa': self._rsa(options),
+                'payloads': [self._payload(size, buffer_limit, options) for size in sizes],
+            }
+        finally:
+            logging.disable(logging.NOTSET)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'operation':<24} {'ms':>10}")
+        for name, result in results['rsa'].items():
+            self.stdout.write(f"{name:<24} {result['latency_ms']:>10.2f}")
+        self.stdout.write('')
+        self.stdout.write(f"{'size':>7} {'operation':<22} {'threads':>7} {'MB/s':>9} {'latency ms':>11} {'peak MB':>8}")
+        for payload in results['payloads']:
+            for result in payload['results']:
+                peak = result.get('peak_memory_bytes')
+                self.stdout.write(
+                    f"{format_size(payload['size']):>7} {result['operation']:<22} {result['threads']:>7} "
+                    f"{result['mb_per_s']:>9.1f} {result['latency_ms']:>11.2f} "
+                    f"{(peak / 1024 ** 2) if peak is not None else float('nan'):>8.1f}"
+                )
+            for operation in payload['skipped']:
+                self.stdout.write(f"{format_size(payload['size']):>7} {operation:<22} skipped (--buffer-limit)")
+        self.stdout.write(self.style.SUCCESS('Benchmark finished'))
+
+    def _meta(self):
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'cryptography': cryptography.__version__,
+            'openssl': openssl_backend.openssl_version_text(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'crypto_pool_workers': get_pool().workers,
+        }
+
+    def _rsa(self, options):
+        iterations = options['rsa_iterations']
+        key_pairs = [None] * iterations
+
+        def generate(index):
+            key_pairs[index] = crypto_utils.generate_rsa_key_pair()
+
+        results = {'generate_rsa_key_pair': self._latency(generate, iterations)}
+        key_pair = key_pairs[0]
+        aes_key = os.urandom(48)
+        wrapped = crypto_utils.encrypt_aes_key(aes_key, key_pair['public_key'])
+
+        # Холодный вызов - с разбором PEM, теплый - с ключом из кэша
+        def cold_unwrap(_):
+            crypto_utils.invalidate_cached_key(key_pair['private_key'])
+            crypto_utils.decrypt_aes_key(wrapped, key_pair['private_key'])
+
+        results['encrypt_aes_key'] = self._latency(lambda _: crypto_utils.encrypt_aes_key(aes_key, key_pair['public_key']), 50)
+        results['decrypt_aes_key_cold'] = self._latency(cold_unwrap, 20)
+        results['decrypt_aes_key_cached'] = self._latency(lambda _: crypto_utils.decrypt_aes_key(wrapped, key_pair['private_key']), 50)
+        self._key_pair = key_pair
+        return results
+
+    def _latency(self, func, iterations):
+        timings = []
+        for index in range(iterations):
+            started = time.perf_counter()
+            func(index)
+            timings.append((time.perf_counter() - started) * 1000)
+        return {'iterations': iterations, 'latency_ms': statistics.median(timings), 'max_ms': max(timings)}
+
+    def _payload(self, size, buffer_limit, options):
+        key_pair = self._key_pair
+        pattern = os.urandom(min(size, IO_BLOCK_SIZE))
+        aes_key = os.urandom(32)
+        pool = get_pool()
+        operations = {}
+        skipped = []
+
+        # Текущий путь: весь файл в памяти, AES-CBC (+ обертка ключа RSA)
+        if size <= buffer_limit:
+            plaintext = _PatternReader(size, pattern).read()
+            encrypted = crypto_utils.encrypt_file_content(plaintext, key_pair['public_key'])
+            operations['cbc_encrypt'] = lambda: crypto_utils.encrypt_file_content(plaintext, key_pair['public_key'])
+            operations['cbc_decrypt'] = lambda: crypto_utils.decrypt_file_content(
+                encrypted['encrypted_data'], encrypted['encrypted_key'], encrypted['iv'], key_pair['private_key']
+            )
+        else:
+            skipped += ['cbc_encrypt', 'cbc_decrypt']
+
+        # Потоковый формат: сегменты AES-GCM, шифротекст во временном файле
+        ciphertext_file = tempfile.NamedTemporaryFile(prefix='benchmark-crypto-', delete=False)
+        try:
+            with ciphertext_file:
+                for chunk in crypto_utils.encrypt_stream(_PatternReader(size, pattern), aes_key):
+                    ciphertext_file.write(chunk)
+
+            def decrypt(map_segments):
+                with open(ciphertext_file.name, 'rb') as f:
+                    _drain(crypto_utils.decrypt_stream(f, aes_key, map_segments=map_segments))
+
+            operations['stream_encrypt'] = lambda: _drain(crypto_utils.encrypt_stream(_PatternReader(size, pattern), aes_key))
+            operations['stream_decrypt'] = lambda: decrypt(map)
+            operations['stream_encrypt_pool'] = lambda: _drain(crypto_utils.encrypt_stream(
+                _PatternReader(size, pattern), aes_key, map_segments=pool.map_ordered
+            ))
+            operations['stream_decrypt_pool'] = lambda: decrypt(pool.map_ordered)
+
+            repeat = options['repeat'] if size <= 16 * 1024 ** 2 else 1
+            results = []
+            for name, func in operations.items():
+                peak = None if options['skip_memory'] else self._peak_memory(func)
+                for threads in options['threads']:
+                    result = self._measure(func, size, threads, repeat)
+                    result['operation'] = name
+                    if threads == 1:
+                        result['peak_memory_bytes'] = peak
+                    results.append(result)
+        finally:
+            os.remove(ciphertext_file.name)
+
+        return {'size': size, 'results': results, 'skipped': skipped}
+
+    def _measure(self, func, size, threads, repeat):
+        """Медиана по repeat запускам: threads потоков одновременно выполняют func"""
+        walls = []
+        latencies = []
+        for _ in range(repeat):
+            barrier = threading.Barrier(threads + 1)
+            durations = []
+            lock = threading.Lock()
+
+            def worker():
+                barrier.wait()
+                started = time.perf_counter()
+                func()
+                with lock:
+                    durations.append(time.perf_counter() - started)
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for thread in workers:
+                thread.start()
+            barrier.wait()
+            started = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            walls.append(time.perf_counter() - started)
+            latencies.extend(durations)
+
+        wall = statistics.median(walls)
+        return {
+            'threads': threads,
+            'repeat': repeat,
+            'mb_per_s': threads * size / wall / 1024 ** 2,
+            'latency_ms': statistics.median(latencies) * 1000,
+            'wall_ms': wall * 1000,
+        }
+
+    def _peak_memory(self, func):
+        """Пиковый объем памяти Python (tracemalloc) за одну операцию"""
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+from files.models import EncryptedFile
+from files.pagination import encode_cursor
+from files.views import file_list
+
+class Command(BaseCommand):
+    help = 'Measures file_list latency for growing numbers of rows (data is rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Row counts to benchmark')
+        parser.add_argument('--page-size', type=int, default=100, help='Page size passed to file_list')
+        parser.add_argument('--repeat', type=int, default=5, help='Measurements per case (median is reported)')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        logging.disable(logging.INFO)
+        try:
+            with transaction.atomic():
+                results = self._run(options)
+                transaction.set_rollback(True)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'rows':>10} {'first page ms':>14} {'deep page ms':>13} {'full scan ms':>13}")
+        for result in results:
+            self.stdout.write(
+                f"{result['rows']:>10} {result['first_page_ms']:>14.2f} "
+                f"{result['deep_page_ms']:>13.2f} {result['full_scan_ms']:>13.2f}"
+            )
+
+    def _run(self, options):
+        user = User.objects.create(username=f'benchmark-{os.getpid()}-{time.time_ns()}')
+        factory = APIRequestFactory()
+        results = []
+        created = 0
+
+        for rows in sorted(options['rows']):
+            # Добавляем строки до нужного количества; ключи имитируют реальный объем записи
+            batch = [
+                EncryptedFile(
+                    user=user,
+                    file=f'encrypted_files/benchmark-{index}.bin',
+                    filename=f'benchmark-{index}.bin',
+                    size=index,
+                    is_encrypted=True,
+                    encrypted_aes_key=os.urandom(256),
+                    iv=os.urandom(16)
+                )
+                for index in range(created, rows)
+            ]
+            EncryptedFile.objects.bulk_create(batch, batch_size=1000)
+            created = rows
+
+            def call(params):
+                request = factory.get('/api/files/', params)
+                force_authenticate(request, user=user)
+                response = file_list(request)
+                return response.data
+
+            # Курсор из середины списка
+            middle = (
+                EncryptedFile.objects.filter(user=user)
+                .order_by('-uploaded_at', '-id')
+                .values('uploaded_at', 'id')[rows // 2]
+            )
+            cursor = encode_cursor(middle['uploaded_at'], middle['id'])
+
+            results.append({
+                'rows': rows,
+                'first_page_ms': self._measure(lambda: call({'limit': options['page_size']}), options['repeat']),
+                'deep_page_ms': self._measure(lambda: call({'limit': options['page_size'], 'cursor': cursor}), options['repeat']),
+                # Для сравнения: прежний подход с загрузкой всех строк пользователя
+                'full_scan_ms': self._measure(
+                    lambda: [f.uploaded_at.strftime('%Y-%m-%d %H:%M:%S') for f in EncryptedFile.objects.filter(user=user)],
+                    options['repeat']
+                ),
+            })
+        return results
+
+    def _measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
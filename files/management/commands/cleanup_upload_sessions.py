@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from files.models import UploadSession
+from files.storage import delete_stored_file
+
+class Command(BaseCommand):
+    help = 'Deletes expired upload sessions and their partially uploaded files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of sessions deleted per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        deleted = 0
+
+        while True:
+            sessions = list(
+                UploadSession.objects.filter(expires_at__lt=timezone.now())
+                .values_list('id', 'storage_name')[:batch_size]
+            )
+            if not sessions:
+                break
+
+            for _, storage_name in sessions:
+                delete_stored_file(storage_name)
+            UploadSession.objects.filter(id__in=[session_id for session_id, _ in sessions]).delete()
+            deleted += len(sessions)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} expired upload sessions'))
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from files.models import EncryptedFile
+from files.storage import SHARDED_NAME_RE, UPLOAD_DIR, sharded_storage_name, storage_path
+
+class Command(BaseCommand):
+    help = (
+        'Moves uploaded files from the flat encrypted_files/ directory to the encrypted_files/ab/cd/ layout. '
+        'Files are hard-linked in parallel, records are updated in batches and the old names are removed '
+        'afterwards, so downloads keep working during the migration. An interrupted run can simply be restarted'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of records updated per transaction')
+        parser.add_argument('--workers', type=int, default=8, help='Parallel file operations')
+        parser.add_argument('--dry-run', action='store_true', help='Only count files that would be moved')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        # Уже перенесенные записи не попадают в выборку, поэтому повторный запуск продолжает перенос
+        files = EncryptedFile.objects.filter(file__startswith=f'{UPLOAD_DIR}/').exclude(file__regex=SHARDED_NAME_RE.pattern)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would move {files.count()} files'))
+            return
+
+        moved = 0
+        missing = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                rows = list(files.filter(id__gt=last_id).order_by('id').values_list('id', 'file')[:batch_size])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                results = list(executor.map(self._link, [name for _, name in rows]))
+                updates = []
+                linked = []
+                for (file_id, name), (target, is_link) in zip(rows, results):
+                    if target is None:
+                        missing += 1
+                        self.stderr.write(f'File {file_id} not found on disk, skipped')
+                        continue
+                    updates.append(EncryptedFile(id=file_id, file=target))
+                    if is_link:
+                        linked.append(name)
+
+                with transaction.atomic():
+                    EncryptedFile.objects.bulk_update(updates, ['file'], batch_size=batch_size)
+                # Старые имена удаляются только после фиксации новых путей в БД
+                list(executor.map(self._unlink, linked))
+                moved += len(updates)
+                self.stdout.write(f'  {moved} files moved')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully moved {moved} files ({missing} missing on disk)'))
+
+    def _link(self, name):
+        """
+        Создает файл по новому пути. Возвращает (новое имя, создана ли
+        жесткая ссылка) или (None, False), если файла нет ни по одному пути.
+        """
+        target = sharded_storage_name(name)
+        source_path = default_storage.path(name)
+        target_path = storage_path(target)
+        if not os.path.exists(source_path):
+            # Файл перенесен прерванным запуском, но запись не обновлена
+            return (target, False) if os.path.exists(target_path) else (None, False)
+        try:
+            os.link(source_path, target_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Файловая система без жестких ссылок: переименование (чтение - через stored_file_path)
+            os.replace(source_path, target_path)
+            return target, False
+        return target, True
+
+    def _unlink(self, name):
+        try:
+            os.remove(default_storage.path(name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,50 @@
+import os
+
+from django.core.management.base import BaseCommand
+from files.blobs import atomic_blob_store, store_blob
+from files.models import EncryptedFile
+from files.storage import hash_stored_file, stored_file_path
+
+class Command(BaseCommand):
+    help = 'Moves existing unencrypted files into the content-addressed blob store, deduplicating identical content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of files loaded per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be migrated')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        migrated = missing = 0
+        last_id = 0
+
+        while True:
+            batch = list(
+                EncryptedFile.objects.filter(encryption_mode='none', blob__isnull=True, id__gt=last_id)
+                .order_by('id')
+                .only('id', 'file', 'size', 'sha256')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for file_instance in batch:
+                if not file_instance.file or not os.path.exists(stored_file_path(file_instance.file.name)):
+                    missing += 1
+                    self.stderr.write(f'File {file_instance.id} not found on disk, skipped')
+                    continue
+                if dry_run:
+                    migrated += 1
+                    continue
+
+                sha256 = hash_stored_file(file_instance.file.name)
+                size = os.path.getsize(stored_file_path(file_instance.file.name))
+                with atomic_blob_store() as moves:
+                    blob = store_blob(file_instance.file.name, sha256, size, moves)
+                    EncryptedFile.objects.filter(id=file_instance.id).update(
+                        blob=blob, file=blob.file.name, sha256=sha256, size=size
+                    )
+                migrated += 1
+
+        action = 'Would migrate' if dry_run else 'Successfully migrated'
+        self.stdout.write(self.style.SUCCESS(f'{action} {migrated} files into the blob store ({missing} missing on disk)'))
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from files.models import AuditEvent
+
+class Command(BaseCommand):
+    help = (
+        'Deletes audit events older than the retention period (AUDIT_LOG_RETENTION_DAYS) and compacts '
+        'noisy actions (AUDIT_LOG_COMPACT_ACTIONS) older than AUDIT_LOG_COMPACT_DAYS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_LOG_RETENTION_DAYS, help='Keep events for this many days')
+        parser.add_argument('--compact-days', type=int, default=settings.AUDIT_LOG_COMPACT_DAYS, help='Keep noisy actions for this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of events deleted per query')
+        parser.add_argument('--vacuum', action='store_true', help='Reclaim disk space after deleting (SQLite and PostgreSQL)')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['compact_days'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive, --compact-days must not be negative')
+
+        now = timezone.now()
+        expired = self._purge_expired(now - timedelta(days=options['days']), options['batch_size'])
+        compacted = 0
+        for action in settings.AUDIT_LOG_COMPACT_ACTIONS:
+            compacted += self._compact(action, now - timedelta(days=options['compact_days']), options['batch_size'])
+
+        if options['vacuum']:
+            self._vacuum()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully deleted {expired} expired and {compacted} compacted audit events'
+        ))
+
+    def _purge_expired(self, cutoff, batch_size):
+        """
+        События добавляются в порядке времени, поэтому самые старые лежат в
+        начале первичного ключа: удаляем пачками по id и останавливаемся на
+        первой пачке, в которой встретились события новее cutoff.
+        """
+        deleted = 0
+        while True:
+            rows = list(AuditEvent.objects.order_by('id').values_list('id', 'timestamp')[:batch_size])
+            expired_ids = [event_id for event_id, timestamp in rows if timestamp < cutoff]
+            if expired_ids:
+                AuditEvent.objects.filter(id__in=expired_ids).delete()
+                deleted += len(expired_ids)
+            if len(expired_ids) < batch_size:
+                return deleted
+
+    def _compact(self, action, cutoff, batch_size):
+        """Удаляет старые события действия пачками по индексу (action, timestamp, id)"""
+        deleted = 0
+        while True:
+            event_ids = list(
+                AuditEvent.objects.filter(action=action, timestamp__lt=cutoff)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not event_ids:
+                return deleted
+            AuditEvent.objects.filter(id__in=event_ids).delete()
+            deleted += len(event_ids)
+
+    def _vacuum(self):
+        if connection.vendor == 'sqlite':
+            statement = 'VACUUM'
+        elif connection.vendor == 'postgresql':
+            statement = f'VACUUM ANALYZE {AuditEvent._meta.db_table}'
+        else:
+            self.stdout.write(self.style.WARNING(f'VACUUM is not supported for {connection.vendor}, skipped'))
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
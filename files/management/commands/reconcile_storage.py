@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from files.blobs import delete_encrypted_file
+from files.models import EncryptedFile, FileBlob, UploadSession
+from files.storage import BLOB_DIR, UPLOAD_DIR, UPLOAD_SESSION_DIR, is_sharded_name, stored_file_path
+
+# Каталоги MEDIA_ROOT, файлы которых должны принадлежать записям в БД
+SCANNED_DIRS = (UPLOAD_DIR, BLOB_DIR, UPLOAD_SESSION_DIR)
+
+# Как часто (в секундах) сохраняется контрольная точка при обходе каталогов
+CHECKPOINT_INTERVAL = 30
+
+
+class _RateLimiter:
+    """Ограничивает число операций с файловой системой в секунду на все потоки"""
+
+    def __init__(self, rate):
+        self._interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _Checkpoint:
+    """
+    Состояние прерванного запуска: последний проверенный id записи и
+    обойденные каталоги со списками их подкаталогов (чтобы при
+    продолжении не читать заново каталоги с миллионами файлов).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_id = 0
+        self.dirs = {}
+        self._saved_at = time.monotonic()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.last_id = state.get('last_id', 0)
+            self.dirs = state.get('dirs', {})
+
+    def save(self, force=True):
+        if not self.path or (not force and time.monotonic() - self._saved_at < CHECKPOINT_INTERVAL):
+            return
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'last_id': self.last_id, 'dirs': self.dirs}, f)
+        os.replace(self.path + '.tmp', self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconciles MEDIA_ROOT with the database: reports EncryptedFile records whose file is missing on disk '
+        'and files that no record references. Records are read in keyset batches and directories are scanned '
+        'in parallel; nothing is changed without --fix. With --checkpoint an interrupted run continues where it stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Delete dangling records and orphan files (default: report only)')
+        parser.add_argument('--workers', type=int, default=8, help='Parallel file system workers')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Records or file names checked per query')
+        parser.add_argument('--max-ops', type=float, default=0, help='File system operations per second (0 - unlimited)')
+        parser.add_argument('--min-age-hours', type=float, default=24, help='Files modified more recently are never treated as orphans')
+        parser.add_argument('--checkpoint', help='JSON file with progress; resumes from it if it exists')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive')
+        if options['max_ops'] < 0 or options['min_age_hours'] < 0:
+            raise CommandError('--max-ops and --min-age-hours must not be negative')
+
+        self.fix = options['fix']
+        self.batch_size = options['batch_size']
+        self.limiter = _RateLimiter(options['max_ops'])
+        # Свежие файлы могут принадлежать загрузке, запись которой еще не сохранена
+        self.min_mtime = time.time() - options['min_age_hours'] * 3600
+        checkpoint = _Checkpoint(options['checkpoint'])
+        if checkpoint.last_id or checkpoint.dirs:
+            self.stdout.write(f'Resuming from record {checkpoint.last_id}, {len(checkpoint.dirs)} directories already scanned')
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            dangling = self._check_records(executor, checkpoint)
+            orphans, orphan_bytes = self._scan_directories(executor, options['workers'], checkpoint)
+        checkpoint.remove()
+
+        action = 'removed' if self.fix else 'found'
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciliation finished: {dangling} dangling records and {orphans} orphan files '
+            f'({orphan_bytes} bytes) {action}'
+        ))
+
+    def _check_records(self, executor, checkpoint):
+        """Ищет записи, файла которых нет на диске"""
+        dangling = 0
+        checked = 0
+        while True:
+            rows = list(
+                EncryptedFile.objects.filter(id__gt=checkpoint.last_id).order_by('id').values_list('id', 'file')[:self.batch_size]
+            )
+            if not rows:
+                break
+            # Записи с общим содержимым ссылаются на один файл: проверяем каждое имя один раз
+            names = list({name for _, name in rows if name})
+            existing = {name for name, exists in zip(names, executor.map(self._exists, names)) if exists}
+
+            for file_id, name in rows:
+                if name in existing:
+                    continue
+                if self.fix and not self._delete_record(file_id):
+                    continue
+                self.stdout.write(f'Dangling record {file_id}: {name or "<empty>"}')
+                dangling += 1
+
+            checkpoint.last_id = rows[-1][0]
+            checkpoint.save()
+            checked += len(rows)
+            self.stdout.write(f'  {checked} records checked')
+        return dangling
+
+    def _exists(self, name):
+        self.limiter.acquire()
+        return os.path.exists(stored_file_path(name))
+
+    def _delete_record(self, file_id):
+        """Удаляет запись, если ее файл все еще не найден (его мог вернуть на место параллельный перенос)"""
+        file_instance = EncryptedFile.objects.filter(id=file_id).first()
+        if file_instance is None:
+            return False
+        if file_instance.file and self._exists(file_instance.file.name):
+            return False
+        delete_encrypted_file(file_instance)
+        return True
+
+    def _scan_directories(self, executor, workers, checkpoint):
+        """
+        Обходит каталоги хранилища: каждый каталог читается одним потоком,
+        его подкаталоги ставятся в очередь по мере обнаружения. Одновременно
+        в работе не больше 2 * workers каталогов.
+        """
+        pending = deque(name for name in SCANNED_DIRS if os.path.isdir(default_storage.path(name)))
+        running = {}
+        orphans = 0
+        orphan_bytes = 0
+        while pending or running:
+            while pending and len(running) < workers * 2:
+                relative = pending.popleft()
+                if relative in checkpoint.dirs:
+                    pending.extend(checkpoint.dirs[relative])
+                    continue
+                running[executor.submit(self._scan_directory, relative)] = relative
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative = running.pop(future)
+                subdirs, found = future.result()
+                pending.extend(subdirs)
+                for name, size in found:
+                    self.stdout.write(f'Orphan file: {name} ({size} bytes)')
+                    orphan_bytes += size
+                orphans += len(found)
+                checkpoint.dirs[relative] = subdirs
+            checkpoint.save(force=False)
+
+        checkpoint.save()
+        return orphans, orphan_bytes
+
+    def _scan_directory(self, relative):
+        """Возвращает подкаталоги и найденные (и при --fix удаленные) файлы без записей"""
+        subdirs = []
+        found = []
+        candidates = []
+        try:
+            self.limiter.acquire()
+            with os.scandir(default_storage.path(relative)) as entries:
+                for entry in entries:
+                    self.limiter.acquire()
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(f'{relative}/{entry.name}')
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > self.min_mtime:
+                        continue
+                    candidates.append((f'{relative}/{entry.name}', stat.st_size))
+                    if len(candidates) >= self.batch_size:
+                        found.extend(self._unreferenced(candidates))
+                        candidates = []
+            if candidates:
+                found.extend(self._unreferenced(candidates))
+        finally:
+            connection.close()
+        return subdirs, found
+
+    def _unreferenced(self, candidates):
+        names = [name for name, _ in candidates]
+        # Во время migrate_storage_layout файл encrypted_files/ab/cd/<имя> может
+        # принадлежать записи, которая еще хранит старое имя encrypted_files/<имя>
+        aliases = {name: f'{UPLOAD_DIR}/{os.path.basename(name)}' for name in names if is_sharded_name(name)}
+        lookup = names + list(aliases.values())
+        referenced = set(EncryptedFile.objects.filter(file__in=lookup).values_list('file', flat=True))
+        referenced.update(FileBlob.objects.filter(file__in=lookup).values_list('file', flat=True))
+        referenced.update(UploadSession.objects.filter(storage_name__in=names).values_list('storage_name', flat=True))
+
+        found = []
+        for name, size in candidates:
+            if name in referenced or aliases.get(name) in referenced:
+                continue
+            if self.fix:
+                self.limiter.acquire()
+                try:
+                    os.remove(default_storage.path(name))
+                except FileNotFoundError:
+                    continue
+            found.append((name, size))
+        return found
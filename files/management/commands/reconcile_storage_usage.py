@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from files.models import EncryptedFile, StorageUsage
+
+class Command(BaseCommand):
+    help = 'Recomputes per-user storage usage counters from EncryptedFile rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of users processed per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            totals = {
+                row['user']: (row['bytes_used'] or 0, row['file_count'])
+                for row in EncryptedFile.objects.filter(user_id__in=user_ids)
+                .values('user')
+                .annotate(bytes_used=Sum('size'), file_count=Count('id'))
+                .order_by()
+            }
+
+            with transaction.atomic():
+                StorageUsage.objects.bulk_create(
+                    [StorageUsage(user_id=user_id) for user_id in user_ids],
+                    ignore_conflicts=True
+                )
+                usages = list(StorageUsage.objects.select_for_update().filter(user_id__in=user_ids))
+                for usage in usages:
+                    usage.bytes_used, usage.file_count = totals.get(usage.user_id, (0, 0))
+                StorageUsage.objects.bulk_update(usages, ['bytes_used', 'file_count'])
+            updated += len(usages)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconciled storage usage for {updated} users'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from files.key_rotation import job_progress, rotate_server_batch, start_server_rotation
+from files.models import KeyRotationJob
+
+class Command(BaseCommand):
+    help = (
+        'Re-wraps the keys of server-side encrypted files with the current master key '
+        '(FILE_SERVER_ENCRYPTION_KEY); previous keys must be listed in FILE_SERVER_ENCRYPTION_OLD_KEYS. '
+        'An interrupted run continues where it stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Files re-wrapped per transaction')
+
+    def handle(self, *args, **options):
+        job, created = start_server_rotation()
+        self.stdout.write(f"{'Started' if created else 'Resuming'} key rotation {job.id} ({job.processed_files}/{job.total_files} files done)")
+
+        rewrapped = 0
+        while job.status == KeyRotationJob.STATUS_RUNNING:
+            processed, updated = rotate_server_batch(job, options['batch_size'])
+            rewrapped += updated
+            progress = job_progress(job)
+            self.stdout.write(f"  {progress['processed_files']}/{progress['total_files']} files ({progress['progress']:.0%})")
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rotated server file keys ({rewrapped} keys re-wrapped)'))
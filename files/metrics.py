@@ -0,0 +1,413 @@
+import atexit
+import bisect
+import functools
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: снимки завершившихся процессов не сворачиваются
+    fcntl = None
+
+# Границы корзин гистограмм (секунды или штуки)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CRYPTO_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Все метрики процесса по имени; значения защищены одной блокировкой,
+# запись метрики - это поиск в словаре и сложение под ней
+_registry = {}
+_collectors = []
+_lock = threading.Lock()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with _lock:
+            return [(key, self._copy(value)) for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик; в нескольких процессах значения суммируются"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Для сборщиков, переносящих в метрику уже накопленный компонентом счетчик"""
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    """Текущее значение; учитываются только живые процессы"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам; хранится [число в каждой корзине..., сумма]"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+    def merge(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+
+def timed(histogram, **labels):
+    """Декоратор: длительность каждого вызова функции попадает в гистограмму"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+# Запросы к API
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by view, method and status', ('view', 'method', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'Time to build the response', ('view', 'method'), LATENCY_BUCKETS)
+HTTP_DB_QUERIES = Histogram('http_request_db_queries', 'Database queries per request', ('view',), QUERY_COUNT_BUCKETS)
+
+# Передача файлов
+UPLOAD_BYTES = Counter('file_upload_bytes_total', 'Request body bytes received by upload views', ('view',))
+DOWNLOAD_BYTES = Counter('file_download_bytes_total', 'Response bytes sent by download views', ('view',))
+OFFLOADED_BYTES = Counter('file_offloaded_bytes_total', 'File bytes handed to the front proxy (FILE_DOWNLOAD_OFFLOAD)')
+ACTIVE_TRANSFERS = Gauge('file_active_transfers', 'Uploads and downloads in progress', ('direction',))
+
+# Криптография
+CRYPTO_SECONDS = Histogram('crypto_operation_duration_seconds', 'Time spent in crypto_utils operations', ('operation',), CRYPTO_BUCKETS)
+
+# Состояние компонентов (переносится из их собственных счетчиков при снятии метрик)
+CRYPTO_POOL_WORKERS = Gauge('crypto_pool_workers', 'Crypto pool worker threads')
+CRYPTO_POOL_IN_FLIGHT = Gauge('crypto_pool_in_flight', 'Crypto pool tasks running or queued')
+CRYPTO_POOL_TASKS = Counter('crypto_pool_tasks_total', 'Crypto pool tasks by outcome', ('result',))
+KEY_CACHE_SIZE = Gauge('crypto_key_cache_size', 'Parsed RSA keys in the cache')
+KEY_CACHE_LOOKUPS = Counter('crypto_key_cache_lookups_total', 'Parsed RSA key cache lookups', ('result',))
+AUDIT_LOG_RECORDS = Counter('audit_log_records_total', 'Audit log records by outcome', ('result',))
+AUDIT_LOG_QUEUED = Gauge('audit_log_queued', 'Audit log records waiting to be written')
+
+
+def register_collector(collector):
+    """collector() вызывается перед каждым снимком и обновляет метрики"""
+    _collectors.append(collector)
+
+
+def _collect_components():
+    from .crypto_pool import get_pool
+    from .crypto_utils import key_cache_stats
+    from .logger import get_pipeline
+
+    pool = get_pool().stats()
+    CRYPTO_POOL_WORKERS.set(pool['workers'])
+    CRYPTO_POOL_IN_FLIGHT.set(pool['in_flight'])
+    for result in ('submitted', 'completed', 'failed'):
+        CRYPTO_POOL_TASKS.set(pool[result], result=result)
+
+    cache = key_cache_stats()
+    KEY_CACHE_SIZE.set(cache['size'])
+    KEY_CACHE_LOOKUPS.set(cache['hits'], result='hit')
+    KEY_CACHE_LOOKUPS.set(cache['misses'], result='miss')
+
+    audit = get_pipeline().stats()
+    for result in ('enqueued', 'written', 'dropped', 'errors'):
+        AUDIT_LOG_RECORDS.set(audit[result], result=result)
+    AUDIT_LOG_QUEUED.set(audit['queued'])
+
+
+register_collector(_collect_components)
+
+
+def snapshot():
+    """Значения всех метрик этого процесса: {имя: [[значения меток, значение], ...]}"""
+    for collector in _collectors:
+        collector()
+    return {name: [[list(key), value] for key, value in metric.samples()] for name, metric in _registry.items()}
+
+
+# Несколько процессов (gunicorn, uwsgi): каждый процесс периодически пишет
+# свой снимок в METRICS_MULTIPROCESS_DIR/<pid>-<время запуска>.json, а экспорт
+# суммирует снимки всех процессов. Время запуска в имени отделяет снимок
+# процесса, получившего pid завершившегося, от снимка прежнего владельца.
+# Счетчики завершившихся процессов экспорт переносит в aggregate.json и
+# удаляет их снимки; значения gauge учитываются только у живых процессов.
+
+SNAPSHOT_NAME_RE = re.compile(r'^(\d+)-(\d+)\.json$')
+AGGREGATE_NAME = 'aggregate.json'
+LOCK_NAME = '.lock'
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+_process_started = time.time_ns()
+
+
+def _snapshot_name():
+    return f'{os.getpid()}-{_process_started}.json'
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot():
+    """Атомарно записывает снимок метрик процесса в METRICS_MULTIPROCESS_DIR"""
+    if not settings.METRICS_MULTIPROCESS_DIR:
+        return
+    os.makedirs(settings.METRICS_MULTIPROCESS_DIR, exist_ok=True)
+    _write_json(
+        os.path.join(settings.METRICS_MULTIPROCESS_DIR, _snapshot_name()),
+        {'pid': os.getpid(), 'metrics': snapshot()}
+    )
+
+
+def _flush_loop():
+    pid = os.getpid()
+    while _flusher_pid == pid:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except Exception:
+            # Метрики не должны мешать обработке запросов; попробуем в следующий раз
+            pass
+
+
+def start_flusher():
+    """Запускает периодическую запись снимка (один поток на процесс, только в режиме нескольких процессов)"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not settings.METRICS_MULTIPROCESS_DIR:
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(write_snapshot)
+
+
+def _reset_after_fork():
+    """Дочерний процесс начинает с нуля, иначе значения родителя учлись бы дважды"""
+    global _lock, _flusher_pid, _flusher_lock, _process_started
+    _lock = threading.Lock()
+    _flusher_lock = threading.Lock()
+    _flusher_pid = None
+    _process_started = time.time_ns()
+    for metric in _registry.values():
+        metric._values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _compact(directory, dead):
+    """
+    Переносит счетчики и гистограммы завершившихся процессов (имена их
+    снимков в dead) в aggregate.json и удаляет эти снимки. В агрегате
+    запоминаются перенесенные снимки: если процесс экспорта прервется до
+    их удаления, следующий экспорт удалит их, не учитывая второй раз.
+    Вызывается под блокировкой каталога.
+    """
+    aggregate = _read_json(os.path.join(directory, AGGREGATE_NAME)) or {'metrics': {}, 'merged': []}
+    for name in aggregate['merged']:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+    totals = {name: {tuple(key): value for key, value in samples} for name, samples in aggregate['metrics'].items()}
+    merged = []
+    for name in dead:
+        # Снимок мог уже перенести одновременный экспорт
+        data = None if name in aggregate['merged'] else _read_json(os.path.join(directory, name))
+        if data is None:
+            continue
+        for metric_name, samples in data['metrics'].items():
+            metric = _registry.get(metric_name)
+            if metric is None or metric.kind == 'gauge':
+                continue
+            metric_totals = totals.setdefault(metric_name, {})
+            for key, value in samples:
+                key = tuple(key)
+                metric_totals[key] = metric.merge(metric_totals.get(key), value)
+        merged.append(name)
+
+    if merged or aggregate['merged']:
+        _write_json(os.path.join(directory, AGGREGATE_NAME), {
+            'metrics': {name: [[list(key), value] for key, value in samples.items()] for name, samples in totals.items()},
+            'merged': merged,
+        })
+    for name in merged:
+        os.remove(os.path.join(directory, name))
+
+
+def _process_snapshots():
+    """Снимки всех процессов: [(снимок, жив ли процесс)]; текущий процесс - без чтения файла"""
+    snapshots = [(snapshot(), True)]
+    directory = settings.METRICS_MULTIPROCESS_DIR
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+
+    own = _snapshot_name()
+    started = {}
+    for entry in os.scandir(directory):
+        match = SNAPSHOT_NAME_RE.match(entry.name)
+        if match and entry.name != own:
+            started[entry.name] = (int(match.group(1)), int(match.group(2)))
+    # pid жив и принадлежит процессу, запущенному последним с этим pid
+    latest = {}
+    for pid, process_started in started.values():
+        latest[pid] = max(latest.get(pid, 0), process_started)
+    alive = {name for name, (pid, process_started) in started.items() if latest[pid] == process_started and _pid_alive(pid)}
+
+    dead = sorted(set(started) - alive)
+
+    # Агрегат и снимки читаются под той же блокировкой, под которой их меняет
+    # одновременный экспорт: иначе снимок, перенесенный между чтениями, потерялся бы
+    with open(os.path.join(directory, LOCK_NAME), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if dead:
+                _compact(directory, dead)
+        aggregate = _read_json(os.path.join(directory, AGGREGATE_NAME))
+        if aggregate is not None:
+            snapshots.append((aggregate['metrics'], False))
+        for name in sorted(started):
+            data = None if aggregate and name in aggregate['merged'] else _read_json(os.path.join(directory, name))
+            if data is not None:
+                snapshots.append((data['metrics'], name in alive))
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {name: {} for name in _registry}
+    for data, alive in snapshots:
+        for name, samples in data.items():
+            metric = _registry.get(name)
+            if metric is None or (metric.kind == 'gauge' and not alive):
+                continue
+            totals = merged[name]
+            for key, value in samples:
+                key = tuple(key)
+                totals[key] = metric.merge(totals.get(key), value)
+    return merged
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render():
+    """Метрики всех процессов в текстовом формате Prometheus"""
+    merged = _merge(_process_snapshots())
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(merged[name].items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{_labels(metric.labelnames, key)} {_format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                cumulative += count
+                le = (('le', _format_value(bound)),)
+                lines.append(f'{name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labelnames, key)} {_format_value(value[-1])}')
+            lines.append(f'{name}_count{_labels(metric.labelnames, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
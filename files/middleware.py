@@ -0,0 +1,89 @@
+import time
+
+from django.db import connection
+
+from . import metrics
+
+# Представления, передающие содержимое файлов: для них учитываются
+# объем передачи и число активных передач
+TRANSFER_VIEWS = {
+    'file_upload': 'upload',
+    'upload_session_chunk': 'upload',
+    'file_download': 'download',
+    'file_archive': 'download',
+}
+
+
+class _QueryCounter:
+    """Обертка execute_wrapper, считающая запросы к БД за время запроса"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _count_streamed(stream, view):
+    for chunk in stream:
+        metrics.DOWNLOAD_BYTES.inc(len(chunk), view=view)
+        yield chunk
+
+
+class MetricsMiddleware:
+    """
+    Метрики запросов: время ответа и число запросов к БД по представлениям,
+    объем загрузок и скачиваний, число активных передач. Потоковый ответ
+    считается активной передачей, пока сервер не закроет его.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.start_flusher()
+        started = time.perf_counter()
+        queries = _QueryCounter()
+        try:
+            with connection.execute_wrapper(queries):
+                response = self.get_response(request)
+        except Exception:
+            self._finish_transfer(request)
+            raise
+
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        metrics.HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, view=view, method=request.method)
+        metrics.HTTP_DB_QUERIES.observe(queries.count, view=view)
+
+        direction = getattr(request, 'metrics_transfer', None)
+        if direction == 'upload':
+            metrics.UPLOAD_BYTES.inc(int(request.META.get('CONTENT_LENGTH') or 0), view=view)
+            self._finish_transfer(request)
+        elif direction == 'download':
+            if response.has_header('Content-Length'):
+                metrics.DOWNLOAD_BYTES.inc(int(response['Content-Length']), view=view)
+            elif response.streaming:
+                response.streaming_content = _count_streamed(response.streaming_content, view)
+            else:
+                metrics.DOWNLOAD_BYTES.inc(len(response.content), view=view)
+            if response.streaming:
+                # Передача идет и после выхода из middleware, до закрытия ответа
+                response._resource_closers.append(lambda: self._finish_transfer(request))
+            else:
+                self._finish_transfer(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        direction = TRANSFER_VIEWS.get(request.resolver_match.url_name)
+        if direction is not None:
+            request.metrics_transfer = direction
+            metrics.ACTIVE_TRANSFERS.inc(direction=direction)
+
+    def _finish_transfer(self, request):
+        direction = getattr(request, 'metrics_transfer', None)
+        if direction is not None:
+            request.metrics_transfer = None
+            metrics.ACTIVE_TRANSFERS.dec(direction=direction)
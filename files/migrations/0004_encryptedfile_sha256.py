@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0003_alter_userkeys_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
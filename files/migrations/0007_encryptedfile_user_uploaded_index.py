@@ -0,0 +1,17 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_fileblob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user', '-uploaded_at', '-id'], name='files_user_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:22
+
+from django.db import migrations, models
+
+from files.search import install_fts, uninstall_fts
+
+
+def create_filename_search(apps, schema_editor):
+    install_fts(schema_editor.connection)
+
+
+def drop_filename_search(apps, schema_editor):
+    uninstall_fts(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_encryptedfile_user_uploaded_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user', 'filename', 'id'], name='files_user_filename_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user', 'size', 'id'], name='files_user_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user', 'is_encrypted', '-uploaded_at', '-id'], name='files_user_encrypted_idx'),
+        ),
+        # Триграммный индекс SQLite FTS5 для поиска подстроки в имени файла
+        migrations.RunPython(create_filename_search, drop_filename_search),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+def mark_client_encrypted(apps, schema_editor):
+    # Все существующие зашифрованные файлы шифровались на клиенте
+    EncryptedFile = apps.get_model('files', 'EncryptedFile')
+    EncryptedFile.objects.filter(is_encrypted=True).update(encryption_mode='client')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_storageusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='encryption_mode',
+            field=models.CharField(choices=[('none', 'Без шифрования'), ('client', 'Шифрование на клиенте'), ('server', 'Шифрование на сервере')], default='none', max_length=10),
+        ),
+        migrations.RunPython(mark_client_encrypted, migrations.RunPython.noop),
+    ]
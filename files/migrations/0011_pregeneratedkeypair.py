@@ -0,0 +1,26 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_encryptedfile_encryption_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PregeneratedKeyPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_key', models.BinaryField()),
+                ('private_key', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Заготовленная пара ключей',
+                'verbose_name_plural': 'Заготовленные пары ключей',
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0011_pregeneratedkeypair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyRotationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('mode', models.CharField(choices=[('client', 'Ключ пользователя'), ('server', 'Мастер-ключ сервера')], max_length=10)),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('completed', 'Завершено'), ('cancelled', 'Отменено')], default='running', max_length=10)),
+                ('new_key_fingerprint', models.CharField(blank=True, max_length=64)),
+                ('max_file_id', models.BigIntegerField()),
+                ('last_file_id', models.BigIntegerField(default=0)),
+                ('total_files', models.IntegerField(default=0)),
+                ('processed_files', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='key_rotation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Перешифрование ключей',
+                'verbose_name_plural': 'Перешифрования ключей',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='keyrotationjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'running')), fields=('user', 'mode'), name='unique_running_key_rotation'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0012_keyrotationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('action', models.CharField(max_length=64)),
+                ('file_id', models.BigIntegerField(blank=True, null=True)),
+                ('bytes', models.BigIntegerField(blank=True, null=True)),
+                ('duration_ms', models.IntegerField(blank=True, null=True)),
+                ('message', models.CharField(max_length=255)),
+                ('details', models.TextField(blank=True)),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Событие аудита',
+                'verbose_name_plural': 'События аудита',
+                'indexes': [models.Index(fields=['user', '-timestamp', '-id'], name='audit_user_time_idx'), models.Index(fields=['action', '-timestamp', '-id'], name='audit_action_time_idx')],
+            },
+        ),
+    ]
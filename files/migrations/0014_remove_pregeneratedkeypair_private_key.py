@@ -0,0 +1,17 @@
+# Generated by Django 4.2.19 on 2026-10-18 08:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0013_auditevent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pregeneratedkeypair',
+            name='private_key',
+        ),
+    ]
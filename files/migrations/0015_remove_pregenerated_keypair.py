@@ -0,0 +1,16 @@
+# Generated by Django 4.2.19 on 2026-10-18 09:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0014_remove_pregeneratedkeypair_private_key'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='PregeneratedKeyPair',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.19 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0015_remove_pregenerated_keypair'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='keyrotationjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'running'), ('user__isnull', True)), fields=('mode',), name='unique_running_server_key_rotation'),
+        ),
+    ]
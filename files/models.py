@@ -1,4 +1,5 @@
 from django.utils import timezone
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -15,6 +16,21 @@ class UserKeys(models.Model):
         verbose_name = "Ключи пользователя"
         verbose_name_plural = "Ключи пользователей"
 
+class FileBlob(models.Model):
+    """Содержимое незашифрованного файла, хранимое один раз на SHA-256"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/', max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)  # Количество ссылающихся EncryptedFile
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
+
+    class Meta:
+        verbose_name = "Содержимое файла"
+        verbose_name_plural = "Содержимое файлов"
+
 class EncryptedFile(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='encrypted_files')
     file = models.FileField(upload_to='encrypted_files/')
@@ -24,6 +40,13 @@ class EncryptedFile(models.Model):
     is_encrypted = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     size = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, null=True, blank=True)  # Контрольная сумма содержимого на диске
+    blob = models.ForeignKey(FileBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='files')  # Общее содержимое для незашифрованных файлов
+    encryption_mode = models.CharField(
+        max_length=10,
+        choices=[('none', 'Без шифрования'), ('client', 'Шифрование на клиенте'), ('server', 'Шифрование на сервере')],
+        default='none'
+    )  # Для 'server' encrypted_aes_key - ключ файла, зашифрованный мастер-ключом сервера
 
     def __str__(self):
         encryption_status = "зашифрован" if self.is_encrypted else "не зашифрован"
@@ -31,5 +54,147 @@ class EncryptedFile(models.Model):
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Постраничный список файлов пользователя (курсор по uploaded_at, id)
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='files_user_uploaded_idx'),
+            # Фильтры и сортировки списка файлов
+            models.Index(fields=['user', 'filename', 'id'], name='files_user_filename_idx'),
+            models.Index(fields=['user', 'size', 'id'], name='files_user_size_idx'),
+            models.Index(fields=['user', 'is_encrypted', '-uploaded_at', '-id'], name='files_user_encrypted_idx'),
+        ]
         verbose_name = "Зашифрованный файл"
-        verbose_name_plural = "Зашифрованные файлы"
\ No newline at end of file
+        verbose_name_plural = "Зашифрованные файлы"
+
+class UploadSession(models.Model):
+    """Сессия загрузки файла по частям"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    is_encrypted = models.BooleanField(default=False)
+    encrypted_aes_key = models.BinaryField(null=True, blank=True)
+    iv = models.BinaryField(null=True, blank=True)
+    storage_name = models.CharField(max_length=255)  # Файл, в который пишутся части
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.id})"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Ожидаемый размер части с указанным номером"""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    class Meta:
+        verbose_name = "Сессия загрузки"
+        verbose_name_plural = "Сессии загрузки"
+
+
+class UploadChunk(models.Model):
+    """Принятая часть файла в сессии загрузки"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Часть загрузки"
+        verbose_name_plural = "Части загрузки"
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
+
+
+class StorageUsage(models.Model):
+    """Занятое пользователем место, обновляется вместе с загрузкой и удалением файлов"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='storage_usage')
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    quota_bytes = models.BigIntegerField(null=True, blank=True)  # Индивидуальная квота; NULL - квота по умолчанию
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.bytes_used} байт"
+
+    class Meta:
+        verbose_name = "Использование хранилища"
+        verbose_name_plural = "Использование хранилища"
+
+class KeyRotationJob(models.Model):
+    """
+    Перешифрование ключей файлов после смены ключа. В режиме 'client'
+    клиент получает ключи файлов пользователя пачками и возвращает их
+    зашифрованными новым публичным ключом; в режиме 'server' ключи файлов,
+    зашифрованных на сервере, перешифровываются текущим мастер-ключом.
+    """
+    MODE_CLIENT = 'client'
+    MODE_SERVER = 'server'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CANCELLED = 'cancelled'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='key_rotation_jobs')  # NULL - все пользователи (режим 'server')
+    mode = models.CharField(max_length=10, choices=[(MODE_CLIENT, 'Ключ пользователя'), (MODE_SERVER, 'Мастер-ключ сервера')])
+    status = models.CharField(
+        max_length=10,
+        choices=[(STATUS_RUNNING, 'Выполняется'), (STATUS_COMPLETED, 'Завершено'), (STATUS_CANCELLED, 'Отменено')],
+        default=STATUS_RUNNING
+    )
+    new_key_fingerprint = models.CharField(max_length=64, blank=True)  # Отпечаток ключа, которым перешифровываются ключи файлов
+    max_file_id = models.BigIntegerField()  # Файлы, загруженные позже, уже зашифрованы новым ключом
+    last_file_id = models.BigIntegerField(default=0)  # Курсор: все файлы с id <= last_file_id обработаны
+    total_files = models.IntegerField(default=0)
+    processed_files = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.mode} {self.id} ({self.processed_files}/{self.total_files})"
+
+    class Meta:
+        constraints = [
+            # Не больше одного незавершенного перешифрования на пользователя
+            models.UniqueConstraint(
+                fields=['user', 'mode'],
+                condition=models.Q(status='running'),
+                name='unique_running_key_rotation'
+            ),
+            # У задач по мастер-ключу user пуст, а NULL не участвует в уникальности
+            models.UniqueConstraint(
+                fields=['mode'],
+                condition=models.Q(status='running', user__isnull=True),
+                name='unique_running_server_key_rotation'
+            ),
+        ]
+        verbose_name = "Перешифрование ключей"
+        verbose_name_plural = "Перешифрования ключей"
+
+class AuditEvent(models.Model):
+    """Запись журнала аудита (только добавление; очистка - командой purge_audit_events)"""
+    timestamp = models.DateTimeField()
+    # Без внешнего ключа: история сохраняется и после удаления пользователя
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, blank=True, related_name='+')
+    action = models.CharField(max_length=64)  # Код действия, см. files/audit.py
+    file_id = models.BigIntegerField(null=True, blank=True)
+    bytes = models.BigIntegerField(null=True, blank=True)
+    duration_ms = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255)  # Текст действия
+    details = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.timestamp} {self.user_id} {self.action}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'], name='audit_user_time_idx'),
+            models.Index(fields=['action', '-timestamp', '-id'], name='audit_action_time_idx'),
+        ]
+        verbose_name = "Событие аудита"
+        verbose_name_plural = "События аудита"
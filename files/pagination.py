@@ -0,0 +1,71 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы поврежден или не соответствует сортировке"""
+
+
+def encode_cursor(value, pk):
+    """Кодирует позицию последней записи страницы в непрозрачную строку"""
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = json.dumps([value, pk], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, field=None):
+    """Декодирует курсор в пару (значение поля сортировки, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        pk = int(pk)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if field is not None:
+        # Курсор мог быть выдан для другой сортировки: значение должно
+        # подходить полю, иначе фильтр упадет уже в запросе
+        try:
+            value = field.to_python(value)
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        if value is None:
+            raise InvalidCursor(cursor)
+    return value, pk
+
+
+def keyset_filter(field_name, value, pk, descending):
+    """
+    Условие "после курсора" для сортировки по (field_name, id) в одном
+    направлении: позволяет СУБД продолжить чтение индекса с нужного места
+    вместо OFFSET.
+    """
+    lookup = 'lt' if descending else 'gt'
+    # Первое условие ограничивает диапазон индекса, второе отсекает
+    # уже отданные записи с тем же значением поля
+    return Q(**{f'{field_name}__{lookup}e': value}) & (
+        Q(**{f'{field_name}__{lookup}': value}) | Q(**{f'id__{lookup}': pk})
+    )
+
+
+def paginate_keyset(queryset, field_name, descending, cursor, limit):
+    """
+    Возвращает (записи страницы, курсор следующей страницы или None).
+    queryset должен быть результатом .values(), включающим field_name и id.
+    """
+    if cursor:
+        field = queryset.model._meta.get_field(field_name)
+        value, pk = decode_cursor(cursor, field)
+        queryset = queryset.filter(keyset_filter(field_name, value, pk, descending))
+
+    prefix = '-' if descending else ''
+    rows = list(queryset.order_by(f'{prefix}{field_name}', f'{prefix}id')[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][field_name], rows[-1]['id'])
+    return rows, next_cursor
@@ -0,0 +1,97 @@
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+# Полнотекстовая таблица SQLite FTS5 (триграммы) для поиска подстроки в имени файла
+FTS_TABLE = 'files_encryptedfile_fts'
+
+# Минимальная длина подстроки, которую может найти триграммный индекс
+FTS_MIN_LENGTH = 3
+
+FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON files_encryptedfile BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, filename) VALUES (new.id, new.filename);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON files_encryptedfile BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename) VALUES ('delete', old.id, old.filename);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF filename ON files_encryptedfile BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, filename) VALUES ('delete', old.id, old.filename);
+        INSERT INTO {FTS_TABLE}(rowid, filename) VALUES (new.id, new.filename);
+    END
+    """,
+]
+
+
+def fts_supported(conn):
+    """Доступен ли в SQLite модуль FTS5 с триграммным токенизатором"""
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+            cursor.execute("DROP TABLE temp.fts_probe")
+        except Exception:
+            return False
+    return True
+
+
+def install_fts(conn, repair_only=False):
+    """
+    Создает FTS таблицу и триггеры синхронизации, если их нет.
+    Пересоздание таблицы миграциями SQLite удаляет триггеры, поэтому
+    после каждого migrate функция вызывается с repair_only=True: триггеры
+    восстанавливаются, а индекс перестраивается.
+    """
+    if not fts_supported(conn):
+        return
+    if repair_only and FTS_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{FTS_TABLE}_a%']
+        )
+        triggers_installed = cursor.fetchone()[0] == len(FTS_TRIGGERS)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"filename, content='files_encryptedfile', content_rowid='id', tokenize='trigram')"
+        )
+        for trigger in FTS_TRIGGERS:
+            cursor.execute(trigger)
+        if not triggers_installed:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_fts(conn):
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+@lru_cache(maxsize=None)
+def _fts_table_exists():
+    return FTS_TABLE in connection.introspection.table_names()
+
+
+def filter_filename_contains(queryset, substring):
+    """
+    Фильтр по подстроке в имени файла (без учета регистра). Для подстрок
+    от трех символов используется триграммный индекс FTS5, для коротких -
+    обычный LIKE в пределах файлов пользователя.
+    """
+    if len(substring) >= FTS_MIN_LENGTH and _fts_table_exists():
+        phrase = '"' + substring.replace('"', '""') + '"'
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase]
+        ))
+    return queryset.filter(filename__icontains=substring)
@@ -0,0 +1,102 @@
+import base64
+from functools import lru_cache
+
+from django.conf import settings
+
+from .crypto_pool import get_pool
+from .crypto_utils import decrypt_stream, derive_key, generate_aes_key, unwrap_key, wrap_key
+from .storage import stored_file_path
+
+# Режимы шифрования файла (EncryptedFile.encryption_mode)
+ENCRYPTION_NONE = 'none'
+ENCRYPTION_CLIENT = 'client'
+ENCRYPTION_SERVER = 'server'
+
+
+def _decode_master_key(value, setting):
+    key = base64.b64decode(value)
+    if len(key) != 32:
+        raise ValueError(f"{setting} должен содержать 32 байта")
+    return key
+
+
+def _secret_key_master_key():
+    return derive_key(settings.SECRET_KEY, b'files.server-encryption.master-key')
+
+
+@lru_cache(maxsize=None)
+def server_master_key():
+    """
+    Мастер-ключ серверного шифрования: settings.FILE_SERVER_ENCRYPTION_KEY
+    (base64, 32 байта) либо ключ, выведенный из SECRET_KEY.
+    """
+    if settings.FILE_SERVER_ENCRYPTION_KEY:
+        return _decode_master_key(settings.FILE_SERVER_ENCRYPTION_KEY, 'FILE_SERVER_ENCRYPTION_KEY')
+    return _secret_key_master_key()
+
+
+@lru_cache(maxsize=None)
+def previous_master_keys():
+    """
+    Прежние мастер-ключи (settings.FILE_SERVER_ENCRYPTION_OLD_KEYS): ими
+    расшифровываются ключи файлов, еще не перешифрованные после смены
+    мастер-ключа. Ключ из SECRET_KEY проверяется последним.
+    """
+    keys = [_decode_master_key(value, 'FILE_SERVER_ENCRYPTION_OLD_KEYS') for value in settings.FILE_SERVER_ENCRYPTION_OLD_KEYS]
+    if settings.FILE_SERVER_ENCRYPTION_KEY:
+        keys.append(_secret_key_master_key())
+    return keys
+
+
+def _key_context(user_id):
+    return f'user:{user_id}'.encode('ascii')
+
+
+def new_file_key(user):
+    """Новый ключ файла: (ключ, ключ зашифрованный мастер-ключом)"""
+    key, _ = generate_aes_key()
+    return key, wrap_key(server_master_key(), key, _key_context(user.id))
+
+
+def unwrap_file_key(wrapped_key, user_id):
+    """Ключ файла и признак того, что он зашифрован текущим мастер-ключом"""
+    wrapped_key = bytes(wrapped_key)
+    context = _key_context(user_id)
+    try:
+        return unwrap_key(server_master_key(), wrapped_key, context), True
+    except ValueError:
+        pass
+    for master_key in previous_master_keys():
+        try:
+            return unwrap_key(master_key, wrapped_key, context), False
+        except ValueError:
+            continue
+    raise ValueError("Ключ файла не подходит ни к одному мастер-ключу")
+
+
+def rewrap_file_key(wrapped_key, user_id):
+    """Ключ файла, зашифрованный текущим мастер-ключом, или None, если он уже такой"""
+    key, current = unwrap_file_key(wrapped_key, user_id)
+    if current:
+        return None
+    return wrap_key(server_master_key(), key, _key_context(user_id))
+
+
+def file_key(file_instance):
+    """Ключ файла, зашифрованного на сервере"""
+    return unwrap_file_key(file_instance.encrypted_aes_key, file_instance.user_id)[0]
+
+
+def decrypted_reader(file_instance):
+    """
+    Функция read_range(start, end) для serve_file: расшифровывает только
+    сегменты, покрывающие диапазон, AES операции выполняются в пуле.
+    """
+    key = file_key(file_instance)
+    path = stored_file_path(file_instance.file.name)
+
+    def read_range(start, end):
+        with open(path, 'rb') as f:
+            yield from decrypt_stream(f, key, start, end, map_segments=get_pool().map_ordered)
+
+    return read_range
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import default_storage
+
+# Каталог внутри MEDIA_ROOT, в котором хранятся загруженные файлы
+UPLOAD_DIR = 'encrypted_files'
+
+# Каталог для файлов незавершенных сессий загрузки
+UPLOAD_SESSION_DIR = 'upload_sessions'
+
+# Каталог общего хранилища содержимого (адресация по SHA-256)
+BLOB_DIR = 'blobs'
+
+
+# Имя файла в раскладке по подкаталогам: encrypted_files/ab/cd/<имя>
+SHARDED_NAME_RE = re.compile(rf'^{UPLOAD_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[^/]+$')
+
+
+def sharded_storage_name(name):
+    """
+    Имя файла в раскладке encrypted_files/ab/cd/<имя>, где ab/cd - начало
+    SHA-256 имени файла: в одном каталоге не оказывается миллионов файлов.
+    """
+    basename = os.path.basename(name)
+    digest = hashlib.sha256(basename.encode('utf-8')).hexdigest()
+    return f"{UPLOAD_DIR}/{digest[:2]}/{digest[2:4]}/{basename}"
+
+
+def is_sharded_name(name):
+    return bool(SHARDED_NAME_RE.match(name))
+
+
+def generate_storage_name(original_filename):
+    """Генерирует уникальное имя файла в хранилище, сохраняя расширение"""
+    file_extension = os.path.splitext(original_filename)[1]
+    return sharded_storage_name(f"{uuid.uuid4()}{file_extension}")
+
+
+def stored_file_path(name):
+    """
+    Абсолютный путь к файлу хранилища. Во время переноса в раскладку по
+    подкаталогам (migrate_storage_layout) файл записи со старым именем
+    может уже лежать по новому пути.
+    """
+    path = default_storage.path(name)
+    if name.startswith(f'{UPLOAD_DIR}/') and not is_sharded_name(name) and not os.path.exists(path):
+        sharded_path = default_storage.path(sharded_storage_name(name))
+        if os.path.exists(sharded_path):
+            return sharded_path
+    return path
+
+
+def blob_storage_name(sha256):
+    """Возвращает имя файла содержимого в общем хранилище: blobs/ab/cd/<sha256>"""
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def storage_path(name):
+    """Возвращает абсолютный путь к файлу хранилища и создает его каталог"""
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def delete_stored_file(name):
+    """Удаляет файл из хранилища, если он существует"""
+    if not name:
+        return
+    try:
+        os.remove(stored_file_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def allocate_file(name, size):
+    """Создает файл заданного размера (разреженный, если ФС это поддерживает)"""
+    with open(storage_path(name), 'xb') as f:
+        f.truncate(size)
+
+
+def write_stream_at(name, offset, stream, length, block_size=64 * 1024):
+    """
+    Записывает length байт из stream в файл хранилища начиная с offset.
+    Данные копируются блоками, поэтому несколько запросов могут
+    параллельно писать в разные участки одного файла.
+    Возвращает количество реально прочитанных из stream байт.
+    """
+    written = 0
+    fd = os.open(default_storage.path(name), os.O_WRONLY)
+    try:
+        while written < length:
+            block = stream.read(min(block_size, length - written))
+            if not block:
+                break
+            os.pwrite(fd, block, offset + written)
+            written += len(block)
+    finally:
+        os.close(fd)
+    return written
+
+
+def move_stored_file(source_name, target_name):
+    """Переименовывает файл внутри хранилища без копирования данных"""
+    os.replace(stored_file_path(source_name), storage_path(target_name))
+
+
+def hash_stored_file(name, block_size=1024 * 1024):
+    """Считает SHA-256 файла хранилища, читая его блоками"""
+    digest = hashlib.sha256()
+    with open(stored_file_path(name), 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -1,3 +1,282 @@
-from django.test import TestCase
+import base64
+import os
+import re
+import tempfile
+import time
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import RegistrationKey
+
+from .crypto_utils import encrypt_aes_key, generate_rsa_key_pair
+from .filters import filter_files
+from .logger import DatabaseSink, LoggingSink, _format_record
+from .models import AuditEvent, EncryptedFile, KeyRotationJob
+from .pagination import keyset_filter
+
+
+def api_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    return client
+
+
+# Журнал действий пишет фоновый поток; в тестах он не должен обращаться к тестовой БД
+@override_settings(AUDIT_LOG_SINKS=[])
+class FilesTestCase(TestCase):
+    pass
+
+
+class KeyRotationTests(FilesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.key_pairs = [generate_rsa_key_pair() for _ in range(3)]
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.client = api_client(self.user)
+
+    def update_key(self, key_pair):
+        return self.client.post(
+            '/api/files/keys/', {'public_key': base64.b64encode(key_pair['public_key']).decode()}, format='json'
+        )
+
+    def test_key_change_during_rotation_restarts_job(self):
+        self.update_key(self.key_pairs[0])
+        EncryptedFile.objects.create(
+            user=self.user, file='encrypted_files/a', filename='a', size=1, is_encrypted=True,
+            encryption_mode=KeyRotationJob.MODE_CLIENT, iv=b'i' * 16,
+            encrypted_aes_key=encrypt_aes_key(os.urandom(32), self.key_pairs[0]['public_key'])
+        )
+        first_job = self.update_key(self.key_pairs[1]).data['key_rotation_job']
+
+        response = self.update_key(self.key_pairs[2])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['key_rotation_job'], first_job)
+        self.assertEqual(KeyRotationJob.objects.get(id=first_job).status, KeyRotationJob.STATUS_CANCELLED)
+        self.assertEqual(KeyRotationJob.objects.filter(status=KeyRotationJob.STATUS_RUNNING).count(), 1)
+
+    def test_cancel_running_job(self):
+        self.update_key(self.key_pairs[0])
+        EncryptedFile.objects.create(
+            user=self.user, file='encrypted_files/a', filename='a', size=1, is_encrypted=True,
+            encryption_mode=KeyRotationJob.MODE_CLIENT, iv=b'i' * 16, encrypted_aes_key=b'k' * 256
+        )
+        job_id = self.update_key(self.key_pairs[1]).data['key_rotation_job']
+
+        response = self.client.delete(f'/api/files/keys/rotations/{job_id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], KeyRotationJob.STATUS_CANCELLED)
+        self.assertEqual(self.client.delete(f'/api/files/keys/rotations/{job_id}/').status_code, 409)
+
+    def test_single_running_server_job(self):
+        KeyRotationJob.objects.create(mode=KeyRotationJob.MODE_SERVER, new_key_fingerprint='a', max_file_id=0, total_files=1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            KeyRotationJob.objects.create(mode=KeyRotationJob.MODE_SERVER, new_key_fingerprint='b', max_file_id=0, total_files=1)
+
+
+class PublicKeyTests(FilesTestCase):
+    def test_registered_user_has_no_public_key(self):
+        key = RegistrationKey.objects.create()
+        response = APIClient().post(
+            '/api/users/register/', {'username': 'newcomer', 'password': 'secret', 'registration_key': str(key.key)}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+        # Закрытый ключ создается только на клиенте, сервер не выдает свою пару
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(api_client(user).get('/api/files/keys/public/').status_code, 404)
+
+
+class FileListTests(FilesTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.client = api_client(self.user)
+        for i in range(3):
+            EncryptedFile.objects.create(user=self.user, file=f'encrypted_files/{i}', filename=f'{i}.txt', size=i)
+
+    def test_cursor_walks_all_pages(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, 'sort': 'size'}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/api/files/', params).data
+            seen.extend(row['size'] for row in data['files'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [0, 1, 2])
+
+    def test_cursor_from_another_sort_is_rejected(self):
+        cursor = self.client.get('/api/files/', {'limit': 1}).data['next_cursor']
+
+        response = self.client.get('/api/files/', {'limit': 1, 'sort': 'size', 'cursor': cursor})
+
+        self.assertEqual(response.status_code, 400)
+
+
+
+class FileDownloadTests(FilesTestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_override = self.settings(MEDIA_ROOT=media_root.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.user = User.objects.create(username='owner')
+        self.client = api_client(self.user)
+        name = default_storage.save('encrypted_files/report.bin', ContentFile(self.content))
+        self.file = EncryptedFile.objects.create(user=self.user, file=name, filename='report.bin', size=len(self.content))
+        self.url = f'/api/files/{self.file.id}/'
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect', FILE_DOWNLOAD_ACCEL_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.file.file.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.file.file.name))
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect')
+    def test_offload_leaves_range_to_proxy(self):
+        etag = self.client.get(self.url)['ETag']
+
+        # Range и If-Range обрабатывает прокси: Django не отвечает 206 сам
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Accel-Redirect', response)
+        self.assertNotIn('Content-Range', response)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], etag)
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD=None)
+    def test_fallback_streams_file(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD=None)
+    def test_fallback_range_and_if_range(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        # Устаревший If-Range: отдается весь файл
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+
+
+class AuditSinkTests(FilesTestCase):
+    def failed_record(self, user):
+        try:
+            1 / 0
+        except ZeroDivisionError as e:
+            exc = e
+        return _format_record({
+            'timestamp': time.time(), 'user_id': user.id, 'username': user.username,
+            'action': 'Ошибка при скачивании файла', 'code': None, 'details': 'division by zero', 'exc': exc,
+        })
+
+    def test_database_sink_keeps_traceback(self):
+        user = User.objects.create(username='owner')
+
+        DatabaseSink().write([self.failed_record(user)])
+
+        details = AuditEvent.objects.get().details
+        self.assertTrue(details.startswith('division by zero\n'))
+        self.assertIn('ZeroDivisionError', details)
+
+    def test_logging_sink_keeps_traceback(self):
+        user = User.objects.create(username='owner')
+
+        with self.assertLogs('user_actions') as logs:
+            LoggingSink().write([self.failed_record(user)])
+
+        self.assertIn('Traceback', logs.output[0])
+        self.assertIn('ZeroDivisionError', logs.output[0])
+
+
+# Наборы параметров списка файлов, план которых проверяется
+PLAN_CASES = [
+    '',
+    'name_prefix=report',
+    'q=install',
+    'q=ab',
+    'size_min=1024&size_max=1048576',
+    'uploaded_after=2024-01-01&uploaded_before=2024-12-31',
+    'is_encrypted=true',
+    'sort=filename',
+    'sort=-filename',
+    'sort=size',
+    'sort=-size',
+    'sort=uploaded_at',
+    'name_prefix=report&sort=filename',
+    'size_min=1024&sort=-size',
+    'is_encrypted=false&uploaded_after=2024-01-01',
+]
+
+# Полный просмотр таблицы файлов (просмотр индекса или FTS таблицы допустим)
+FULL_SCAN_RE = re.compile(r'\bSCAN files_encryptedfile\b(?! USING)(?!_fts)')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов проверяются только на SQLite')
+class FileListPlanTests(FilesTestCase):
+    """Фильтры и сортировки списка файлов не должны приводить к полному просмотру таблицы"""
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_filters_use_indexes(self):
+        user = User.objects.create(username='owner')
+        for case in PLAN_CASES:
+            queryset = EncryptedFile.objects.filter(user=user).values('id', 'filename', 'size', 'is_encrypted', 'uploaded_at')
+            queryset, sort_field, descending = filter_files(queryset, QueryDict(case))
+
+            # Проверяется и первая страница, и продолжение по курсору
+            sample_value = {'uploaded_at': '2024-06-01T00:00:00+00:00', 'filename': 'm', 'size': 1}[sort_field]
+            prefix = '-' if descending else ''
+            pages = {
+                'first page': queryset,
+                'next page': queryset.filter(keyset_filter(sort_field, sample_value, 1, descending)),
+            }
+            for page, page_queryset in pages.items():
+                with self.subTest(case=case or '(default)', page=page):
+                    plan = self.query_plan(page_queryset.order_by(f'{prefix}{sort_field}', f'{prefix}id')[:101])
+                    self.assertFalse(any(FULL_SCAN_RE.search(step) for step in plan), '\n'.join(plan))
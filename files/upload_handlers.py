@@ -0,0 +1,174 @@
+import hashlib
+import os
+from collections import deque
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .crypto_pool import CryptoPoolBusy, get_pool
+from .crypto_utils import DEFAULT_SEGMENT_SIZE, encrypt_segment, new_chunked_header, segment_nonce
+from .storage import delete_stored_file, generate_storage_name, storage_path
+
+
+class StoredUploadedFile(UploadedFile):
+    """Файл, который уже записан обработчиком загрузки в хранилище"""
+
+    def __init__(self, file, name, storage_name, size, sha256, content_type=None, charset=None,
+                 content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        # Имя файла относительно MEDIA_ROOT (значение для FileField)
+        self.storage_name = storage_name
+        # SHA-256 содержимого, посчитанный во время записи
+        self.sha256 = sha256
+
+
+class StreamingFileUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки, который пишет каждый пришедший фрагмент запроса
+    сразу в итоговый файл в encrypted_files/, одновременно считая размер
+    и SHA-256. В памяти держится только текущий фрагмент.
+    С encryption_key файл шифруется по мере поступления в потоковом
+    формате AES-GCM: сегменты шифруются в пуле потоков, пока читаются
+    следующие фрагменты запроса; размер и SHA-256 относятся к открытому тексту.
+    """
+
+    # Допустимый объем служебных данных multipart сверх размера файла
+    # при предварительной проверке квоты по Content-Length
+    MULTIPART_OVERHEAD = 16 * 1024
+
+    def __init__(self, request=None, max_size=None, quota_remaining=None, encryption_key=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.encryption_key = encryption_key
+        # Сколько байт еще помещается в квоту пользователя (None - без ограничений)
+        self.quota_remaining = quota_remaining
+        # Размер отклоненного файла, если он превысил max_size
+        self.rejected_size = None
+        self.quota_exceeded = False
+        # Пул шифрования был переполнен, файл не сохранен
+        self.pool_busy = False
+        self.stored_names = []
+        self._file = None
+        self._storage_name = None
+        self._hash = None
+        self._size = 0
+        self._cipher = None
+        self._header = None
+        self._nonce_prefix = None
+        self._buffer = None
+        self._segment_index = 0
+        self._pending = deque()
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Запрос, который заведомо не помещается в квоту, отклоняется
+        # до записи на диск: тело не читается, файлов в запросе нет
+        if self.quota_remaining is not None and content_length > self.quota_remaining + self.MULTIPART_OVERHEAD:
+            self.quota_exceeded = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._storage_name = generate_storage_name(self.file_name)
+        self._file = open(storage_path(self._storage_name), 'xb')
+        self._hash = hashlib.sha256()
+        self._size = 0
+        if self.encryption_key is not None:
+            self._cipher = AESGCM(self.encryption_key)
+            self._header, self._nonce_prefix = new_chunked_header(DEFAULT_SEGMENT_SIZE)
+            self._buffer = bytearray()
+            self._segment_index = 0
+            self._file.write(self._header)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self.max_size is not None and self._size > self.max_size:
+            self.rejected_size = self._size
+            self._discard_current()
+            raise SkipFile()
+        if self.quota_remaining is not None and self._size > self.quota_remaining:
+            self.quota_exceeded = True
+            self._discard_current()
+            raise SkipFile()
+        self._hash.update(raw_data)
+        if self._cipher is None:
+            self._file.write(raw_data)
+            return
+        self._buffer += raw_data
+        try:
+            self._encrypt_segments()
+        except CryptoPoolBusy:
+            self.pool_busy = True
+            self._discard_current()
+            raise SkipFile()
+
+    def file_complete(self, file_size):
+        if self._file is None:
+            return None
+        if self._cipher is not None:
+            try:
+                self._encrypt_segments(final=True)
+            except CryptoPoolBusy:
+                self.pool_busy = True
+                self._discard_current()
+                return None
+        self._file.close()
+        self.stored_names.append(self._storage_name)
+        uploaded = StoredUploadedFile(
+            file=self._file,
+            name=self.file_name,
+            storage_name=self._storage_name,
+            size=self._size,
+            sha256=self._hash.hexdigest(),
+            content_type=self.content_type,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        self._file = None
+        return uploaded
+
+    def _encrypt_segments(self, final=False):
+        """Отдает накопленные полные сегменты в пул и пишет готовые по порядку"""
+        pool = get_pool()
+        # Последний сегмент определяется только в конце файла, поэтому
+        # полный сегмент шифруется, когда за ним уже есть данные
+        while len(self._buffer) > DEFAULT_SEGMENT_SIZE:
+            self._submit_segment(pool, self._buffer[:DEFAULT_SEGMENT_SIZE], last=False)
+            del self._buffer[:DEFAULT_SEGMENT_SIZE]
+        if final:
+            self._submit_segment(pool, self._buffer, last=True)
+            self._buffer = bytearray()
+        depth = 0 if final else pool.pipeline_depth
+        while len(self._pending) > depth:
+            self._file.write(self._pending.popleft().result())
+
+    def _submit_segment(self, pool, segment, last):
+        nonce = segment_nonce(self._nonce_prefix, self._segment_index, last)
+        self._pending.append(pool.submit(encrypt_segment, self._cipher, nonce, bytes(segment), self._header))
+        self._segment_index += 1
+
+    def upload_interrupted(self):
+        self._discard_current()
+
+    def discard(self, keep=None):
+        """Удаляет все записанные этим обработчиком файлы, кроме keep"""
+        self._discard_current()
+        for name in self.stored_names:
+            if name != keep:
+                delete_stored_file(name)
+        self.stored_names = [name for name in self.stored_names if name == keep]
+
+    def _discard_current(self):
+        while self._pending:
+            self._pending.popleft().cancel()
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except FileNotFoundError:
+                pass
+            self._file = None
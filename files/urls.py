@@ -4,7 +4,20 @@ from . import views
 urlpatterns = [
     path('', views.file_list, name='file_list'),
     path('upload/', views.file_upload, name='file_upload'),
+    path('uploads/', views.upload_session_create, name='upload_session_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_session_detail, name='upload_session_detail'),
+    path('uploads/<uuid:upload_id>/chunks/<int:index>/', views.upload_session_chunk, name='upload_session_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_session_complete, name='upload_session_complete'),
+    path('usage/', views.storage_usage, name='storage_usage'),
+    path('crypto-pool/', views.crypto_pool_stats, name='crypto_pool_stats'),
+    path('audit/', views.audit_events, name='audit_events'),
+    path('metrics/', views.metrics_export, name='metrics_export'),
+    path('archive/', views.file_archive, name='file_archive'),
     path('<int:file_id>/', views.file_download, name='file_download'),
+    path('<int:file_id>/meta/', views.file_meta, name='file_meta'),
     path('keys/', views.update_public_key, name='update_public_key'),
     path('keys/public/', views.get_public_key, name='get_public_key'),
+    path('keys/rotations/', views.key_rotation_create, name='key_rotation_create'),
+    path('keys/rotations/<uuid:job_id>/', views.key_rotation_detail, name='key_rotation_detail'),
+    path('keys/rotations/<uuid:job_id>/batch/', views.key_rotation_batch, name='key_rotation_batch'),
 ]
\ No newline at end of file
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import StorageUsage, UploadSession
+
+
+class QuotaExceeded(Exception):
+    """Файл не помещается в квоту пользователя"""
+
+
+def get_usage(user):
+    usage, _ = StorageUsage.objects.get_or_create(user=user)
+    return usage
+
+
+def effective_quota(usage):
+    """Квота пользователя в байтах или None, если место не ограничено"""
+    if usage.quota_bytes is not None:
+        return usage.quota_bytes
+    return settings.FILE_STORAGE_DEFAULT_QUOTA
+
+
+def remaining_quota(user):
+    """Сколько байт пользователь еще может загрузить (None - без ограничений)"""
+    usage = get_usage(user)
+    quota = effective_quota(usage)
+    if quota is None:
+        return None
+    return max(quota - usage.bytes_used, 0)
+
+
+def active_upload_sessions(user):
+    """Число незавершенных сессий загрузки пользователя и их суммарный размер"""
+    totals = UploadSession.objects.filter(user=user, expires_at__gt=timezone.now()).aggregate(
+        count=Count('id'), size=Sum('size')
+    )
+    return totals['count'], totals['size'] or 0
+
+
+@contextmanager
+def lock_usage(user):
+    """
+    Транзакция, в которой проверки квоты пользователя не пересекаются с
+    параллельными запросами: первым выполняется пустой UPDATE его счетчика,
+    который блокирует строку (на SQLite - всю БД на запись).
+    """
+    usage = get_usage(user)
+    with transaction.atomic():
+        StorageUsage.objects.filter(pk=usage.pk).update(bytes_used=F('bytes_used'))
+        yield
+
+
+def charge_usage(user, size):
+    """
+    Учитывает новый файл в счетчике пользователя. Проверка квоты и
+    увеличение счетчика выполняются одним UPDATE, поэтому параллельные
+    загрузки не могут вместе превысить квоту. Вызывается в транзакции
+    сохранения EncryptedFile.
+    """
+    # Первым в транзакции выполняется UPDATE: на SQLite транзакция, начатая
+    # с чтения, не может дождаться блокировки записи и сразу получает
+    # "database is locked", если другое соединение в этот момент фиксирует запись
+    within_quota = Q(quota_bytes__isnull=False, bytes_used__lte=F('quota_bytes') - size)
+    if settings.FILE_STORAGE_DEFAULT_QUOTA is None:
+        within_quota |= Q(quota_bytes__isnull=True)
+    else:
+        within_quota |= Q(quota_bytes__isnull=True, bytes_used__lte=settings.FILE_STORAGE_DEFAULT_QUOTA - size)
+
+    for _ in range(2):
+        if StorageUsage.objects.filter(within_quota, user=user).update(
+            bytes_used=F('bytes_used') + size, file_count=F('file_count') + 1
+        ):
+            return
+        if StorageUsage.objects.filter(user=user).exists():
+            raise QuotaExceeded()
+        # Счетчика еще нет: создаем его и повторяем
+        get_usage(user)
+    raise QuotaExceeded()
+
+
+def release_usage(user_id, size):
+    """Уменьшает счетчик пользователя при удалении файла"""
+    StorageUsage.objects.filter(user_id=user_id).update(
+        bytes_used=Greatest(F('bytes_used') - (size or 0), Value(0)),
+        file_count=Greatest(F('file_count') - 1, Value(0))
+    )
@@ -1,17 +1,18 @@
-from django.utils.crypto import get_random_string
-from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.utils.crypto import constant_time_compare, get_random_string
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import BasePermission, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 import os
-from django.http import JsonResponse, FileResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.files.storage import FileSystemStorage
 from django.shortcuts import get_object_or_404
 from django.utils.encoding import smart_str
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
 import mimetypes
-import tempfile
-from .models import EncryptedFile, UserKeys
+from .models import AuditEvent, EncryptedFile, KeyRotationJob, UserKeys, UploadSession, UploadChunk
 from .crypto_utils import (
     generate_rsa_key_pair,
     encrypt_aes_key,
@@ -21,166 +22,466 @@ from .crypto_utils import (
     export_public_key,
     export_private_key,
     encrypt_file_content,
-    decrypt_file_content
+    decrypt_file_content,
+    invalidate_cached_key
 )
-from django.core.files.base import ContentFile
 import json
 import base64
+import time
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 import uuid
+from users.authentication import CachedJWTAuthentication
 from .logger import log_user_action
+from .upload_handlers import StreamingFileUploadHandler
+from .blobs import atomic_blob_store, delete_encrypted_file, store_blob
+from .downloads import serve_file
+from .usage import QuotaExceeded, active_upload_sessions, charge_usage, get_usage, effective_quota, lock_usage, remaining_quota
+from .archives import stream_zip
+from .crypto_pool import get_pool
+from . import metrics
+from .key_rotation import InvalidRotationBatch, apply_client_batch, cancel_job, job_progress, next_batch, start_client_rotation
+from .server_encryption import ENCRYPTION_CLIENT, ENCRYPTION_NONE, ENCRYPTION_SERVER, decrypted_reader, new_file_key
+from .pagination import InvalidCursor, paginate_keyset
+from .filters import InvalidFilter, filter_files
+from .audit import filter_audit_events
+from .storage import (
+    UPLOAD_SESSION_DIR,
+    allocate_file,
+    delete_stored_file,
+    generate_storage_name,
+    hash_stored_file,
+    move_stored_file,
+    stored_file_path,
+    write_stream_at
+)
+
+
+# Максимальный размер файла, загружаемого одним запросом (100MB)
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
 
 
 # Функция загрузки файла с шифрованием
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def file_upload(request):
+    started = time.monotonic()
+    # Шифрование на сервере включается параметром строки запроса ?encrypt=server:
+    # режим нужно знать до того, как начнет приходить содержимое файла
+    server_encrypt = request.GET.get('encrypt') == ENCRYPTION_SERVER
+    file_key, wrapped_file_key = new_file_key(request.user) if server_encrypt else (None, None)
+
+    # Файл пишется на диск потоково, без буферизации всего содержимого в памяти
+    upload_handler = StreamingFileUploadHandler(
+        request,
+        max_size=MAX_UPLOAD_SIZE,
+        quota_remaining=remaining_quota(request.user),
+        encryption_key=file_key
+    )
+    request.upload_handlers = [upload_handler]
     try:
-        if 'file' not in request.FILES:
+        # Разбор тела запроса: файл записывается на диск по мере поступления
+        uploaded_files = request.FILES
+
+        # Проверка квоты пользователя
+        if upload_handler.quota_exceeded:
+            upload_handler.discard()
+            log_user_action(request.user, "Попытка загрузки файла", "Превышена квота хранилища")
+            return Response({'error': 'Превышена квота хранилища'}, status=413)
+
+        # Пул шифрования переполнен
+        if upload_handler.pool_busy:
+            upload_handler.discard()
+            log_user_action(request.user, "Попытка загрузки файла", "Пул шифрования перегружен")
+            return Response({'error': 'Сервер перегружен, повторите попытку позже'}, status=503, headers={'Retry-After': '5'})
+
+        # Проверка размера файла (максимум 100MB)
+        if upload_handler.rejected_size is not None:
+            upload_handler.discard()
+            log_user_action(request.user, "Попытка загрузки файла", f"Превышен размер файла: {upload_handler.rejected_size} байт")
+            return Response({'error': 'Размер файла превышает 100MB'}, status=400)
+
+        if 'file' not in uploaded_files:
+            upload_handler.discard()
             log_user_action(request.user, "Попытка загрузки файла", "Файл не найден")
             return Response({'error': 'Файл не найден'}, status=400)
-            
-        file = request.FILES['file']
+
+        file = uploaded_files['file']
         encrypt = request.POST.get('encrypt', 'false').lower() == 'true'
-        
-        # Проверка размера файла (максимум 100MB)
-        if file.size > 100 * 1024 * 1024:
-            log_user_action(request.user, "Попытка загрузки файла", f"Превышен размер файла: {file.size} байт")
-            return Response({'error': 'Размер файла превышает 100MB'}, status=400)
-        
-        # Получаем оригинальное имя файла и расширение
+        if request.POST.get('encrypt', '').lower() == ENCRYPTION_SERVER and not server_encrypt:
+            upload_handler.discard()
+            log_user_action(request.user, "Попытка загрузки файла", "Режим шифрования на сервере указан только в теле запроса")
+            return Response({'error': 'Для шифрования на сервере передайте encrypt=server в строке запроса'}, status=400)
+        if server_encrypt:
+            encrypt = False
+            encryption_mode = ENCRYPTION_SERVER
+        else:
+            encryption_mode = ENCRYPTION_CLIENT if encrypt else ENCRYPTION_NONE
+
+        # Удаляем лишние файлы, если в запросе их было несколько
+        upload_handler.discard(keep=file.storage_name)
+
+        # Оригинальное имя файла; на диске файл уже лежит под уникальным именем
         original_filename = file.name
-        file_extension = os.path.splitext(original_filename)[1]
-        
-        # Генерируем уникальное имя файла, сохраняя расширение
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # Создаем запись в базе данных без сохранения файла
+
+        # Создаем запись в базе данных, указывая на уже записанный файл
         file_instance = EncryptedFile(
             user=request.user,
             filename=original_filename,
             size=file.size,
-            is_encrypted=encrypt
+            sha256=file.sha256,
+            is_encrypted=encrypt,
+            encryption_mode=encryption_mode,
+            encrypted_aes_key=wrapped_file_key
         )
-        
-        # Считываем содержимое файла
-        file_content = file.read()
-        
+        file_instance.file.name = file.storage_name
+
         # Если нужно шифрование
         if encrypt:
             try:
                 # Проверяем наличие IV и зашифрованного ключа
                 iv = request.POST.get('iv')
                 encrypted_aes_key = request.POST.get('encrypted_aes_key')
-                
+
                 if not iv:
+                    upload_handler.discard()
                     log_user_action(request.user, "Попытка загрузки зашифрованного файла", "Отсутствует IV")
                     return Response({'error': 'Отсутствует IV для шифрования'}, status=400)
                 if not encrypted_aes_key:
+                    upload_handler.discard()
                     log_user_action(request.user, "Попытка загрузки зашифрованного файла", "Отсутствует AES ключ")
                     return Response({'error': 'Отсутствует зашифрованный AES ключ'}, status=400)
-                
-                # Получаем или создаем ключи пользователя
-                user_keys, created = UserKeys.objects.get_or_create(user=request.user)
-                
-                # Если у пользователя нет ключей, генерируем новую пару
-                if not user_keys.rsa_public_key:
-                    key_pair = generate_rsa_key_pair()
-                    user_keys.rsa_public_key = key_pair['public_key']
-                    user_keys.rsa_private_key = key_pair['private_key']
-                    user_keys.save()
-                    log_user_action(request.user, "Сгенерирована новая пара RSA ключей")
-                
-                # Сохраняем зашифрованный файл
-                try:
-                    file_instance.file.save(unique_filename, ContentFile(file_content), save=False)
-                    file_instance.encrypted_aes_key = base64.b64decode(encrypted_aes_key)
-                    file_instance.iv = base64.b64decode(iv)
-                except Exception as e:
-                    log_user_action(request.user, "Ошибка при сохранении зашифрованного файла", str(e))
-                    return Response({
-                        'error': 'Ошибка при сохранении файла',
-                        'details': str(e)
-                    }, status=500)
-                
+
+                file_instance.encrypted_aes_key = base64.b64decode(encrypted_aes_key)
+                file_instance.iv = base64.b64decode(iv)
+
             except Exception as e:
+                upload_handler.discard()
                 log_user_action(request.user, "Ошибка при загрузке зашифрованного файла", str(e))
                 return Response({
                     'error': 'Ошибка шифрования',
                     'details': str(e)
                 }, status=500)
-        else:
-            # Сохраняем файл без шифрования
-            try:
-                file_instance.file.save(unique_filename, ContentFile(file_content), save=False)
-            except Exception as e:
-                log_user_action(request.user, "Ошибка при сохранении файла", str(e))
-                return Response({
-                    'error': 'Ошибка при сохранении файла',
-                    'details': str(e)
-                }, status=500)
-        
+
         # Сохраняем запись в базе данных
         try:
-            file_instance.save()
-            
-            # Проверяем, что файл действительно сохранен
-            if not os.path.exists(file_instance.file.path):
-                log_user_action(request.user, "Ошибка при сохранении файла", "Файл не найден после сохранения")
-                file_instance.delete()
-                return Response({
-                    'error': 'Ошибка при сохранении файла',
-                    'details': 'Файл не был сохранен на диск'
-                }, status=500)
-                
+            with atomic_blob_store() as moves:
+                # Занятое место учитывается в той же транзакции
+                charge_usage(request.user, file.size)
+                # Незашифрованное содержимое хранится один раз на SHA-256
+                if encryption_mode == ENCRYPTION_NONE:
+                    file_instance.blob = store_blob(file.storage_name, file.sha256, file.size, moves)
+                    file_instance.file.name = file_instance.blob.file.name
+                file_instance.save()
+        except QuotaExceeded:
+            upload_handler.discard()
+            log_user_action(request.user, "Попытка загрузки файла", "Превышена квота хранилища")
+            return Response({'error': 'Превышена квота хранилища'}, status=413)
         except Exception as e:
+            upload_handler.discard()
             log_user_action(request.user, "Ошибка при сохранении записи файла", str(e))
             return Response({
                 'error': 'Ошибка при сохранении записи файла',
                 'details': str(e)
             }, status=500)
-        
-        log_user_action(request.user, "Файл успешно загружен", f"Имя файла: {original_filename}, Размер: {file.size} байт, Шифрование: {'Да' if encrypt else 'Нет'}")
-        
+
+        log_user_action(request.user, "Файл успешно загружен", f"Имя файла: {original_filename}, Размер: {file.size} байт, Шифрование: {encryption_mode}", file_id=file_instance.id, bytes=file.size, duration=time.monotonic() - started)
+
         return Response({
             'message': 'Файл успешно загружен',
             'file_id': file_instance.id,
             'filename': original_filename,
-            'is_encrypted': encrypt
+            'is_encrypted': encrypt,
+            'encryption_mode': encryption_mode
         })
-        
+
     except Exception as e:
-        import traceback
-        log_user_action(request.user, "Ошибка при загрузке файла", f"{str(e)}\n{traceback.format_exc()}")
+        upload_handler.discard()
+        log_user_action(request.user, "Ошибка при загрузке файла", str(e), exc=e)
         return Response({
             'error': 'Ошибка загрузки файла',
             'details': str(e)
         }, status=500)
 
 
-# Функция получения списка файлов
+# Сессии загрузки по частям: создание сессии, параллельная загрузка частей
+# в произвольном порядке и финализация в EncryptedFile
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_session_create(request):
+    try:
+        filename = request.data.get('filename')
+        encrypt = str(request.data.get('encrypt', 'false')).lower() == 'true'
+        try:
+            size = int(request.data.get('size'))
+            chunk_size = int(request.data.get('chunk_size') or settings.FILE_UPLOAD_CHUNK_SIZE)
+        except (TypeError, ValueError):
+            log_user_action(request.user, "Попытка создания сессии загрузки", "Неверный размер файла или части")
+            return Response({'error': 'Неверный размер файла или части'}, status=400)
+
+        if not filename:
+            log_user_action(request.user, "Попытка создания сессии загрузки", "Не указано имя файла")
+            return Response({'error': 'Не указано имя файла'}, status=400)
+        if size < 0 or size > settings.FILE_UPLOAD_SESSION_MAX_SIZE:
+            log_user_action(request.user, "Попытка создания сессии загрузки", f"Недопустимый размер файла: {size} байт")
+            return Response({'error': 'Недопустимый размер файла'}, status=400)
+        if not settings.FILE_UPLOAD_MIN_CHUNK_SIZE <= chunk_size <= settings.FILE_UPLOAD_MAX_CHUNK_SIZE:
+            log_user_action(request.user, "Попытка создания сессии загрузки", f"Недопустимый размер части: {chunk_size} байт")
+            return Response({'error': 'Недопустимый размер части'}, status=400)
+
+        session = UploadSession(
+            user=request.user,
+            filename=os.path.basename(filename),
+            size=size,
+            chunk_size=chunk_size,
+            is_encrypted=encrypt,
+            expires_at=timezone.now() + settings.FILE_UPLOAD_SESSION_TTL
+        )
+
+        if encrypt:
+            iv = request.data.get('iv')
+            encrypted_aes_key = request.data.get('encrypted_aes_key')
+            if not iv:
+                log_user_action(request.user, "Попытка создания сессии загрузки", "Отсутствует IV")
+                return Response({'error': 'Отсутствует IV для шифрования'}, status=400)
+            if not encrypted_aes_key:
+                log_user_action(request.user, "Попытка создания сессии загрузки", "Отсутствует AES ключ")
+                return Response({'error': 'Отсутствует зашифрованный AES ключ'}, status=400)
+            session.iv = base64.b64decode(iv)
+            session.encrypted_aes_key = base64.b64decode(encrypted_aes_key)
+
+        # Части пишутся сразу в общий файл по своим смещениям
+        session.storage_name = f"{UPLOAD_SESSION_DIR}/{session.id}.part"
+        try:
+            with lock_usage(request.user):
+                # Незавершенные сессии уже занимают место на диске: их размер
+                # учитывается в квоте, а их число ограничено
+                active_sessions, reserved = active_upload_sessions(request.user)
+                if active_sessions >= settings.FILE_UPLOAD_MAX_ACTIVE_SESSIONS:
+                    log_user_action(request.user, "Попытка создания сессии загрузки", f"Незавершенных сессий: {active_sessions}")
+                    return Response({'error': 'Слишком много незавершенных загрузок'}, status=429)
+                quota_left = remaining_quota(request.user)
+                if quota_left is not None and size + reserved > quota_left:
+                    log_user_action(request.user, "Попытка создания сессии загрузки", "Превышена квота хранилища")
+                    return Response({'error': 'Превышена квота хранилища'}, status=413)
+                allocate_file(session.storage_name, size)
+                session.save()
+        except Exception:
+            delete_stored_file(session.storage_name)
+            raise
+
+        log_user_action(request.user, "Создана сессия загрузки", f"Имя файла: {session.filename}, Размер: {size} байт, Частей: {session.total_chunks}")
+        return Response(_upload_session_data(session, []), status=201)
+
+    except Exception as e:
+        log_user_action(request.user, "Ошибка при создании сессии загрузки", str(e))
+        return Response({
+            'error': 'Ошибка создания сессии загрузки',
+            'details': str(e)
+        }, status=500)
+
+
+@api_view(['GET', 'DELETE'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_session_detail(request, upload_id):
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+
+    # Отмена загрузки
+    if request.method == 'DELETE':
+        delete_stored_file(session.storage_name)
+        session.delete()
+        log_user_action(request.user, "Сессия загрузки отменена", f"Имя файла: {session.filename}")
+        return Response({'message': 'Сессия загрузки отменена'})
+
+    # Состояние загрузки: по списку принятых частей клиент докачивает недостающие
+    received = list(session.chunks.order_by('index').values_list('index', flat=True))
+    return Response(_upload_session_data(session, received))
+
+
+@api_view(['PUT'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_session_chunk(request, upload_id, index):
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+
+    if session.expires_at < timezone.now():
+        log_user_action(request.user, "Попытка загрузки части", f"Сессия {session.id} истекла")
+        return Response({'error': 'Сессия загрузки истекла'}, status=410)
+    if index < 0 or index >= session.total_chunks:
+        log_user_action(request.user, "Попытка загрузки части", f"Неверный номер части: {index}")
+        return Response({'error': 'Неверный номер части'}, status=400)
+
+    expected_length = session.chunk_length(index)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = -1
+    if content_length != expected_length:
+        log_user_action(request.user, "Попытка загрузки части", f"Часть {index}: ожидалось {expected_length} байт, получено {content_length}")
+        return Response({'error': f'Размер части должен быть {expected_length} байт'}, status=400)
+
+    try:
+        written = write_stream_at(
+            session.storage_name,
+            index * session.chunk_size,
+            request.stream,
+            expected_length
+        )
+        if written != expected_length:
+            log_user_action(request.user, "Ошибка при загрузке части", f"Часть {index} получена не полностью")
+            return Response({'error': 'Часть получена не полностью'}, status=400)
+
+        # Повторная загрузка той же части просто перезаписывает ее
+        UploadChunk.objects.update_or_create(
+            session=session, index=index, defaults={'size': written}
+        )
+        UploadSession.objects.filter(id=session.id).update(
+            expires_at=timezone.now() + settings.FILE_UPLOAD_SESSION_TTL
+        )
+    except Exception as e:
+        log_user_action(request.user, "Ошибка при загрузке части", str(e))
+        return Response({
+            'error': 'Ошибка загрузки части',
+            'details': str(e)
+        }, status=500)
+
+    return Response({'index': index, 'size': written})
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_session_complete(request, upload_id):
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+
+    received = session.chunks.count()
+    if received != session.total_chunks:
+        log_user_action(request.user, "Попытка завершения загрузки", f"Получено частей: {received} из {session.total_chunks}")
+        return Response({
+            'error': 'Загружены не все части файла',
+            'received_chunks': received,
+            'total_chunks': session.total_chunks
+        }, status=409)
+
+    # Файл сессии переименовывается в итоговый, без повторного копирования
+    storage_name = generate_storage_name(session.filename)
+    try:
+        move_stored_file(session.storage_name, storage_name)
+    except FileNotFoundError:
+        log_user_action(request.user, "Ошибка при завершении загрузки", f"Файл сессии {session.id} не найден")
+        return Response({'error': 'Файл сессии не найден'}, status=409)
+
+    try:
+        # Хеш считается до транзакции: на SQLite первая запись берет блокировку
+        # всей БД, и она не должна удерживаться, пока читается весь файл
+        sha256 = None if session.is_encrypted else hash_stored_file(storage_name)
+        with atomic_blob_store() as moves:
+            file_instance = EncryptedFile(
+                user=request.user,
+                filename=session.filename,
+                size=session.size,
+                is_encrypted=session.is_encrypted,
+                encryption_mode=ENCRYPTION_CLIENT if session.is_encrypted else ENCRYPTION_NONE,
+                encrypted_aes_key=session.encrypted_aes_key,
+                iv=session.iv
+            )
+            file_instance.file.name = storage_name
+            charge_usage(request.user, session.size)
+            # Незашифрованное содержимое хранится один раз на SHA-256
+            if not session.is_encrypted:
+                file_instance.sha256 = sha256
+                file_instance.blob = store_blob(storage_name, file_instance.sha256, session.size, moves)
+                file_instance.file.name = file_instance.blob.file.name
+            file_instance.save()
+            session.delete()
+    except QuotaExceeded:
+        # Сессия сохраняется: после освобождения места финализацию можно повторить
+        move_stored_file(storage_name, session.storage_name)
+        log_user_action(request.user, "Попытка завершения загрузки", "Превышена квота хранилища")
+        return Response({'error': 'Превышена квота хранилища'}, status=413)
+    except Exception as e:
+        delete_stored_file(storage_name)
+        log_user_action(request.user, "Ошибка при сохранении записи файла", str(e))
+        return Response({
+            'error': 'Ошибка при сохранении записи файла',
+            'details': str(e)
+        }, status=500)
+
+    log_user_action(request.user, "Файл успешно загружен", f"Имя файла: {session.filename}, Размер: {session.size} байт, Шифрование: {'Да' if session.is_encrypted else 'Нет'}, Частей: {received}", file_id=file_instance.id, bytes=session.size)
+
+    return Response({
+        'message': 'Файл успешно загружен',
+        'file_id': file_instance.id,
+        'filename': session.filename,
+        'is_encrypted': session.is_encrypted
+    })
+
+
+def _upload_session_data(session, received_chunks):
+    return {
+        'upload_id': str(session.id),
+        'filename': session.filename,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received_chunks': received_chunks,
+        'expires_at': session.expires_at.isoformat()
+    }
+
+
+# Функция получения списка файлов (фильтры, сортировка и постраничная выборка по курсору)
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def file_list(request):
-    files = EncryptedFile.objects.filter(user=request.user)
-    files_data = [{
-        'id': f.id, 
-        'filename': f.filename,
-        'size': f.size,
-        'is_encrypted': f.is_encrypted,
-        'uploaded_at': f.uploaded_at.strftime('%Y-%m-%d %H:%M:%S') if f.uploaded_at else None
-    } for f in files]
-    log_user_action(request.user, "Получен список файлов", f"Количество файлов: {len(files_data)}")
-    return Response({'files': files_data})
+    started = time.monotonic()
+    try:
+        limit = min(int(request.GET.get('limit', settings.FILE_LIST_PAGE_SIZE)), settings.FILE_LIST_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'Неверный размер страницы'}, status=400)
+    if limit < 1:
+        return Response({'error': 'Неверный размер страницы'}, status=400)
+
+    # Загружаются только отдаваемые колонки; ключи шифрования не читаются
+    files = EncryptedFile.objects.filter(user=request.user).values(
+        'id', 'filename', 'size', 'is_encrypted', 'encryption_mode', 'uploaded_at'
+    )
+    try:
+        files, sort_field, descending = filter_files(files, request.GET)
+        rows, next_cursor = paginate_keyset(files, sort_field, descending, request.GET.get('cursor'), limit)
+    except InvalidFilter as e:
+        return Response({'error': str(e)}, status=400)
+    except InvalidCursor:
+        return Response({'error': 'Неверный курсор страницы'}, status=400)
+
+    for row in rows:
+        row['uploaded_at'] = row['uploaded_at'].strftime('%Y-%m-%d %H:%M:%S') if row['uploaded_at'] else None
+    log_user_action(request.user, "Получен список файлов", f"Количество файлов: {len(rows)}", duration=time.monotonic() - started)
+    return Response({'files': rows, 'next_cursor': next_cursor})
+
+
+# Занятое пользователем место и квота
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def storage_usage(request):
+    usage = get_usage(request.user)
+    quota = effective_quota(usage)
+    return Response({
+        'bytes_used': usage.bytes_used,
+        'file_count': usage.file_count,
+        'quota_bytes': quota,
+        'bytes_available': max(quota - usage.bytes_used, 0) if quota is not None else None
+    })
 
 
 # Новый endpoint для получения метаданных зашифрованного файла
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def file_meta(request, file_id):
     file_instance = get_object_or_404(EncryptedFile, id=file_id, user=request.user)
@@ -190,17 +491,19 @@ def file_meta(request, file_id):
     if not file_instance.encrypted_aes_key or not file_instance.iv:
         log_user_action(request.user, "Попытка получения метаданных", f"Отсутствуют ключи шифрования для файла {file_instance.filename}")
         return Response({'error': 'Отсутствуют ключи шифрования'}, status=400)
-    log_user_action(request.user, "Получены метаданные файла", f"Файл: {file_instance.filename}")
+    log_user_action(request.user, "Получены метаданные файла", f"Файл: {file_instance.filename}", file_id=file_instance.id)
     return Response({
         'encrypted_aes_key': base64.b64encode(file_instance.encrypted_aes_key).decode('utf-8'),
         'iv': base64.b64encode(file_instance.iv).decode('utf-8'),
-        'filename': file_instance.filename
+        'filename': file_instance.filename,
+        'mime_type': mimetypes.guess_type(file_instance.filename)[0] or 'application/octet-stream',
+        'size': file_instance.size
     })
 
 
 # Исправленный endpoint скачивания файла
 @api_view(['GET', 'DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def file_download(request, file_id):
     try:
@@ -210,11 +513,9 @@ def file_download(request, file_id):
         if request.method == 'DELETE':
             try:
                 filename = file_instance.filename
-                # Проверяем существование файла
-                if file_instance.file and os.path.exists(file_instance.file.path):
-                    os.remove(file_instance.file.path)
-                file_instance.delete()
-                log_user_action(request.user, "Файл успешно удален", f"Файл: {filename}")
+                # Удаляем запись и файл (общее содержимое - с последней ссылкой)
+                delete_encrypted_file(file_instance)
+                log_user_action(request.user, "Файл успешно удален", f"Файл: {filename}", file_id=file_id)
                 return JsonResponse({'message': 'Файл успешно удален'})
             except Exception as e:
                 log_user_action(request.user, "Ошибка при удалении файла", str(e))
@@ -225,18 +526,11 @@ def file_download(request, file_id):
             log_user_action(request.user, "Попытка скачивания файла", f"Файл {file_id} не найден в базе данных")
             return JsonResponse({'error': 'Файл не найден в базе данных'}, status=404)
             
-        if not os.path.exists(file_instance.file.path):
+        if not os.path.exists(stored_file_path(file_instance.file.name)):
             log_user_action(request.user, "Попытка скачивания файла", f"Файл {file_id} не найден на диске")
-            file_instance.delete()
+            delete_encrypted_file(file_instance)
             return JsonResponse({'error': 'Файл не найден на сервере'}, status=404)
         
-        try:
-            with open(file_instance.file.path, 'rb') as f:
-                file_content = f.read()
-        except Exception as e:
-            log_user_action(request.user, "Ошибка при чтении файла", str(e))
-            return JsonResponse({'error': 'Ошибка при чтении файла'}, status=500)
-        
         # Если файл зашифрован и требуется расшифровка
         decrypt_requested = request.GET.get('decrypt', 'true').lower() == 'true'
         if file_instance.is_encrypted and decrypt_requested:
@@ -244,43 +538,186 @@ def file_download(request, file_id):
                 if not file_instance.encrypted_aes_key or not file_instance.iv:
                     log_user_action(request.user, "Попытка скачивания зашифрованного файла", "Отсутствуют ключи шифрования")
                     return JsonResponse({'error': 'Отсутствуют ключи шифрования'}, status=400)
-                
+
+                mime_type = mimetypes.guess_type(file_instance.filename)[0] or 'application/octet-stream'
+
+                # Бинарный режим: шифротекст отдается потоком как есть,
+                # а ключ, IV и тип файла передаются в заголовках
+                if request.GET.get('mode') == 'binary':
+                    response = serve_file(
+                        request,
+                        stored_file_path(file_instance.file.name),
+                        file_instance,
+                        'application/octet-stream',
+                        file_instance.filename
+                    )
+                    response['X-Encrypted-AES-Key'] = base64.b64encode(file_instance.encrypted_aes_key).decode('utf-8')
+                    response['X-Encryption-IV'] = base64.b64encode(file_instance.iv).decode('utf-8')
+                    response['X-File-Mime-Type'] = mime_type
+
+                    log_user_action(request.user, "Зашифрованный файл отправлен для расшифровки на клиенте", f"Файл: {file_instance.filename}, Размер: {file_instance.size} байт", file_id=file_id, bytes=file_instance.size)
+                    return response
+
+                try:
+                    with open(stored_file_path(file_instance.file.name), 'rb') as f:
+                        file_content = f.read()
+                except Exception as e:
+                    log_user_action(request.user, "Ошибка при чтении файла", str(e))
+                    return JsonResponse({'error': 'Ошибка при чтении файла'}, status=500)
+
                 # Возвращаем зашифрованный файл вместе с метаданными для расшифровки на клиенте
                 response_data = {
                     'encrypted_content': base64.b64encode(file_content).decode('utf-8'),
                     'encrypted_aes_key': base64.b64encode(file_instance.encrypted_aes_key).decode('utf-8'),
                     'iv': base64.b64encode(file_instance.iv).decode('utf-8'),
                     'filename': file_instance.filename,
-                    'mime_type': mimetypes.guess_type(file_instance.filename)[0] or 'application/octet-stream'
+                    'mime_type': mime_type
                 }
                 
-                log_user_action(request.user, "Файл подготовлен для расшифровки на клиенте", f"Файл: {file_instance.filename}")
+                log_user_action(request.user, "Файл подготовлен для расшифровки на клиенте", f"Файл: {file_instance.filename}", file_id=file_id, bytes=file_instance.size)
                 return JsonResponse(response_data)
                 
             except Exception as e:
-                import traceback
-                log_user_action(request.user, "Ошибка при подготовке зашифрованного файла", f"{str(e)}\n{traceback.format_exc()}")
+                log_user_action(request.user, "Ошибка при подготовке зашифрованного файла", str(e), exc=e)
                 return JsonResponse({'error': f'Ошибка подготовки файла: {str(e)}'}, status=500)
         else:
             # Возвращаем файл как есть (без расшифровки)
             mime_type, _ = mimetypes.guess_type(file_instance.filename)
             mime_type = mime_type or 'application/octet-stream'
             filename = smart_str(file_instance.filename)
-            
-            response = FileResponse(open(file_instance.file.path, 'rb'), as_attachment=True)
-            response['Content-Type'] = mime_type
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            log_user_action(request.user, "Файл успешно скачан", f"Файл: {file_instance.filename}, Размер: {len(file_content)} байт")
+
+            # Поддерживаются Range/If-Range и условные запросы (ETag/Last-Modified)
+            if file_instance.encryption_mode == ENCRYPTION_SERVER:
+                # Файл, зашифрованный на сервере, расшифровывается по мере отдачи
+                if get_pool().saturated:
+                    log_user_action(request.user, "Попытка скачивания файла", "Пул шифрования перегружен")
+                    return JsonResponse({'error': 'Сервер перегружен, повторите попытку позже'}, status=503, headers={'Retry-After': '5'})
+                response = serve_file(
+                    request,
+                    stored_file_path(file_instance.file.name),
+                    file_instance,
+                    mime_type,
+                    filename,
+                    read_range=decrypted_reader(file_instance),
+                    size=file_instance.size
+                )
+            else:
+                response = serve_file(request, stored_file_path(file_instance.file.name), file_instance, mime_type, filename)
+
+            log_user_action(request.user, "Файл успешно скачан", f"Файл: {file_instance.filename}, Размер: {file_instance.size} байт", file_id=file_id, bytes=file_instance.size)
             
             return response
             
     except Exception as e:
-        import traceback
-        log_user_action(request.user, "Ошибка при скачивании файла", f"{str(e)}\n{traceback.format_exc()}")
+        log_user_action(request.user, "Ошибка при скачивании файла", str(e), exc=e)
         return JsonResponse({'error': str(e)}, status=500)
 
 
+# Метрики пула шифрования (для администраторов)
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAdminUser])
+def crypto_pool_stats(request):
+    return Response(get_pool().stats())
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """Сборщик метрик передает METRICS_TOKEN в заголовке Authorization: Bearer"""
+
+    def authenticate(self, request):
+        token = settings.METRICS_TOKEN
+        if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return AnonymousUser(), 'metrics'
+        return None
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == 'metrics' or request.user.is_staff
+
+
+# Метрики всех процессов сервера в текстовом формате Prometheus
+# (для сборщика с METRICS_TOKEN или администраторов)
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, CachedJWTAuthentication])
+@permission_classes([CanReadMetrics])
+def metrics_export(request):
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Журнал аудита: события текущего пользователя (администратор может указать
+# user_id, а для всех пользователей - user_id=all вместе с фильтром action)
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def audit_events(request):
+    try:
+        limit = min(int(request.GET.get('limit', settings.AUDIT_LOG_PAGE_SIZE)), settings.AUDIT_LOG_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'Неверный размер страницы'}, status=400)
+    if limit < 1:
+        return Response({'error': 'Неверный размер страницы'}, status=400)
+
+    user_id = request.GET.get('user_id')
+    if user_id and not request.user.is_staff:
+        return Response({'error': 'Недостаточно прав'}, status=403)
+
+    events = AuditEvent.objects.all()
+    if user_id == 'all':
+        # Без пользователя выборка идет по индексу (action, timestamp, id)
+        if not request.GET.get('action'):
+            return Response({'error': 'Для всех пользователей укажите action'}, status=400)
+    elif user_id:
+        try:
+            events = events.filter(user_id=int(user_id))
+        except ValueError:
+            return Response({'error': 'Неверное значение параметра user_id'}, status=400)
+    else:
+        events = events.filter(user=request.user)
+
+    events = events.values('id', 'timestamp', 'user_id', 'action', 'file_id', 'bytes', 'duration_ms', 'message', 'details')
+    try:
+        events = filter_audit_events(events, request.GET)
+        rows, next_cursor = paginate_keyset(events, 'timestamp', True, request.GET.get('cursor'), limit)
+    except InvalidFilter as e:
+        return Response({'error': str(e)}, status=400)
+    except InvalidCursor:
+        return Response({'error': 'Неверный курсор страницы'}, status=400)
+
+    return Response({'events': rows, 'next_cursor': next_cursor})
+
+
+# Скачивание нескольких файлов одним ZIP архивом
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def file_archive(request):
+    file_ids = request.data.get('file_ids')
+    if not isinstance(file_ids, list) or not file_ids:
+        log_user_action(request.user, "Попытка скачивания архива", "Не указан список файлов")
+        return Response({'error': 'Не указан список файлов'}, status=400)
+    if len(file_ids) > settings.FILE_ARCHIVE_MAX_FILES:
+        log_user_action(request.user, "Попытка скачивания архива", f"Слишком много файлов: {len(file_ids)}")
+        return Response({'error': f'Можно выбрать не более {settings.FILE_ARCHIVE_MAX_FILES} файлов'}, status=400)
+    try:
+        file_ids = [int(file_id) for file_id in file_ids]
+    except (TypeError, ValueError):
+        log_user_action(request.user, "Попытка скачивания архива", "Неверный идентификатор файла")
+        return Response({'error': 'Неверный идентификатор файла'}, status=400)
+
+    # Все файлы выбираются одним запросом, порядок - как в запросе клиента
+    files_by_id = EncryptedFile.objects.filter(user=request.user, id__in=file_ids).in_bulk()
+    file_instances = [files_by_id[file_id] for file_id in dict.fromkeys(file_ids) if file_id in files_by_id]
+    if not file_instances:
+        log_user_action(request.user, "Попытка скачивания архива", "Файлы не найдены")
+        return Response({'error': 'Файлы не найдены'}, status=404)
+
+    response = StreamingHttpResponse(stream_zip(file_instances), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="files.zip"'
+    log_user_action(request.user, "Скачивание архива", f"Количество файлов: {len(file_instances)}", bytes=sum(f.size or 0 for f in file_instances))
+    return response
+
+
 # Очистка временных файлов после отправки
 def cleanup_temp_file(sender, **kwargs):
     if 'response' in kwargs and hasattr(kwargs['response'], '_file_to_clean'):
@@ -297,7 +734,7 @@ request_finished.connect(cleanup_temp_file)
 
 # Функция удаления файла
 @api_view(['DELETE'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def file_delete(request, file_id):
     try:
@@ -307,24 +744,21 @@ def file_delete(request, file_id):
         # Проверяем существование файла
         if not file_instance.file:
             log_user_action(request.user, "Попытка удаления файла", f"Файл {file_id} не найден в базе данных")
-            file_instance.delete()  # Удаляем запись из базы
+            delete_encrypted_file(file_instance)  # Удаляем запись из базы
             return JsonResponse({'message': 'Файл уже был удален'})
             
         # Проверяем существование файла на диске
-        if not os.path.exists(file_instance.file.path):
+        if not os.path.exists(stored_file_path(file_instance.file.name)):
             log_user_action(request.user, "Попытка удаления файла", f"Файл {file_id} не найден на диске")
-            file_instance.delete()  # Удаляем запись из базы
+            delete_encrypted_file(file_instance)  # Удаляем запись из базы
             return JsonResponse({'message': 'Файл уже был удален'})
         
         try:
-            # Удаляем физический файл
-            if os.path.exists(file_instance.file.path):
-                os.remove(file_instance.file.path)
-            
-            # Удаляем запись из базы данных
-            file_instance.delete()
+            # Удаляем запись из базы данных и физический файл
+            # (общее содержимое удаляется только с последней ссылкой)
+            delete_encrypted_file(file_instance)
             
-            log_user_action(request.user, "Файл успешно удален", f"Файл: {filename}")
+            log_user_action(request.user, "Файл успешно удален", f"Файл: {filename}", file_id=file_id)
             return JsonResponse({'message': 'Файл успешно удален'})
             
         except Exception as e:
@@ -344,7 +778,7 @@ def file_delete(request, file_id):
 
 # Получение публичного ключа для шифрования
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def update_public_key(request):
     try:
@@ -355,20 +789,36 @@ def update_public_key(request):
 
         # Получаем или создаем запись ключей пользователя
         user_keys, created = UserKeys.objects.get_or_create(user=request.user)
-        
-        # Обновляем публичный ключ
+        previous_key = bytes(user_keys.rsa_public_key) if user_keys.rsa_public_key else None
         try:
             # Проверяем, что ключ в формате base64
             if isinstance(public_key, str):
                 # Декодируем base64 для проверки
-                decoded_key = base64.b64decode(public_key)
-                user_keys.rsa_public_key = decoded_key
+                new_key = base64.b64decode(public_key)
             else:
-                user_keys.rsa_public_key = public_key.encode()
-            
+                new_key = public_key.encode()
+
+            # Обновляем публичный ключ; прежний ключ больше не нужен в кэше разобранных ключей
+            invalidate_cached_key(previous_key)
+            user_keys.rsa_public_key = new_key
             user_keys.save()
             log_user_action(request.user, "Обновлен публичный ключ")
-            return Response({'message': 'Публичный ключ успешно обновлен'})
+
+            # Ключи уже загруженных файлов зашифрованы прежним ключом: начинаем
+            # их перешифрование (выполняет клиент, см. key_rotation_batch).
+            # Незавершенная задача для предыдущего ключа при этом отменяется
+            rotation_job = KeyRotationJob.objects.filter(
+                user=request.user, mode=KeyRotationJob.MODE_CLIENT, status=KeyRotationJob.STATUS_RUNNING
+            ).first()
+            if previous_key and previous_key != new_key:
+                rotation_job, _ = start_client_rotation(request.user)
+                if rotation_job.status != KeyRotationJob.STATUS_RUNNING:
+                    rotation_job = None
+
+            return Response({
+                'message': 'Публичный ключ успешно обновлен',
+                'key_rotation_job': str(rotation_job.id) if rotation_job else None
+            })
         except Exception as e:
             log_user_action(request.user, "Ошибка при обработке публичного ключа", str(e))
             return Response({'error': 'Неверный формат публичного ключа'}, status=400)
@@ -378,7 +828,7 @@ def update_public_key(request):
         return Response({'error': str(e)}, status=500)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_public_key(request):
     try:
@@ -408,4 +858,76 @@ def get_public_key(request):
             
     except Exception as e:
         log_user_action(request.user, "Ошибка при получении публичного ключа", str(e))
-        return Response({'error': str(e)}, status=500)
\ No newline at end of file
+        return Response({'error': str(e)}, status=500)
+
+
+# Перешифрование ключей файлов после смены ключа пользователя: клиент
+# получает ключи файлов пачками, расшифровывает их прежним приватным
+# ключом и возвращает зашифрованными новым публичным ключом
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def key_rotation_create(request):
+    job, created = start_client_rotation(request.user)
+    if created:
+        log_user_action(request.user, "Начато перешифрование ключей файлов", f"Файлов: {job.total_files}")
+    return Response(job_progress(job), status=201 if created else 200)
+
+
+@api_view(['GET', 'DELETE'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def key_rotation_detail(request, job_id):
+    job = get_object_or_404(KeyRotationJob, id=job_id, user=request.user)
+
+    # Отмена: например, если у клиента нет закрытого ключа, которым обернуты ключи файлов
+    if request.method == 'DELETE':
+        if not cancel_job(job):
+            return Response({'error': 'Перешифрование уже завершено или отменено', **job_progress(job)}, status=409)
+        log_user_action(request.user, "Перешифрование ключей файлов отменено", f"Обработано: {job.processed_files}/{job.total_files}")
+    return Response(job_progress(job))
+
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def key_rotation_batch(request, job_id):
+    job = get_object_or_404(KeyRotationJob, id=job_id, user=request.user, mode=KeyRotationJob.MODE_CLIENT)
+
+    if request.method == 'GET':
+        # Следующая пачка файлов после курсора задачи
+        try:
+            limit = min(int(request.GET.get('limit', settings.FILE_KEY_ROTATION_BATCH_SIZE)), settings.FILE_KEY_ROTATION_MAX_BATCH_SIZE)
+        except ValueError:
+            return Response({'error': 'Неверный размер пачки'}, status=400)
+        if limit < 1:
+            return Response({'error': 'Неверный размер пачки'}, status=400)
+        rows = next_batch(job, limit) if job.status == KeyRotationJob.STATUS_RUNNING else []
+        return Response({
+            'files': [
+                {'file_id': row['id'], 'encrypted_aes_key': base64.b64encode(row['encrypted_aes_key']).decode('utf-8')}
+                for row in rows
+            ],
+            **job_progress(job)
+        })
+
+    keys = request.data.get('keys')
+    if not isinstance(keys, list) or not keys or len(keys) > settings.FILE_KEY_ROTATION_MAX_BATCH_SIZE:
+        log_user_action(request.user, "Попытка перешифрования ключей", "Неверный список ключей")
+        return Response({'error': 'Неверный список ключей'}, status=400)
+    try:
+        wrapped_keys = {int(item['file_id']): base64.b64decode(item['encrypted_aes_key'], validate=True) for item in keys}
+    except (KeyError, TypeError, ValueError):
+        log_user_action(request.user, "Попытка перешифрования ключей", "Неверный формат ключа")
+        return Response({'error': 'Неверный формат ключа'}, status=400)
+    if len(wrapped_keys) != len(keys) or not all(wrapped_keys.values()):
+        return Response({'error': 'Неверный список ключей'}, status=400)
+
+    try:
+        job = apply_client_batch(job, wrapped_keys)
+    except InvalidRotationBatch as e:
+        log_user_action(request.user, "Попытка перешифрования ключей", str(e))
+        return Response({'error': str(e), **job_progress(job)}, status=409)
+
+    log_user_action(request.user, "Перешифрованы ключи файлов", f"Файлов: {len(wrapped_keys)}, Обработано: {job.processed_files}/{job.total_files}")
+    return Response(job_progress(job))
@@ -62,6 +62,8 @@ const Home = () => {
   const [files, setFiles] = useState([]);
   const [filteredFiles, setFilteredFiles] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null); // Курсор следующей страницы списка файлов
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loadingFile, setLoadingFile] = useState(null); // ID файла, который скачивается
   const [deletingFile, setDeletingFile] = useState(null); // ID файла, который удаляется
   const [showUploadSection, setShowUploadSection] = useState(true);
@@ -259,32 +261,43 @@ const Home = () => {
     return accessToken;
   };
 
-  const fetchFiles = async () => {
-    setLoading(true);
+  // Загружает первую страницу списка; со следующими страницами (cursor)
+  // файлы дописываются к уже загруженным
+  const fetchFiles = async (cursor = null) => {
+    const setBusy = cursor ? setLoadingMore : setLoading;
+    setBusy(true);
     const token = await getAccessToken();
 
     if (!token) {
       showMessage('Не удалось авторизоваться. Пожалуйста, войдите снова.', 'error');
-      setLoading(false);
+      setBusy(false);
       return;
     }
 
     try {
-      const response = await fetch(`${backendUrl}/api/files/`, {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${backendUrl}/api/files/${query}`, {
         headers: {
           'Authorization': `Bearer ${token}`,
         },
       });
-      if (response.ok) {
-        const data = await response.json();
-        setFiles(data.files);
-      } else {
+      if (!response.ok) {
         showMessage('Не удалось загрузить файлы', 'error');
+        return;
       }
+      const data = await response.json();
+      setFiles(prevFiles => cursor ? prevFiles.concat(data.files) : data.files);
+      setNextCursor(data.next_cursor);
     } catch (err) {
       showMessage('Ошибка при загрузке файлов', 'error');
     } finally {
-      setLoading(false);
+      setBusy(false);
+    }
+  };
+
+  const loadMoreFiles = () => {
+    if (nextCursor && !loadingMore) {
+      fetchFiles(nextCursor);
     }
   };
 
@@ -301,7 +314,7 @@ const Home = () => {
             return;
         }
 
-        const url = `${backendUrl}/api/files/${fileId}/${isEncrypted ? '?decrypt=true' : ''}`;
+        const url = `${backendUrl}/api/files/${fileId}/${isEncrypted ? '?decrypt=true&mode=binary' : ''}`;
         const response = await fetch(url, {
             method: 'GET',
             headers: {
@@ -319,8 +332,10 @@ const Home = () => {
         }
 
         if (isEncrypted) {
-            // Обработка зашифрованного файла
-            const data = await response.json();
+            // Обработка зашифрованного файла: шифротекст приходит в теле ответа,
+            // ключ, IV и тип файла - в заголовках
+            const encryptedContent = await response.arrayBuffer();
+            const mimeType = response.headers.get('X-File-Mime-Type') || 'application/octet-stream';
             
             // Получаем приватный ключ из localStorage
             const privateKeyPem = localStorage.getItem('private_key');
@@ -332,19 +347,18 @@ const Home = () => {
             try {
                 // Расшифровываем AES ключ
                 const privateKey = await importPrivateKey(privateKeyPem);
-                const encryptedAesKey = base64ToArrayBuffer(data.encrypted_aes_key);
-                const iv = base64ToArrayBuffer(data.iv);
-                const encryptedContent = base64ToArrayBuffer(data.encrypted_content);
+                const encryptedAesKey = base64ToArrayBuffer(response.headers.get('X-Encrypted-AES-Key'));
+                const iv = base64ToArrayBuffer(response.headers.get('X-Encryption-IV'));
 
                 const aesKey = await decryptAesKey(encryptedAesKey, privateKey);
                 const decryptedContent = await decryptFileContent(encryptedContent, aesKey, iv);
 
                 // Создаем и скачиваем файл
-                const blob = new Blob([decryptedContent], { type: data.mime_type });
+                const blob = new Blob([decryptedContent], { type: mimeType });
                 const url = window.URL.createObjectURL(blob);
                 const a = document.createElement('a');
                 a.href = url;
-                a.download = data.filename;
+                a.download = filename;
                 document.body.appendChild(a);
                 a.click();
                 window.URL.revokeObjectURL(url);
@@ -682,7 +696,7 @@ const Home = () => {
             </button> */}
             
             <button
-              onClick={fetchFiles}
+              onClick={() => fetchFiles()}
               className="text-gray-600 dark:text-gray-300 hover:text-blue-600 dark:hover:text-blue-400 transition flex items-center"
               title="Обновить список файлов"
               disabled={loading}
@@ -1079,6 +1093,18 @@ const Home = () => {
                     </table>
                   </div>
                 )}
+
+                {!loading && nextCursor && (
+                  <div className="p-4 text-center border-t border-gray-200 dark:border-gray-700">
+                    <button
+                      onClick={loadMoreFiles}
+                      disabled={loadingMore}
+                      className="inline-flex items-center px-4 py-2 bg-blue-600 dark:bg-blue-700 text-white text-sm font-medium rounded-lg hover:bg-blue-700 dark:hover:bg-blue-600 transition disabled:bg-gray-400 dark:disabled:bg-gray-600"
+                    >
+                      {loadingMore ? 'Загрузка...' : 'Загрузить еще'}
+                    </button>
+                  </div>
+                )}
               </div>
             </div>
           </div>
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from .authentication import invalidate_cached_user
+
+        # Изменение, деактивация или удаление пользователя сбрасывает кэш аутентификации
+        post_save.connect(invalidate_cached_user, sender=get_user_model())
+        post_delete.connect(invalidate_cached_user, sender=get_user_model())
@@ -0,0 +1,144 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from files import metrics
+
+USER_CACHE_LOOKUPS = metrics.Counter(
+    'auth_user_cache_lookups_total', 'JWT user lookups by cache result', ('result',)
+)
+
+
+class _UserCache:
+    """
+    Кэш пользователей процесса по id: ограниченный LRU, запись живет
+    AUTH_USER_CACHE_TTL секунд. При AUTH_USER_CACHE_SHARED промах
+    локального кэша проверяется в кэше Django (CACHES) перед запросом к БД.
+    """
+
+    def __init__(self):
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+        # Растет при каждом сбросе: загруженный до сброса пользователь не кэшируется
+        self._generation = 0
+
+    def _shared_key(self, user_id):
+        return f'auth_user:{user_id}'
+
+    def get(self, user_id, loader):
+        """Возвращает копию пользователя; loader(user_id) загружает его из БД (None - не найден)"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._users.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return copy.copy(entry[1])
+            generation = self._generation
+
+        user = cache.get(self._shared_key(user_id)) if settings.AUTH_USER_CACHE_SHARED else None
+        if user is not None:
+            self._count('shared_hits')
+        else:
+            self._count('misses')
+            user = loader(user_id)
+            if user is None:
+                return None
+            if settings.AUTH_USER_CACHE_SHARED:
+                cache.set(self._shared_key(user_id), user, settings.AUTH_USER_CACHE_TTL)
+
+        with self._lock:
+            if generation != self._generation:
+                return copy.copy(user)
+            self._users[user_id] = (time.monotonic() + settings.AUTH_USER_CACHE_TTL, user)
+            self._users.move_to_end(user_id)
+            while len(self._users) > settings.AUTH_USER_CACHE_SIZE:
+                self._users.popitem(last=False)
+        # Каждый запрос получает свою копию: представления могут менять request.user
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._generation += 1
+            self._users.pop(user_id, None)
+        if settings.AUTH_USER_CACHE_SHARED:
+            cache.delete(self._shared_key(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'size': len(self._users), 'max_size': settings.AUTH_USER_CACHE_SIZE}
+
+
+_user_cache = _UserCache()
+
+
+def user_cache_stats():
+    return _user_cache.stats()
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Обработчик post_save/post_delete модели пользователя"""
+    _user_cache.invalidate(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+def _collect_user_cache():
+    stats = user_cache_stats()
+    USER_CACHE_LOOKUPS.set(stats['hits'], result='hit')
+    USER_CACHE_LOOKUPS.set(stats['shared_hits'], result='shared_hit')
+    USER_CACHE_LOOKUPS.set(stats['misses'], result='miss')
+
+
+metrics.register_collector(_collect_user_cache)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication, который берет пользователя из кэша вместо запроса
+    к БД на каждый запрос. Проверки активности и отзыва токена по смене
+    пароля выполняются как в JWTAuthentication. Изменение или удаление
+    пользователя сбрасывает кэш этого процесса (и общий кэш Django);
+    в других процессах запись устаревает не позже чем через TTL.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = _user_cache.get(str(user_id), self._load_user)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def _load_user(self, user_id):
+        try:
+            return self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            return None
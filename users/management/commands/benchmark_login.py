@@ -0,0 +1,94 @@
+import json
+import logging
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User as DjangoUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils.crypto import get_random_string
+from users.passwords import get_hashing_pool, hash_password
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks POST /api/users/login/: logins per second, latency and requests rejected by '
+        'the password hashing pool (503) for each number of concurrent clients'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Logins per thread count')
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16], help='Concurrent client counts')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or any(threads < 1 for threads in options['threads']):
+            raise CommandError('--requests and --threads must be positive')
+
+        username = f'benchmark-login-{get_random_string(8)}'
+        password = get_random_string(16)
+        user = DjangoUser.objects.create(username=username, password=hash_password(password))
+
+        logging.disable(logging.WARNING)
+        try:
+            results = [self._run(username, password, threads, options['requests']) for threads in options['threads']]
+        finally:
+            logging.disable(logging.NOTSET)
+            user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'pool_workers': get_hashing_pool().workers, 'results': results}, indent=2))
+            return
+
+        self.stdout.write(f"{'threads':>7} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'ok':>6} {'503':>6}")
+        for result in results:
+            self.stdout.write(
+                f"{result['threads']:>7} {result['logins_per_s']:>9.1f} {result['p50_ms']:>8.1f} "
+                f"{result['p95_ms']:>8.1f} {result['ok']:>6} {result['rejected']:>6}"
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark finished'))
+
+    def _run(self, username, password, threads, total):
+        latencies = []
+        statuses = []
+        lock = threading.Lock()
+        remaining = iter(range(total))
+        barrier = threading.Barrier(threads + 1)
+
+        def worker():
+            client = Client()
+            barrier.wait()
+            try:
+                while next(remaining, None) is not None:
+                    started = time.perf_counter()
+                    response = client.post(
+                        '/api/users/login/', {'username': username, 'password': password}, content_type='application/json'
+                    )
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                        statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        ok = statuses.count(200)
+        return {
+            'threads': threads,
+            'requests': total,
+            'ok': ok,
+            'rejected': statuses.count(503),
+            'logins_per_s': ok / wall,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        }
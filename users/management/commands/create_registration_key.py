@@ -1,20 +1,76 @@
-from django.core.management.base import BaseCommand
-from users.models import RegistrationKey
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from users.models import RegistrationKey, RegistrationKeyBatch
+
+DURATION_RE = re.compile(r'^(\d+)\s*([dhm]?)$', re.IGNORECASE)
+DURATION_UNITS = {'': 'days', 'd': 'days', 'h': 'hours', 'm': 'minutes'}
+
+
+def parse_duration(value):
+    match = DURATION_RE.match(value.strip())
+    if not match:
+        raise ValueError(f'Invalid duration: {value}')
+    return timedelta(**{DURATION_UNITS[match.group(2).lower()]: int(match.group(1))})
+
 
 class Command(BaseCommand):
-    help = 'Creates registration keys'
+    help = (
+        'Creates registration keys as one named batch with bulk inserts in a single transaction; '
+        'keys are streamed to stdout or to --output'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('--count', type=int, default=1, help='Number of keys to create')
+        parser.add_argument('--batch', help='Batch name (default: keys-<timestamp>)')
+        parser.add_argument('--expires-in', help='Batch lifetime, e.g. 30d, 12h or 90m (default: no expiry)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of keys inserted per query')
+        parser.add_argument('--output', help='Write keys to this file (one per line) instead of stdout')
 
     def handle(self, *args, **options):
         count = options['count']
-        created_keys = []
-        
-        for _ in range(count):
-            key = RegistrationKey.objects.create()
-            created_keys.append(str(key.key))
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully created {count} registration keys:'))
-        for key in created_keys:
-            self.stdout.write(key) 
\ No newline at end of file
+        if count < 1 or options['batch_size'] < 1:
+            raise CommandError('--count and --batch-size must be positive')
+        try:
+            lifetime = parse_duration(options['expires_in']) if options['expires_in'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        now = timezone.now()
+        name = options['batch'] or f"keys-{now.strftime('%Y%m%d-%H%M%S')}"
+        if RegistrationKeyBatch.objects.filter(name=name).exists():
+            raise CommandError(f'Batch "{name}" already exists')
+
+        # Ключи пишутся во временный файл, который заменяет --output только после
+        # фиксации транзакции: в файле не окажется ключей, которых нет в БД
+        output_path = options['output']
+        output = open(output_path + '.tmp', 'w') if output_path else self.stdout
+        try:
+            with transaction.atomic():
+                batch = RegistrationKeyBatch.objects.create(name=name, expires_at=now + lifetime if lifetime else None)
+                created = 0
+                while created < count:
+                    keys = [
+                        RegistrationKey(key=uuid.uuid4(), batch=batch)
+                        for _ in range(min(options['batch_size'], count - created))
+                    ]
+                    RegistrationKey.objects.bulk_create(keys)
+                    output.write(''.join(f'{key.key}\n' for key in keys))
+                    created += len(keys)
+            if output_path:
+                output.close()
+                os.replace(output_path + '.tmp', output_path)
+        except BaseException:
+            if output_path:
+                output.close()
+                os.remove(output_path + '.tmp')
+            raise
+
+        expiry = f', expires {batch.expires_at:%Y-%m-%d %H:%M}' if batch.expires_at else ''
+        destination = f' to {output_path}' if output_path else ''
+        self.stdout.write(self.style.SUCCESS(f'Successfully created {count} registration keys in batch "{name}"{expiry}{destination}'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from users.models import RegistrationKey, RegistrationKeyBatch
+
+class Command(BaseCommand):
+    help = 'Deletes unused keys of expired registration key batches (and used keys with --used), then empty expired batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--used', action='store_true', help='Also delete keys that were already used')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of keys deleted per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        now = timezone.now()
+        condition = Q(is_used=False, batch__expires_at__lte=now)
+        if options['used']:
+            condition |= Q(is_used=True)
+
+        deleted = 0
+        while True:
+            key_ids = list(RegistrationKey.objects.filter(condition).values_list('id', flat=True)[:batch_size])
+            if not key_ids:
+                break
+            RegistrationKey.objects.filter(id__in=key_ids).delete()
+            deleted += len(key_ids)
+
+        batches, _ = RegistrationKeyBatch.objects.filter(expires_at__lte=now, keys__isnull=True).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} registration keys and {batches} expired batches'))
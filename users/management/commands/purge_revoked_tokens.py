@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from users.models import RevokedToken
+
+class Command(BaseCommand):
+    help = 'Deletes revoked refresh tokens that have already expired (an expired token is rejected anyway)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of tokens deleted per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        now = timezone.now()
+        deleted = 0
+        while True:
+            token_ids = list(RevokedToken.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+            if not token_ids:
+                break
+            RevokedToken.objects.filter(id__in=token_ids).delete()
+            deleted += len(token_ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} expired revoked tokens'))
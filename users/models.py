@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
 class User(models.Model):
@@ -6,8 +7,22 @@ class User(models.Model):
     password = models.CharField(max_length=255)
     is_admin = models.BooleanField(default=False)
 
+class RegistrationKeyBatch(models.Model):
+    """Партия ключей регистрации, созданная одной командой create_registration_key"""
+    name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)  # None - без срока действия
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
 class RegistrationKey(models.Model):
     key = models.UUIDField(default=uuid.uuid4, unique=True)
+    batch = models.ForeignKey(RegistrationKeyBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='keys')
     is_used = models.BooleanField(default=False)
     used_at = models.DateTimeField(null=True, blank=True)
     used_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -16,3 +31,11 @@ class RegistrationKey(models.Model):
         return str(self.key)
 
 
+
+class RevokedToken(models.Model):
+    """Отозванный refresh токен по jti; запись нужна только до истечения токена (purge_revoked_tokens)"""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
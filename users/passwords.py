@@ -0,0 +1,85 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User as DjangoUser
+
+from files import metrics
+from files.crypto_pool import CryptoPool
+
+PASSWORD_CHECKS = metrics.Counter('auth_password_checks_total', 'Password verifications by result', ('result',))
+HASHING_IN_FLIGHT = metrics.Gauge('auth_password_hashing_in_flight', 'Password hashing tasks running or queued')
+HASHING_REJECTED = metrics.Counter('auth_password_hashing_rejected_total', 'Password hashing tasks rejected by admission control')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    """
+    Отдельный пул для хеширования и проверки паролей: PBKDF2 занимает
+    сотни миллисекунд процессора, и волна входов не должна занимать все
+    рабочие потоки сервера. hashlib отпускает GIL, поэтому потоки пула
+    работают параллельно.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CryptoPool(
+                    workers=settings.PASSWORD_HASHING_WORKERS,
+                    queue_depth=settings.PASSWORD_HASHING_QUEUE_DEPTH,
+                    timeout=settings.PASSWORD_HASHING_TIMEOUT,
+                    name='password-hashing'
+                )
+    return _pool
+
+
+def _collect_hashing_pool():
+    if _pool is not None:
+        stats = _pool.stats()
+        HASHING_IN_FLIGHT.set(stats['in_flight'])
+        HASHING_REJECTED.set(stats['rejected'])
+
+
+metrics.register_collector(_collect_hashing_pool)
+
+
+def _run(fn, *args):
+    """Выполняет fn в пуле; при переполнении очереди - CryptoPoolBusy"""
+    return get_hashing_pool().submit(fn, *args).result()
+
+
+def hash_password(password):
+    """Хеш пароля (make_password), вычисленный в пуле хеширования"""
+    return _run(make_password, password)
+
+
+def authenticate_user(username, password):
+    """
+    Проверяет логин и пароль пользователя Django (как ModelBackend) и
+    возвращает пользователя или None. Проверка пароля выполняется в пуле
+    хеширования; чтение и обновление пользователя - в потоке запроса.
+    """
+    if username is None or password is None:
+        return None
+    try:
+        user = DjangoUser._default_manager.get_by_natural_key(username)
+    except DjangoUser.DoesNotExist:
+        # Хешируем пароль и для несуществующего пользователя, чтобы время
+        # ответа не выдавало, существует ли он
+        _run(make_password, password)
+        PASSWORD_CHECKS.inc(result='unknown_user')
+        return None
+
+    needs_upgrade = []
+    if not _run(check_password, password, user.password, needs_upgrade.append) or not user.is_active:
+        PASSWORD_CHECKS.inc(result='failed')
+        return None
+
+    if needs_upgrade:
+        # Хеш создан устаревшим алгоритмом или с меньшим числом итераций
+        user.password = hash_password(password)
+        user.save(update_fields=['password'])
+    PASSWORD_CHECKS.inc(result='ok')
+    return user
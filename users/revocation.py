@@ -0,0 +1,136 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from files import metrics
+from .models import RevokedToken
+
+REVOCATION_CHECKS = metrics.Counter(
+    'auth_token_revocation_checks_total', 'Refresh token revocation checks by outcome', ('result',)
+)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума на bytearray: проверка "точно нет" за O(1) без обращения
+    к БД, ложноположительные ответы с вероятностью не больше error_rate
+    при заполнении до capacity.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного хеша
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationStore:
+    """
+    Отозванные refresh токены: таблица RevokedToken и фильтр Блума в памяти
+    процесса. Токен, которого нет в фильтре, точно не отозван; при
+    срабатывании фильтра jti проверяется в БД. Отзывы из других процессов
+    добавляются в фильтр не реже раза в TOKEN_REVOCATION_SYNC_INTERVAL
+    секунд, а фильтр пересобирается без истекших токенов раз в
+    TOKEN_REVOCATION_REBUILD_INTERVAL секунд или при переполнении.
+    Повторное использование токена при ротации дополнительно ловит
+    уникальность jti в таблице.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._last_id = 0
+        self._synced_at = 0.0
+        self._built_at = 0.0
+
+    def _rebuild(self):
+        revoked = RevokedToken.objects.filter(expires_at__gt=timezone.now())
+        count = revoked.count()
+        bloom = BloomFilter(max(settings.TOKEN_REVOCATION_BLOOM_CAPACITY, count * 2), settings.TOKEN_REVOCATION_BLOOM_ERROR_RATE)
+        last_id = 0
+        for token_id, jti in revoked.order_by('id').values_list('id', 'jti').iterator(chunk_size=10000):
+            bloom.add(jti)
+            last_id = token_id
+        # Учитываем и записи, истекшие к моменту пересборки, чтобы синхронизация не читала их снова
+        last_id = max(last_id, RevokedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0)
+        self._bloom, self._last_id = bloom, last_id
+        self._built_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        """Добавляет в фильтр отзывы, сделанные после последней синхронизации (в том числе другими процессами)"""
+        now = time.monotonic()
+        if self._bloom is None or now - self._built_at >= settings.TOKEN_REVOCATION_REBUILD_INTERVAL:
+            self._rebuild()
+            return
+        if now - self._synced_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+            return
+        for token_id, jti in RevokedToken.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'jti'):
+            self._bloom.add(jti)
+            self._last_id = token_id
+        self._synced_at = now
+        if self._bloom.count > self._bloom.capacity:
+            self._rebuild()
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self._sync()
+            maybe_revoked = jti in self._bloom
+        if not maybe_revoked:
+            REVOCATION_CHECKS.inc(result='bloom_negative')
+            return False
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        REVOCATION_CHECKS.inc(result='revoked' if revoked else 'false_positive')
+        return revoked
+
+    def revoke(self, jti, expires_at):
+        """Отзывает токен; False, если он уже был отозван (например, одновременным запросом)"""
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        return True
+
+    def stats(self):
+        with self._lock:
+            if self._bloom is None:
+                return {'entries': 0, 'capacity': 0, 'bytes': 0}
+            return {'entries': self._bloom.count, 'capacity': self._bloom.capacity, 'bytes': len(self._bloom._bits)}
+
+
+_store = RevocationStore()
+
+
+def is_token_revoked(jti):
+    return _store.is_revoked(jti)
+
+
+def revoke_token(jti, expires_at):
+    return _store.revoke(jti, expires_at)
+
+
+def revocation_stats():
+    return _store.stats()
@@ -2,6 +2,12 @@ from django.contrib.auth.models import User
 from rest_framework import serializers
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .revocation import is_token_revoked, revoke_token
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -31,3 +37,32 @@ class TokenObtainPairSerializer(serializers.Serializer):
             'refresh': str(refresh),
             'access': str(refresh.access_token),
         }
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление токена с проверкой и отзывом refresh токенов через
+    users.revocation (вместо приложения token_blacklist): отозванный или
+    уже использованный при ротации токен отклоняется.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        jti = refresh[api_settings.JTI_CLAIM]
+        if is_token_revoked(jti):
+            raise TokenError(_("Token is blacklisted"))
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                # Уникальность jti не дает использовать один токен в двух одновременных запросах
+                if not revoke_token(jti, datetime_from_epoch(refresh['exp'])):
+                    raise TokenError(_("Token is blacklisted"))
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        return data
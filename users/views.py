@@ -1,14 +1,14 @@
 from django.shortcuts import render
 from django.contrib.auth.models import User as DjangoUser
-from django.contrib.auth.hashers import make_password
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.http import JsonResponse
-from django.contrib.auth import authenticate
 from django.utils import timezone
 from django.db import IntegrityError
 from .models import RegistrationKey, User
+from files.crypto_pool import CryptoPoolBusy
+from .passwords import authenticate_user, hash_password
 
 import json
 
@@ -33,21 +33,26 @@ def register(request):
             return Response({'error': 'Пользователь с таким именем уже существует'}, status=400)
 
         try:
-            key = RegistrationKey.objects.get(key=registration_key, is_used=False)
+            key = RegistrationKey.objects.select_related('batch').get(key=registration_key, is_used=False)
         except RegistrationKey.DoesNotExist:
             return Response({'error': 'Недействительный или уже использованный ключ регистрации'}, status=400)
+        if key.batch is not None and key.batch.is_expired:
+            return Response({'error': 'Срок действия ключа регистрации истек'}, status=400)
+
+        # Хеш вычисляется один раз и сохраняется в обе записи пользователя
+        password_hash = hash_password(password)
 
         # Создаём нового пользователя
         user = User.objects.create(
             username=username,
-            password=make_password(password)
+            password=password_hash
         )
         user.save()
 
         # Создаем пользователя Django для аутентификации
         django_user = DjangoUser.objects.create(
             username=username,
-            password=make_password(password)
+            password=password_hash
         )
         django_user.save()
 
@@ -58,6 +63,8 @@ def register(request):
         key.save()
 
         return Response({'message': 'Пользователь успешно создан'}, status=201)
+    except CryptoPoolBusy:
+        return Response({'error': 'Сервер перегружен, повторите попытку позже'}, status=503, headers={'Retry-After': '5'})
     except IntegrityError:
         return Response({'error': 'Пользователь с таким именем уже существует'}, status=400)
     except Exception as e:
@@ -70,7 +77,12 @@ def login(request):
         username = request.data.get('username')
         password = request.data.get('password')
 
-        user = authenticate(request, username=username, password=password)
+        # Пароль проверяется в ограниченном пуле хеширования: при его
+        # переполнении вход сразу отклоняется, не занимая рабочие потоки
+        try:
+            user = authenticate_user(username, password)
+        except CryptoPoolBusy:
+            return Response({'error': 'Сервер перегружен, повторите попытку позже'}, status=503, headers={'Retry-After': '5'})
 
         if user is not None:
             refresh = RefreshToken.for_user(user)